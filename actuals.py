@@ -0,0 +1,162 @@
+import operator
+import numpy as np
+import categories
+
+# Groups every transaction in the log by (year, month, category) in one pass and
+# keeps the sums in a single array, which Year_Chart reads to fill its "Actual"
+# columns. Money in and money out are separate categories even when they share a
+# name ("Misc"), the direction comes from the sign of the amount.
+class Monthly_Actuals:
+    years = []
+    categories = []
+    sums = None
+    sectionSums = None
+    codes = {}
+
+    def __init__(self, years, categories, sums):
+        self.years = years
+        self.categories = categories
+        self.sums = sums
+
+        # Column 0 is money in, column 1 is money out, per (year, month).
+        isOut = np.array([out for name, out in categories], dtype=bool)
+        self.sectionSums = np.stack([sums[:, :, ~isOut].sum(axis=2), sums[:, :, isOut].sum(axis=2)], axis=2)
+        self.codes = {}
+        for code in range(len(categories)):
+            self.codes[categories[code]] = code
+
+    # Twelve monthly sums for one category in one year, out categories as positive
+    # amounts spent.
+    def category_months(self, year, name, out):
+        if (year not in self.years or (name, out) not in self.codes):
+            return np.zeros(12)
+        return self.sums[self.years.index(year), :, self.codes[(name, out)]]
+
+    def section_months(self, year, out):
+        if (year not in self.years):
+            return np.zeros(12)
+        return self.sectionSums[self.years.index(year), :, int(out)]
+
+
+# Live (year, month, category) sums kept by Log. Each add, edit or delete adjusts
+# one category cell and one section cell, so nothing is regrouped after a change.
+# Reads the same way as Monthly_Actuals, so Year_Chart can fill from either.
+class Running_Totals:
+    categorySums = {}
+    sectionSums = {}
+
+    def __init__(self, actuals):
+        self.categorySums = {}
+        self.sectionSums = {}
+        years, months, codes = np.nonzero(actuals.sums)
+        for i in range(len(years)):
+            name, out = actuals.categories[codes[i]]
+            self.categorySums[(actuals.years[years[i]], int(months[i]), name, out)] = float(actuals.sums[years[i], months[i], codes[i]])
+        years, months, sections = np.nonzero(actuals.sectionSums)
+        for i in range(len(years)):
+            self.sectionSums[(actuals.years[years[i]], int(months[i]), bool(sections[i]))] = float(actuals.sectionSums[years[i], months[i], sections[i]])
+
+    # sign is 1 when the transaction is added to the log and -1 when it's removed.
+    # A Log row with a blank amount adds nothing, here and in compute_actuals.
+    def apply(self, transaction, sign):
+        if (transaction.amount == None):
+            return
+        out = transaction.amount < 0
+        value = abs(transaction.amount) * sign
+        categoryKey = (transaction.date.year, transaction.date.month - 1, transaction.category, out)
+        sectionKey = (transaction.date.year, transaction.date.month - 1, out)
+        self.categorySums[categoryKey] = self.categorySums.get(categoryKey, 0.0) + value
+        self.sectionSums[sectionKey] = self.sectionSums.get(sectionKey, 0.0) + value
+
+    # Moves a category's sums under another name, adding them to any it already has,
+    # which is a merge when newName is in use.
+    def rename_category(self, oldName, newName):
+        for key in [key for key in self.categorySums if key[2] == oldName]:
+            value = self.categorySums.pop(key)
+            newKey = (key[0], key[1], newName, key[3])
+            self.categorySums[newKey] = self.categorySums.get(newKey, 0.0) + value
+
+    def category_months(self, year, name, out):
+        return np.array([self.categorySums.get((year, month, name, out), 0.0) for month in range(12)])
+
+    def section_months(self, year, out):
+        return np.array([self.sectionSums.get((year, month, out), 0.0) for month in range(12)])
+
+    # Compares the live sums with a full regroup of the log. Returns the keys that
+    # disagree, empty when they match.
+    def check(self, log, tolerance = 0.005):
+        log.transactionIndex.columnCache = None
+        actuals = log_actuals(log)
+        fresh = Running_Totals(actuals)
+        mismatches = []
+        for key in set(self.categorySums) | set(fresh.categorySums):
+            if (abs(self.categorySums.get(key, 0.0) - fresh.categorySums.get(key, 0.0)) > tolerance):
+                mismatches.append(key)
+        for key in set(self.sectionSums) | set(fresh.sectionSums):
+            if (abs(self.sectionSums.get(key, 0.0) - fresh.sectionSums.get(key, 0.0)) > tolerance):
+                mismatches.append(key)
+        return mismatches
+
+
+# Column arrays for the whole log, cached on the index until it next changes. The
+# category column holds the codes the transactions were stored with, which a rename
+# or merge doesn't change, so the cache outlives them.
+def transaction_columns(transactionIndex):
+    if (transactionIndex.columnCache != None):
+        return transactionIndex.columnCache
+
+    transactions = transactionIndex.transactions
+    dates = list(map(operator.attrgetter("date"), transactions))
+    amounts = np.array(list(map(operator.attrgetter("amount"), transactions)), dtype=np.float64)
+    categoryCodes = np.fromiter(map(operator.attrgetter("categoryCode"), transactions), dtype=np.int64, count=len(transactions))
+
+    # Rows on the same day share a datetime, so the month and day keys are worked out
+    # once per day.
+    monthOf = {}
+    dayOf = {}
+    for date in dates:
+        if (date not in monthOf):
+            monthOf[date] = date.year * 12 + date.month - 1
+            dayOf[date] = date.toordinal()
+    monthKeys = np.fromiter(map(monthOf.__getitem__, dates), dtype=np.int64, count=len(dates))
+    days = np.fromiter(map(dayOf.__getitem__, dates), dtype=np.int64, count=len(dates))
+
+    transactionIndex.columnCache = {"monthKeys": monthKeys, "days": days, "amounts": amounts, "categoryCodes": categoryCodes}
+    return transactionIndex.columnCache
+
+
+# names[code] is the category each code in nameCodes stands for.
+def compute_actuals(monthKeys, amounts, nameCodes, names):
+    if (len(amounts) == 0):
+        return Monthly_Actuals([], [], np.zeros((0, 12, 0)))
+
+    amounts = np.nan_to_num(amounts)
+    isOut = amounts < 0
+    codes = nameCodes * 2 + isOut
+
+    firstYear = int(monthKeys.min()) // 12
+    yearCount = int(monthKeys.max()) // 12 - firstYear + 1
+    categoryCount = len(names) * 2
+    keys = (monthKeys - firstYear * 12) * categoryCount + codes
+
+    sums = np.bincount(keys, weights=np.abs(amounts), minlength=yearCount * 12 * categoryCount)
+    sums = sums.reshape(yearCount, 12, categoryCount)
+
+    categoryList = []
+    for code in range(categoryCount):
+        categoryList.append((names[code // 2], code % 2 == 1))
+    return Monthly_Actuals(list(range(firstYear, firstYear + yearCount)), categoryList, sums)
+
+
+# The stored codes are mapped onto the ones they read as now, so renamed and merged
+# categories group together. Codes merged away are left without a name.
+def log_actuals(log):
+    columns = transaction_columns(log.transactionIndex)
+    registry = categories.registry
+    names = []
+    for code in range(len(registry.names)):
+        if (registry.canonical[code] == code):
+            names.append(registry.names[code])
+        else:
+            names.append(None)
+    return compute_actuals(columns["monthKeys"], columns["amounts"], registry.remap(columns["categoryCodes"]), names)
@@ -0,0 +1,228 @@
+import datetime
+import numpy as np
+import global_func as gf
+import categories
+from actuals import transaction_columns
+import instrument
+
+# Trend numbers for the main window: moving spend over the last 30 and 90 days,
+# month over month change and the running balance, per category or overall.
+#
+# Amounts are summed per day into a Fenwick tree (a prefix sum that can be updated
+# in place) for each category code and direction, plus one for all money in and
+# one for all money out. The sum over any run of days is the difference of two
+# prefix sums, and adding or removing a transaction updates one tree row per
+# direction, both in O(log days) with no rescan of the log. Log applies every
+# change to it the same way it does to its Running_Totals.
+#
+# The trees cover from January of the log's first year to the end of next year. A
+# change outside that, or in a category newer than the trees, marks them stale and
+# they're rebuilt on the next query: day sums with one bincount over the log's
+# column arrays, then every tree node from a cumulative sum, all as array
+# operations. They're also only built on the first query, so loading doesn't wait.
+#
+# Trees are kept per category code as stored, so a renamed or merged category's
+# codes are added up at query time and a rename or merge changes nothing here.
+class Rolling_Analytics:
+    transactionIndex = None
+    trees = None
+    firstDay = 0
+    dayCount = 0
+    stale = True
+
+    # Spare rows for categories added after a rebuild.
+    spareCodes = 8
+
+    def __init__(self, transactionIndex):
+        self.transactionIndex = transactionIndex
+        self.trees = None
+        self.firstDay = 0
+        self.dayCount = 0
+        self.stale = True
+
+    # Rows 0 and 1 are all money in and all money out.
+    def row(self, code, out):
+        return 2 + code * 2 + int(out)
+
+    @instrument.timed()
+    def rebuild(self):
+        columns = transaction_columns(self.transactionIndex)
+        days = columns["days"]
+        amounts = np.nan_to_num(columns["amounts"])
+        codes = columns["categoryCodes"]
+
+        firstYear = gf.curYear
+        lastYear = gf.curYear
+        if (len(days) > 0):
+            firstYear = min(firstYear, datetime.date.fromordinal(int(days.min())).year)
+            lastYear = max(lastYear, datetime.date.fromordinal(int(days.max())).year)
+        self.firstDay = datetime.date(firstYear, 1, 1).toordinal()
+        self.dayCount = datetime.date(lastYear + 2, 1, 1).toordinal() - self.firstDay
+        rowCount = self.row(len(categories.registry.names) + self.spareCodes, False)
+
+        isOut = (amounts < 0).astype(np.int64)
+        values = np.abs(amounts)
+        dayIndex = days - self.firstDay
+        sums = np.bincount((2 + codes * 2 + isOut) * self.dayCount + dayIndex, weights=values, minlength=rowCount * self.dayCount)
+        sums = sums.reshape(rowCount, self.dayCount)
+        sums[0:2] = np.bincount(isOut * self.dayCount + dayIndex, weights=values, minlength=2 * self.dayCount).reshape(2, self.dayCount)
+
+        # Node i of a Fenwick tree holds the sum of the lowbit(i) days ending at day i.
+        prefix = np.zeros((rowCount, self.dayCount + 1))
+        np.cumsum(sums, axis=1, out=prefix[:, 1:])
+        nodes = np.arange(1, self.dayCount + 1)
+        self.trees = np.zeros((rowCount, self.dayCount + 1))
+        self.trees[:, 1:] = prefix[:, nodes] - prefix[:, nodes - (nodes & -nodes)]
+        self.stale = False
+
+    # sign is 1 when the transaction is added to the log and -1 when it's removed.
+    def apply(self, transaction, sign):
+        if (self.stale or transaction.amount == None):
+            return
+        out = transaction.amount < 0
+        day = transaction.date.toordinal() - self.firstDay
+        row = self.row(transaction.categoryCode, out)
+        if (day < 0 or day >= self.dayCount or row >= len(self.trees)):
+            self.stale = True
+            return
+        rows = [int(out), row]
+        value = abs(transaction.amount) * sign
+        i = day + 1
+        while (i <= self.dayCount):
+            self.trees[rows, i] += value
+            i = i + (i & -i)
+
+    # Sum of rows over every day up to and including day (an ordinal).
+    def prefix(self, rows, day):
+        i = min(max(day - self.firstDay + 1, 0), self.dayCount)
+        nodes = []
+        while (i > 0):
+            nodes.append(i)
+            i = i - (i & -i)
+        if (len(rows) == 0 or len(nodes) == 0):
+            return 0.0
+        return float(self.trees[np.ix_(rows, nodes)].sum())
+
+    # The tree rows for a category, every code that reads as it; None is the whole
+    # direction.
+    def category_rows(self, name, out):
+        if (name == None):
+            return [int(out)]
+        registry = categories.registry
+        if (name not in registry.codes):
+            return []
+        target = registry.canonical[registry.codes[name]]
+        rows = []
+        for code in range(len(registry.canonical)):
+            if (registry.canonical[code] == target and self.row(code, out) < len(self.trees)):
+                rows.append(self.row(code, out))
+        return rows
+
+    def range_sum(self, rows, firstDay, lastDay):
+        return self.prefix(rows, lastDay) - self.prefix(rows, firstDay - 1)
+
+    # Amount in or out over the days days ending with end (inclusive).
+    @instrument.timed()
+    def window_sum(self, name, out, end, days):
+        if (self.stale):
+            self.rebuild()
+        lastDay = gf.to_datetime(end).toordinal()
+        return self.range_sum(self.category_rows(name, out), lastDay - days + 1, lastDay)
+
+    # Average per day over the window, the burn rate for money out.
+    def daily_rate(self, name, out, end, days):
+        return self.window_sum(name, out, end, days) / days
+
+    def month_sum(self, name, out, year, month):
+        if (self.stale):
+            self.rebuild()
+        firstDay = datetime.date(year, month, 1).toordinal()
+        nextMonth = datetime.date(year + month // 12, month % 12 + 1, 1).toordinal()
+        return self.range_sum(self.category_rows(name, out), firstDay, nextMonth - 1)
+
+    # (this month, last month, change) as of date: this month up to date against
+    # last month up to the same day, so a month in progress is compared like for like.
+    def month_change(self, name, out, date):
+        if (self.stale):
+            self.rebuild()
+        date = gf.to_datetime(date)
+        rows = self.category_rows(name, out)
+        thisMonth = self.range_sum(rows, datetime.date(date.year, date.month, 1).toordinal(), date.toordinal())
+        lastYear = date.year
+        lastMonthInt = date.month - 1
+        if (lastMonthInt == 0):
+            lastYear = date.year - 1
+            lastMonthInt = 12
+        lastFirst = datetime.date(lastYear, lastMonthInt, 1)
+        lastEnd = min(lastFirst.toordinal() + date.day - 1, datetime.date(date.year, date.month, 1).toordinal() - 1)
+        lastMonth = self.range_sum(rows, lastFirst.toordinal(), lastEnd)
+        return thisMonth, lastMonth, thisMonth - lastMonth
+
+    # Everything in minus everything out up to the end of date.
+    def balance(self, date):
+        if (self.stale):
+            self.rebuild()
+        day = gf.to_datetime(date).toordinal()
+        return self.prefix([0], day) - self.prefix([1], day)
+
+    def balance_curve(self, dates):
+        return np.array([self.balance(date) for date in dates])
+
+    # Rows for the window's trend panel as of date: each out category, then the
+    # totals and the balance, as (Category, 30 days, 90 days, This month, Last
+    # month, Change).
+    @instrument.timed()
+    def summary_rows(self, date):
+        date = gf.to_datetime(date)
+        rows = []
+        sections = [(name, True) for name in gf.categoriesOut] + [(None, True), (None, False)]
+        for name, out in sections:
+            label = name
+            if (name == None and out):
+                label = "Total Out"
+            elif (name == None):
+                label = "Total In"
+            thisMonth, lastMonth, change = self.month_change(name, out, date)
+            rows.append((label, round(self.window_sum(name, out, date, 30), 2), round(self.window_sum(name, out, date, 90), 2),
+                         round(thisMonth, 2), round(lastMonth, 2), round(change, 2)))
+
+        balance = self.balance(date)
+        lastBalance = self.balance(datetime.datetime(date.year, date.month, 1) - datetime.timedelta(days=1))
+        rows.append(("Balance", "", "", round(balance, 2), round(lastBalance, 2), round(balance - lastBalance, 2)))
+        return rows
+
+    # Every tree's per-day sums, read back out of its nodes: a prefix sum is a node
+    # plus the prefix sum lowbit(i) days before it, so prefixes are filled in one
+    # array operation per bit count, then differenced.
+    def day_sums(self):
+        nodes = np.arange(self.dayCount + 1)
+        parents = nodes - (nodes & -nodes)
+        bitCounts = np.array([bin(node).count("1") for node in range(self.dayCount + 1)])
+        prefix = np.zeros(self.trees.shape)
+        for bitCount in range(1, int(bitCounts.max()) + 1):
+            level = nodes[bitCounts == bitCount]
+            prefix[:, level] = self.trees[:, level] + prefix[:, parents[level]]
+        return np.diff(prefix, axis=1)
+
+    # Compares every tree's per-day sums with ones added up from the transactions
+    # themselves, building the trees first if they're stale. Returns the (row, date)
+    # pairs that disagree, empty when they match.
+    def check(self, tolerance = 0.005):
+        if (self.stale):
+            self.rebuild()
+        expected = np.zeros((len(self.trees), self.dayCount))
+        mismatches = []
+        for transaction in self.transactionIndex.transactions:
+            if (transaction.amount == None):
+                continue
+            out = transaction.amount < 0
+            day = transaction.date.toordinal() - self.firstDay
+            row = self.row(transaction.categoryCode, out)
+            if (day < 0 or day >= self.dayCount or row >= len(self.trees)):
+                mismatches.append((row, transaction.date.date()))
+                continue
+            expected[int(out), day] = expected[int(out), day] + abs(transaction.amount)
+            expected[row, day] = expected[row, day] + abs(transaction.amount)
+        for row, day in np.argwhere(np.abs(self.day_sums() - expected) > tolerance):
+            mismatches.append((int(row), datetime.date.fromordinal(self.firstDay + int(day))))
+        return mismatches
@@ -1,12 +1,13 @@
-import pandas as pd
-import openpyxl as opxl
+import time
+startTime = time.perf_counter()
+
+import os
+import sys
 import tkinter as tk
+from tkinter import filedialog
 import datetime
-import json
 import global_func as gf
-from year_chart import Year_Chart
-from excel_manager import Excel_Manager
-from log import Log
+import instrument
 
 # Optional: GUI Opens asking which file to open.
 # Load the log in tracker.
@@ -31,15 +32,22 @@ from log import Log
 
 path = "./Tracker.xlsx"
 
-excelManager = Excel_Manager(path)
-
-log = Log(excelManager)
-
-gf.check_years(excelManager)
-
-currentYear = Year_Chart(excelManager=excelManager, log=log, year=gf.today.year)
-if (str(currentYear.year) not in excelManager.workbook.sheetnames):
-    currentYear.create_chart()
+# BUDGET_STARTUP_PROBE=first exits as soon as the window is up and =ready once
+# everything has loaded, printing the time taken; the benchmark suite uses it.
+startupProbe = os.environ.get("BUDGET_STARTUP_PROBE", "")
+
+def startup_time(name):
+    seconds = time.perf_counter() - startTime
+    if (instrument.enabled):
+        instrument.record("startup." + name, seconds)
+    if (startupProbe != ""):
+        print("Startup " + name + ": " + str(round(seconds, 3)) + "s")
+    if (startupProbe == name):
+        if ("excelManager" in globals()):
+            excelManager.persistence.close()
+            excelManager.storage.close()
+        window.destroy()
+        sys.exit(0)
 
 # Main window configuration //
 window = tk.Tk()
@@ -57,11 +65,71 @@ gf.setupScreenSize(window)
 
 # \\
 
+# The window comes up first with a progress line, then settings, the heavy modules
+# (openpyxl, numpy) and the workbook are loaded behind it. //
+loadingTrace = tk.StringVar(value="Loading...")
+loadingLabel = gf.create_widget(window, tk.Label, textvariable=loadingTrace)
+loadingLabel.grid(row=1, column=1)
+window.update()
+startup_time("first")
+
+def show_progress(text):
+    loadingTrace.set(text)
+    window.update()
+
+show_progress("Loading settings...")
+gf.load_settings()
+
+show_progress("Loading modules...")
+from year_chart import Year_Chart, fill_year_charts, fill_year_expectations, update_year_charts, update_chart_categories
+from excel_manager import Excel_Manager
+from log import Log
+from importer import Statement_Importer
+from virtual_view import Virtual_View
+import categories
+
+show_progress("Loading " + path + "...")
+excelManager = Excel_Manager(path)
+
+show_progress("Loading log...")
+log = Log(excelManager)
+
+show_progress("Building charts...")
+gf.check_years(excelManager)
+
+currentYear = Year_Chart(excelManager=excelManager, log=log, year=gf.today.year)
+if (not excelManager.has_sheet(str(currentYear.year))):
+    currentYear.create_chart()
+
+fill_year_charts(excelManager, log)
+fill_year_expectations(excelManager)
+
+def refresh_actuals(oldTransaction, newTransaction):
+    for transaction in (oldTransaction, newTransaction):
+        if (transaction != None):
+            update_year_charts(excelManager, log, transaction, save=True)
+            currentYear.refresh_chart(transaction.date.year)
+    refresh_trends()
+
+log.changeListeners.append(refresh_actuals)
+
+def refresh_imported(transactions):
+    fill_year_charts(excelManager, log, save=True)
+    currentYear.refresh_chart()
+    refresh_trends()
+
+log.bulkListeners.append(refresh_imported)
+
+loadingLabel.destroy()
+
+# \\
+
 # Set up frames in the main window: //
 leftFrame = gf.create_widget(window, tk.Frame)
 leftFrame.grid(row=1, column=0, pady=10)
 leftFrame.rowconfigure(0, weight=1)
 leftFrame.rowconfigure(1, weight=1)
+leftFrame.rowconfigure(2, weight=1)
 
 rightFrame = gf.create_widget(window, tk.Frame)
 rightFrame.grid(row=1, column=2, pady=10)
@@ -80,22 +148,96 @@ middleFrame.rowconfigure(2, weight=1)
 addTButton = gf.create_widget(rightFrame, tk.Button, text="Add Transaction", command= lambda: gf.prompt_for_transaction(window, path, log, False))
 addTButton.grid(row=0, pady=10)
 
-editEButton = gf.create_widget(rightFrame, tk.Button, text="Edit Expectations", command=lambda: gf.prompt_for_expectations(window))
+def refresh_expectations():
+    fill_year_expectations(excelManager, allSheets=True, save=True)
+    currentYear.refresh_chart()
+
+editEButton = gf.create_widget(rightFrame, tk.Button, text="Edit Expectations", command=lambda: gf.prompt_for_expectations(window, refresh_expectations))
 editEButton.grid(row=1, pady=10)
 
 viewLogButton = gf.create_widget(leftFrame, tk.Button, text="View Log", command=lambda: log.display_log(window))
 viewLogButton.grid(row=0, pady=10)
 
-editCatButton = gf.create_widget(leftFrame,tk.Button, text="Edit Categories")
+def change_category(change, name, newName, text):
+    moved = 0
+    if (change == "add"):
+        log.add_category(newName)
+        categories.update_settings(name, newName, change)
+        return moved
+    if (change == "rename"):
+        log.rename_category(name, newName)
+    elif (change == "merge"):
+        log.merge_category(name, newName)
+    else:
+        moved = len(log.split_category(name, newName, text))
+        if (moved == 0):
+            return 0
+    categories.update_settings(name, newName, change)
+    update_chart_categories(excelManager, log, name, newName, change)
+    currentYear.refresh_chart()
+    refresh_trends()
+    return moved
+
+editCatButton = gf.create_widget(leftFrame,tk.Button, text="Edit Categories", command=lambda: gf.prompt_for_categories(window, change_category))
 editCatButton.grid(row=1, pady=10)
 
+def export_workbook():
+    fill_year_charts(excelManager, log, allSheets=True)
+    excelManager.export_xlsx(path, log)
+
+exportButton = gf.create_widget(leftFrame, tk.Button, text="Export to Excel", command=export_workbook)
+exportButton.grid(row=2, pady=10)
+
+def import_statement():
+    statementPath = filedialog.askopenfilename(parent=window, title="Import Statement", filetypes=[("Bank statements", "*.csv *.ofx *.qfx"), ("All files", "*.*")])
+    if (statementPath == "" or statementPath == ()):
+        return
+    try:
+        stats = Statement_Importer().import_file(log, statementPath, review=lambda flagged: gf.prompt_for_duplicates(window, flagged))
+    except (OSError, ValueError) as error:
+        saveStatus.set("Import failed: " + str(error))
+        return
+    if (stats == None):
+        saveStatus.set("Import cancelled")
+        return
+    saveStatus.set("Imported " + str(stats["rows"]) + " rows (" + str(int(stats["rowsPerSecond"])) + " rows/s), skipped " + str(stats["skipped"])
+                   + ", " + str(stats["unread"]) + " without an amount")
+
+importButton = gf.create_widget(leftFrame, tk.Button, text="Import Statement", command=import_statement)
+importButton.grid(row=3, pady=10)
+
+saveStatus = tk.StringVar(value=log.load_summary())
+saveLabel = gf.create_widget(leftFrame, tk.Label, textvariable=saveStatus, height=1)
+saveLabel.grid(row=4, pady=10)
+
+def show_save_status(written, errors):
+    if (len(errors) > 0):
+        saveStatus.set("Save failed: " + str(errors[-1]))
+    else:
+        saveStatus.set("Saved " + datetime.datetime.now().strftime("%H:%M:%S"))
+
+excelManager.persistence.statusListeners.append(show_save_status)
+
+# Only there when started with BUDGET_STATS set.
+if (instrument.enabled):
+    statsButton = gf.create_widget(leftFrame, tk.Button, text="Stats", command=lambda: instrument.show_window(window))
+    statsButton.grid(row=5, pady=10)
+
 chartLabel = gf.create_widget(middleFrame, tk.Label, textvariable=tk.StringVar(value=str(currentYear.year)), height=1)
 chartLabel.grid(row=0, column=1)
 
-previousChartButton = gf.create_widget(middleFrame, tk.Button, text="<", command=lambda: currentYear.previous_year(chartLabel))
+def show_previous_year():
+    currentYear.previous_year(chartLabel)
+    refresh_trends()
+
+def show_next_year():
+    currentYear.next_year(chartLabel)
+    refresh_trends()
+
+previousChartButton = gf.create_widget(middleFrame, tk.Button, text="<", command=show_previous_year)
 previousChartButton.grid(row=0, column=0)
 
-nextChartButton = gf.create_widget(middleFrame, tk.Button, text=">", command=lambda: currentYear.next_year(chartLabel))
+nextChartButton = gf.create_widget(middleFrame, tk.Button, text=">", command=show_next_year)
 nextChartButton.grid(row=0, column=2)
 
 # \\
@@ -106,7 +248,7 @@ chartFrame.grid(row=1, column=1)
 chartFrame.grid_propagate(False)
 chartFrame.config(width=600, height=500)
 
-mainChart = currentYear.display_chart(chartFrame, row=0, column=0, columnSize=75, stretch=0)
+currentYear.display_chart(chartFrame, row=0, column=0, columnSize=75, stretch=0)
 
 hScroll = gf.create_widget(chartFrame, tk.Scrollbar, orient="horizontal")
 hScroll.grid(row=1, column=0, sticky="ew")
@@ -117,11 +259,49 @@ vScroll.grid(row=0, column=1 ,sticky="ns")
 chartFrame.rowconfigure(0, weight=1)
 chartFrame.columnconfigure(0, weight=1)
 
-mainChart.config(xscrollcommand=hScroll.set)
-mainChart.config(yscrollcommand=vScroll.set)
+currentYear.attach_scrollbars(hScroll, vScroll)
+
+# \\
+
+# Trends under the chart, from the log's rolling analytics: as of today for this
+# year's chart and as of December 31st for any other. //
+trendColumns = ("Category", "30 days", "90 days", "This month", "Last month", "Change")
+
+def trend_date():
+    if (currentYear.year == gf.today.year):
+        return gf.today
+    return datetime.date(currentYear.year, 12, 31)
+
+def trend_rows(start, stop):
+    rows = log.analytics.summary_rows(trend_date())
+    return [("trend" + str(i), rows[i]) for i in range(start, min(stop, len(rows)))]
+
+trendView = Virtual_View(middleFrame, lambda: len(gf.categoriesOut) + 3, trend_rows, 6, columns=trendColumns, show="headings")
+for column in trendColumns:
+    trendView.heading(column, text=column)
+    trendView.column(column, width=95)
+trendView.grid(row=2, column=1, pady=10)
+
+def refresh_trends():
+    trendView.refresh()
+
+# \\
 
-hScroll.config(command=mainChart.xview)
-vScroll.config(command=mainChart.yview)
+# Compacts pending log changes into storage in the background and once more on exit,
+# waiting for the persistence thread to write everything before closing: //
+def close_window():
+    log.compact()
+    excelManager.refresh_snapshot(log)
+    excelManager.persistence.close()
+    excelManager.storage.close()
+    window.destroy()
+
+window.after(log.compactInterval, lambda: log.schedule_compaction(window))
+excelManager.persistence.poll(window)
+# A stale snapshot cache is rebuilt in the background once the window is idle.
+window.after_idle(lambda: excelManager.refresh_snapshot(log))
+window.protocol("WM_DELETE_WINDOW", close_window)
+startup_time("ready")
 
 # \\
 
@@ -0,0 +1,164 @@
+import sys
+import argparse
+import global_func as gf
+from excel_manager import Excel_Manager
+from log import Log
+from year_chart import Year_Chart, fill_year_charts, fill_year_expectations
+from importer import Statement_Importer, describe_stats
+
+# Headless batch runs over the same Log, Excel_Manager and Year_Chart the Tk app
+# uses, for nightly jobs on machines without a display:
+#
+#   python batch.py [--path ./Tracker.xlsx] [--settings ./json-dump.json] OPERATION ...
+#
+#   import FILE      imports a CSV or OFX/QFX statement, leaving out exact duplicates
+#   charts           creates this year's chart if it's missing and refills the
+#                    Actual and Expected columns of every year chart
+#   export FILE      writes the log and every year chart to an xlsx file
+#   check            compares the running totals, the rolling analytics and the year
+#                    charts' Actual columns with a full regroup of the log
+#
+#   python batch.py import jan.csv import feb.ofx charts export backup.xlsx check
+#
+# Operations run in the order given against one load of the tracker. The
+# persistence worker is held while they run, so every change they make is written
+# at the end as one burst: one compaction of the changed years, one save of the
+# charts and one storage batch, however many operations there were. The exit code
+# is 1 when check found anything, and 2 when an operation or a write failed. An
+# operation that fails stops the run; what the ones before it did is still written.
+class Batch_Run:
+    excelMan = None
+    log = None
+    chartsChanged = False
+    problems = []
+    saveErrors = []
+
+    def __init__(self, path):
+        self.excelMan = Excel_Manager(path)
+        self.excelMan.persistence.hold()
+        self.excelMan.persistence.statusListeners.append(self.saved)
+        self.log = Log(self.excelMan)
+        self.chartsChanged = False
+        self.problems = []
+        self.saveErrors = []
+
+    def run(self, steps):
+        for name, args in steps:
+            print("== " + " ".join([name] + args))
+            getattr(self, "run_" + name)(*args)
+
+    def run_import(self, statementPath):
+        print(describe_stats(statementPath, Statement_Importer().import_file(self.log, statementPath)))
+
+    def run_charts(self):
+        currentYear = Year_Chart(excelManager=self.excelMan, log=self.log, year=gf.curYear)
+        if (not self.excelMan.has_sheet(str(currentYear.year))):
+            currentYear.create_chart()
+        fill_year_charts(self.excelMan, self.log, allSheets=True)
+        fill_year_expectations(self.excelMan, allSheets=True)
+        self.chartsChanged = True
+
+    # Fills the charts first, like the app's export, so they match the log written.
+    def run_export(self, exportPath):
+        fill_year_charts(self.excelMan, self.log, allSheets=True)
+        fill_year_expectations(self.excelMan, allSheets=True)
+        self.excelMan.export_xlsx(exportPath, self.log)
+        print("Exporting to " + exportPath)
+
+    def run_check(self):
+        problems = []
+        for key in self.log.runningTotals.check(self.log):
+            problems.append("Running total " + str(key) + " doesn't match the log")
+        for row, date in self.log.analytics.check():
+            problems.append("Rolling analytics row " + str(row) + " on " + str(date) + " doesn't match the log")
+        totals = self.log.runningTotals
+        for sheetName in self.excelMan.sheet_names():
+            if (not sheetName.isdigit()):
+                continue
+            yearChart = Year_Chart(excelManager=self.excelMan, log=self.log, year=int(sheetName))
+            yearChart.yearSheet = self.excelMan.get_sheet(sheetName)
+            for row, name, out in yearChart.category_rows()["categories"]:
+                monthValues = totals.category_months(yearChart.year, name, out)
+                for monthInt in range(1, len(gf.months) + 1):
+                    value = yearChart.yearSheet.cell(row=row, column=monthInt * 2 + 1).value
+                    if (value == None):
+                        value = 0
+                    if (abs(float(value) - round(float(monthValues[monthInt - 1]), 2)) > 0.005):
+                        problems.append(sheetName + " " + name + " " + gf.months[monthInt - 1] + ": chart has " + str(value)
+                                        + ", log has " + str(round(float(monthValues[monthInt - 1]), 2)))
+        for problem in problems:
+            print(problem)
+        print(str(len(self.log.transactionIndex)) + " transactions checked, " + str(len(problems)) + " problem(s)")
+        self.problems.extend(problems)
+
+    # Status listener of the persistence worker, the window's save label here.
+    def saved(self, written, errors):
+        for error in errors:
+            print("Save failed: " + repr(error))
+        self.saveErrors.extend(errors)
+
+    # The one write: changed years compacted, changed charts saved and the snapshot
+    # cache refreshed, all released to the worker together.
+    def finish(self):
+        self.log.compact()
+        if (self.chartsChanged):
+            for sheetName in self.excelMan.sheet_names():
+                if (sheetName.isdigit() and sheetName in self.excelMan.workbook.sheetnames):
+                    self.excelMan.save_chart(sheetName)
+        self.excelMan.refresh_snapshot(self.log)
+        self.excelMan.persistence.close()
+        self.excelMan.storage.close()
+
+
+# Operation name to the number of arguments it takes.
+operations = {"import": 1, "charts": 0, "export": 1, "check": 0}
+
+# [(name, args)] from the command line's operation words, checked before anything
+# is loaded.
+def parse_operations(words):
+    steps = []
+    i = 0
+    while (i < len(words)):
+        name = words[i]
+        if (name not in operations):
+            raise ValueError("Unknown operation: " + name)
+        arity = operations[name]
+        if (i + arity >= len(words)):
+            raise ValueError(name + " needs " + str(arity) + " argument(s)")
+        steps.append((name, words[i + 1:i + 1 + arity]))
+        i = i + 1 + arity
+    return steps
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Runs operations on the budget tracker without a window, with one load and one save.")
+    parser.add_argument("--path", default="./Tracker.xlsx")
+    parser.add_argument("--settings", default=gf.settingsPath)
+    parser.add_argument("operations", nargs="+", help="import FILE, charts, export FILE, check")
+    args = parser.parse_args(argv)
+
+    try:
+        steps = parse_operations(args.operations)
+    except ValueError as error:
+        parser.error(str(error))
+
+    gf.settingsPath = args.settings
+    gf.load_settings()
+    batch = Batch_Run(args.path)
+    failed = False
+    try:
+        batch.run(steps)
+    except Exception as error:
+        print("Failed: " + str(error))
+        failed = True
+    finally:
+        batch.finish()
+    if (failed or len(batch.saveErrors) > 0):
+        return 2
+    if (len(batch.problems) > 0):
+        return 1
+    return 0
+
+
+if (__name__ == "__main__"):
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime
+import subprocess
+import openpyxl as opxl
+import global_func as gf
+from excel_manager import Excel_Manager
+from log import Log
+from year_chart import Year_Chart
+
+# Headless benchmarks of the core paths on synthetic Tracker.xlsx workbooks built
+# from the real json-dump.json categories. Nothing here opens a window: the views
+# are measured through the same row sources they read from.
+#
+#   python benchmark.py                      10k, 100k and 1M rows
+#   python benchmark.py --sizes 10000 --storage xlsx --output before.json
+#   python benchmark.py --compare before.json after.json
+#
+# Results are JSON keyed by size then operation, with the commit they ran on, so
+# two runs can be compared with --compare.
+
+descriptionWords = ("Kroger", "Walmart", "Netflix", "Shell", "Payroll", "Amazon", "Target", "Uber", "Starbucks",
+                    "Landlord", "Spotify", "Costco", "Venmo", "Chipotle", "Steam", "Etsy")
+
+
+def synthetic_rows(count, seed = 0):
+    generator = random.Random(seed)
+    firstDay = datetime.datetime(gf.curYear - 9, 1, 1)
+    rows = []
+    for i in range(count):
+        date = firstDay + datetime.timedelta(days=generator.randrange(365 * 10))
+        if (generator.random() < 0.25):
+            amount = round(generator.uniform(10, 2500), 2)
+            category = generator.choice(gf.categoriesIn)
+        else:
+            amount = -round(generator.uniform(1, 400), 2)
+            category = generator.choice(gf.categoriesOut)
+        description = generator.choice(descriptionWords) + " #" + str(generator.randrange(10000))
+        rows.append((date, amount, category, description))
+    rows.sort(key=lambda row: row[0], reverse=True)
+    return rows
+
+
+# A Tracker.xlsx with a Log sheet of count rows, newest first like the app writes it.
+def generate_workbook(path, count, seed = 0):
+    workbook = opxl.Workbook(write_only=True)
+    logSheet = workbook.create_sheet("Log")
+    logSheet.append(["Date", "Amount", "Category", "Description"])
+    for row in synthetic_rows(count, seed):
+        logSheet.append(list(row))
+    workbook.save(path)
+
+
+def timed(results, name, function, repeat = 1):
+    startTime = time.perf_counter()
+    value = None
+    for i in range(repeat):
+        value = function()
+    seconds = time.perf_counter() - startTime
+    results[name] = {"seconds": seconds, "repeat": repeat, "mean": seconds / repeat}
+    return value
+
+
+def run_size(count, storageType, repeat, seed):
+    results = {}
+    directory = tempfile.mkdtemp(prefix="budget-bench-")
+    path = os.path.join(directory, "Tracker.xlsx")
+    gf.storageType = storageType
+    generator = random.Random(seed + 1)
+    try:
+        timed(results, "generate_workbook", lambda: generate_workbook(path, count, seed))
+        excelMan = timed(results, "Excel_Manager.__init__", lambda: Excel_Manager(path))
+        log = timed(results, "Log.load_log", lambda: Log(excelMan))
+        results["Log.load_log"]["bytes"] = log.transactionIndex.memory_size()
+
+        def add():
+            date = datetime.datetime(gf.curYear - generator.randrange(10), generator.randrange(1, 13), generator.randrange(1, 29))
+            log.log_transaction(path, date, -12.5, gf.categoriesOut[0], "Benchmark")
+        timed(results, "Log.log_transaction", add, repeat)
+
+        def edit():
+            transaction = log.transactionIndex.transactions[generator.randrange(len(log.transactionIndex))]
+            log.edit_transaction(path, transaction.date + datetime.timedelta(days=1), transaction.amount, transaction.category, transaction.description, transaction)
+        timed(results, "Log.edit_transaction", edit, repeat)
+
+        def delete():
+            log.delete_transaction(log.transactionIndex.transactions[generator.randrange(len(log.transactionIndex))])
+        timed(results, "Log.delete_row", delete, repeat)
+
+        timed(results, "Log.sort_logs(Date)", lambda: log.sort_logs("Date", False))
+        timed(results, "Log.sort_logs(Amount)", lambda: log.sort_logs("Amount", True))
+        timed(results, "Log.get_years", lambda: log.get_years(), repeat)
+
+        yearChart = Year_Chart(excelManager=excelMan, log=log, year=gf.curYear + 1)
+        timed(results, "Year_Chart.create_chart", yearChart.create_chart)
+        timed(results, "Year_Chart.fill_actuals", lambda: yearChart.fill_actuals(log.runningTotals))
+
+        # Trailing windows from the analytics' prefix sums, against summing the same
+        # window from the log each time.
+        log.analytics.stale = True
+        timed(results, "Rolling_Analytics.rebuild", log.analytics.rebuild)
+
+        def window_end():
+            return datetime.datetime(gf.curYear - generator.randrange(10), generator.randrange(1, 13), generator.randrange(1, 29))
+
+        def window():
+            return log.analytics.window_sum(gf.categoriesOut[0], True, window_end(), 90)
+        timed(results, "Rolling_Analytics.window_sum(90 days)", window, repeat)
+
+        def rescan():
+            end = window_end()
+            total = 0.0
+            for transaction in log.get_transactions(end - datetime.timedelta(days=89), end + datetime.timedelta(days=1)):
+                if (transaction.amount < 0 and transaction.category == gf.categoriesOut[0]):
+                    total = total - transaction.amount
+            return total
+        timed(results, "90 day window by rescan", rescan, repeat)
+
+        def apply():
+            transaction = log.transactionIndex.transactions[generator.randrange(len(log.transactionIndex))]
+            log.analytics.apply(transaction, -1)
+            log.analytics.apply(transaction, 1)
+        timed(results, "Rolling_Analytics.apply(x2)", apply, repeat)
+        timed(results, "Rolling_Analytics.summary_rows", lambda: log.analytics.summary_rows(gf.today), repeat)
+
+        def load_sheet():
+            cols, rowCount, fetchRows = excelMan.sheet_source(excelMan.get_sheet(str(yearChart.year)))
+            return fetchRows(0, 40)
+        timed(results, "Excel_Manager.load_sheet", load_sheet, repeat)
+
+        def load_log_view():
+            return log.get_rows(0, 40)
+        timed(results, "Log.get_rows(first screen)", load_log_view, repeat)
+
+        # The first compaction writes every year; after it only the changed one.
+        def compact():
+            log.compact()
+            excelMan.persistence.flush()
+        timed(results, "Log.compact(all years)", compact)
+        add()
+        timed(results, "Log.compact(one year)", compact)
+
+        def close():
+            log.compact()
+            excelMan.refresh_snapshot(log)
+            excelMan.persistence.close()
+            excelMan.storage.close()
+        timed(results, "persistence flush and close", close)
+
+        # A second start, from the snapshot cache where the backend has one.
+        excelMan = timed(results, "Excel_Manager.__init__(warm)", lambda: Excel_Manager(path))
+        log = timed(results, "Log.load_log(warm)", lambda: Log(excelMan))
+        excelMan.persistence.close()
+        excelMan.storage.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+# Seconds from launch to the main window showing, which should stay under this.
+firstWindowTarget = 0.5
+
+
+# Runs bank.py against a copy of the settings and a workbook of count rows, once
+# exiting as soon as the window is up and once when loading has finished. Needs a
+# display; without one the error is recorded instead.
+def measure_startup(count, storageType, seed):
+    directory = tempfile.mkdtemp(prefix="budget-startup-")
+    bankPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bank.py")
+    results = {"target": firstWindowTarget}
+    try:
+        settings = dict(gf.saveInfo)
+        settings["Storage"] = storageType
+        with open(os.path.join(directory, "json-dump.json"), "w") as settingsFile:
+            json.dump(settings, settingsFile)
+        generate_workbook(os.path.join(directory, "Tracker.xlsx"), count, seed)
+
+        for probe in ("first", "ready"):
+            environment = dict(os.environ)
+            environment["BUDGET_STARTUP_PROBE"] = probe
+            startTime = time.perf_counter()
+            process = subprocess.run([sys.executable, bankPath], cwd=directory, env=environment, capture_output=True, text=True, timeout=3600)
+            wallSeconds = time.perf_counter() - startTime
+            if (process.returncode != 0):
+                results["error"] = process.stderr.strip().splitlines()[-1:]
+                return results
+            for line in process.stdout.splitlines():
+                if (line.startswith("Startup " + probe + ": ")):
+                    results[probe] = float(line[len("Startup " + probe + ": "):-1])
+            results[probe + " (process)"] = wallSeconds
+        results["met"] = results.get("first", firstWindowTarget + 1) <= firstWindowTarget
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Prints the mean time of every operation in two result files and the ratio
+# after / before; above 1 is slower.
+def compare(beforePath, afterPath):
+    with open(beforePath, "r") as beforeFile:
+        before = json.load(beforeFile)
+    with open(afterPath, "r") as afterFile:
+        after = json.load(afterFile)
+    print("Comparing " + str(before.get("commit")) + " -> " + str(after.get("commit")))
+    for size in after["results"]:
+        if (size not in before["results"]):
+            continue
+        print(size + " rows:")
+        for name, timing in after["results"][size].items():
+            if (name not in before["results"][size]):
+                continue
+            oldMean = before["results"][size][name]["mean"]
+            ratio = float("inf")
+            if (oldMean > 0):
+                ratio = timing["mean"] / oldMean
+            print("  " + name.ljust(32) + str(round(oldMean * 1000, 3)).rjust(12) + " ms" + str(round(timing["mean"] * 1000, 3)).rjust(12) + " ms" + ("x" + str(round(ratio, 2))).rjust(10))
+    for size, startup in after.get("startup", {}).items():
+        oldStartup = before.get("startup", {}).get(size, {})
+        for probe in ("first", "ready"):
+            if (probe in startup and probe in oldStartup):
+                print("  startup " + probe + " (" + size + " rows)" + str(round(oldStartup[probe], 3)).rjust(12) + " s" + str(round(startup[probe], 3)).rjust(12) + " s")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the log, storage and year chart paths on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--storage", choices=["xlsx", "sqlite"], default=gf.storageType)
+    parser.add_argument("--repeat", type=int, default=100, help="Runs of each per-transaction operation.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Defaults to benchmark_results/<commit>.json.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--no-startup", action="store_true", help="Skip launching bank.py for the time-to-first-window probe.")
+    args = parser.parse_args(argv)
+
+    if (args.compare != None):
+        compare(args.compare[0], args.compare[1])
+        return
+
+    commit = current_commit()
+    report = {"commit": commit, "time": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+              "platform": platform.platform(), "storage": args.storage, "repeat": args.repeat, "results": {}}
+    for size in args.sizes:
+        print("Benchmarking " + str(size) + " rows (" + args.storage + ")...")
+        report["results"][str(size)] = run_size(size, args.storage, args.repeat, args.seed)
+        for name, timing in report["results"][str(size)].items():
+            print("  " + name.ljust(32) + str(round(timing["mean"] * 1000, 3)).rjust(12) + " ms")
+        if (not args.no_startup):
+            report.setdefault("startup", {})[str(size)] = measure_startup(size, args.storage, args.seed)
+            print("  startup: " + json.dumps(report["startup"][str(size)]))
+
+    output = args.output
+    if (output == None):
+        output = os.path.join("benchmark_results", str(commit or "results") + ".json")
+    if (os.path.dirname(output) != ""):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as outputFile:
+        json.dump(report, outputFile, indent=4)
+    print("Wrote " + output)
+
+
+if (__name__ == "__main__"):
+    main(sys.argv[1:])
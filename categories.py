@@ -0,0 +1,147 @@
+import numpy as np
+import global_func as gf
+
+# Every category name the log has seen gets an integer code, and transactions hold
+# the code instead of the text. A code can point at another one (canonical), which
+# is how a merged category's transactions read as the category they were merged
+# into without being touched. Renaming changes the name a code reads as, so it's one
+# list update too.
+#
+# The log's xlsx files still hold names. Names that were renamed or merged away are
+# kept in json-dump.json as "Category Aliases" (old name to current name), so rows
+# that still use them load under the right category without being rewritten. An
+# alias only lasts until its name is used for a category again; free() gives the
+# name a new code and Log rewrites the rows the alias covered.
+class Category_Registry:
+    names = []
+    codes = {}
+    canonical = []
+    loaded = False
+
+    def __init__(self):
+        self.names = []
+        self.codes = {}
+        self.canonical = []
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
+        for name in gf.categoriesIn + gf.categoriesOut:
+            self.code(name)
+        for alias, name in gf.saveInfo.get("Category Aliases", {}).items():
+            if (alias in gf.categoriesIn + gf.categoriesOut):
+                continue
+            self.canonical[self.code(alias)] = self.canonical[self.code(name)]
+
+    # The code for name, new names get the next one.
+    def code(self, name):
+        if (not self.loaded):
+            self.load()
+        code = self.codes.get(name)
+        if (code == None):
+            code = len(self.names)
+            self.codes[name] = code
+            self.names.append(name)
+            self.canonical.append(code)
+        return code
+
+    def name(self, code):
+        return self.names[self.canonical[code]]
+
+    # The current name for a name that may have been renamed or merged away.
+    def resolve(self, name):
+        return self.name(self.code(name))
+
+    def exists(self, name):
+        return name in self.codes and self.resolve(name) == name
+
+    # Maps an array of codes onto the codes they read as, in one take.
+    def remap(self, codes):
+        return np.asarray(self.canonical, dtype=np.int64)[codes]
+
+    # Renaming onto another category is a merge, so it's refused here. A new name
+    # that's still an alias of another category is freed first, see free(), and the
+    # code it had is returned so its rows can be rewritten; otherwise None.
+    def rename(self, oldName, newName):
+        code = self.canonical[self.code(oldName)]
+        if (self.exists(newName) and self.canonical[self.codes[newName]] != code):
+            raise ValueError(newName + " is already a category, merge into it instead")
+        freedCode = self.free(newName)
+        self.names[code] = newName
+        self.codes[newName] = code
+        if (freedCode != None and self.canonical[freedCode] == code):
+            return None
+        return freedCode
+
+    # Makes an alias name available for a category of its own: the name gets a new
+    # code the next time it's asked for, and the old code keeps reading as the
+    # category it was renamed or merged into. Returns the old code, or None when name
+    # wasn't an alias.
+    def free(self, name):
+        if (not self.loaded):
+            self.load()
+        if (name not in self.codes or self.resolve(name) == name):
+            return None
+        return self.codes.pop(name)
+
+    # Everything that read as source reads as target from now on.
+    def merge(self, source, target):
+        sourceCode = self.canonical[self.code(source)]
+        targetCode = self.canonical[self.code(target)]
+        for code in range(len(self.canonical)):
+            if (self.canonical[code] == sourceCode):
+                self.canonical[code] = targetCode
+
+    # Old name to current name for every name that no longer reads as itself.
+    def aliases(self):
+        aliases = {}
+        for name, code in self.codes.items():
+            if (self.name(code) != name):
+                aliases[name] = self.name(code)
+        return aliases
+
+
+registry = Category_Registry()
+
+
+# Carries a category change ("add", "rename", "merge" or "split") into
+# json-dump.json: the category lists, payees and expectations that name it, and the
+# registry's aliases. An added category is already in its list.
+# Merged expectations add up, since the merged category covers both.
+def update_settings(oldName, newName, change):
+    for categoryList in (gf.categoriesIn, gf.categoriesOut):
+        if (change == "add" or oldName not in categoryList):
+            continue
+        i = categoryList.index(oldName)
+        if (change == "split"):
+            if (newName not in categoryList):
+                categoryList.insert(i + 1, newName)
+        elif (newName in categoryList):
+            del categoryList[i]
+        else:
+            categoryList[i] = newName
+
+    if (change in ("rename", "merge")):
+        for payee, category in gf.payeeCategories.items():
+            if (category == oldName):
+                gf.payeeCategories[payee] = newName
+        for amounts in gf.expectations.get("Defaults", {}).values():
+            if (oldName in amounts):
+                amounts[newName] = amounts.get(newName, 0.0) + amounts.pop(oldName)
+        for rule in gf.expectations.get("Rules", []):
+            if (rule["Category"] == oldName):
+                rule["Category"] = newName
+        overrides = {}
+        for override in gf.expectations.get("Overrides", []):
+            if (override["Category"] == oldName):
+                override["Category"] = newName
+            key = (override["Year"], override["Month"], override["Category"], override.get("Out", True))
+            if (key in overrides):
+                overrides[key]["Amount"] = overrides[key]["Amount"] + override["Amount"]
+            else:
+                overrides[key] = override
+        if ("Overrides" in gf.expectations):
+            gf.expectations["Overrides"] = list(overrides.values())
+
+    gf.saveInfo["Category Aliases"] = registry.aliases()
+    gf.save_settings()
@@ -0,0 +1,81 @@
+import global_func as gf
+
+# Duplicate lookups kept alongside the log. Each index is a dict, updated as
+# transactions are added and removed, so checking a new transaction is O(1)
+# whatever the size of the log:
+# - exact: normalized (day, cents, category, description), the same entry twice.
+# - fuzzy: the same amount within windowDays days. Bank statements and hand
+#   entries rarely agree on the description or category, so overlaps between them
+#   are only caught here. Days are bucketed by windowDays, so only the bucket
+#   either side is looked at.
+# A Log row with a blank amount or date can't match anything, so it's left out.
+class Duplicate_Index:
+    windowDays = 3
+    exact = {}
+    fuzzy = {}
+
+    def __init__(self, windowDays = None):
+        if (windowDays == None):
+            windowDays = gf.duplicateDays
+        self.windowDays = max(1, int(windowDays))
+        self.exact = {}
+        self.fuzzy = {}
+
+    def exact_key(self, transaction):
+        description = " ".join(str(transaction.description or "").split()).lower()
+        category = str(transaction.category or "").strip().lower()
+        return (transaction.date.toordinal(), round(transaction.amount * 100), category, description)
+
+    def fuzzy_key(self, transaction, day = None):
+        if (day == None):
+            day = transaction.date.toordinal()
+        return (round(transaction.amount * 100), day // self.windowDays)
+
+    def indexed(self, transaction):
+        return transaction.amount != None and transaction.date != None
+
+    def add(self, transaction):
+        if (not self.indexed(transaction)):
+            return
+        self.exact.setdefault(self.exact_key(transaction), []).append(transaction)
+        self.fuzzy.setdefault(self.fuzzy_key(transaction), []).append(transaction)
+
+    def add_all(self, transactions):
+        for transaction in transactions:
+            self.add(transaction)
+
+    def remove(self, transaction):
+        if (not self.indexed(transaction)):
+            return
+        for index, key in ((self.exact, self.exact_key(transaction)), (self.fuzzy, self.fuzzy_key(transaction))):
+            matches = index.get(key)
+            if (matches == None):
+                continue
+            for i in range(len(matches)):
+                if (matches[i] is transaction):
+                    del matches[i]
+                    break
+            if (len(matches) == 0):
+                del index[key]
+
+    # Exact keys hold the category name, so they're rebuilt after a rename or merge.
+    # Every transaction is in the fuzzy index, which doesn't look at the category.
+    def rebuild_exact(self):
+        self.exact = {}
+        for matches in self.fuzzy.values():
+            for transaction in matches:
+                self.exact.setdefault(self.exact_key(transaction), []).append(transaction)
+
+    # (exactMatches, nearMatches) for a transaction that isn't in the index yet.
+    # Near matches leave out the exact ones.
+    def matches(self, transaction):
+        if (not self.indexed(transaction)):
+            return [], []
+        exactMatches = list(self.exact.get(self.exact_key(transaction), []))
+        nearMatches = []
+        day = transaction.date.toordinal()
+        for bucketDay in (day - self.windowDays, day, day + self.windowDays):
+            for match in self.fuzzy.get(self.fuzzy_key(transaction, bucketDay), []):
+                if (abs(match.date.toordinal() - day) <= self.windowDays and not any(match is exactMatch for exactMatch in exactMatches)):
+                    nearMatches.append(match)
+        return exactMatches, nearMatches
@@ -1,29 +1,299 @@
+import io
+import os
+import json
+import shutil
 import openpyxl as opxl
-import tkinter as tk
 import global_func as gf
-from tkinter import ttk
+from storage import Xlsx_Storage, Sqlite_Storage, sheet_merges
+from persistence import Persistence_Worker
+from snapshot import Snapshot_Cache
+import instrument
 
 class Excel_Manager:
     path = None
     workbook = None
+    readBook = None
+    sourceNames = []
+    storage = None
+    persistence = None
+    partitionDir = None
+    backupDir = None
+    backedUp = set()
+    snapshot = None
 
+    # The "Storage" setting in json-dump.json picks the backend. With sqlite the
+    # workbook only lives in memory and holds the year charts.
+    #
+    # With xlsx, Tracker.xlsx is opened read-only and streamed. self.workbook only
+    # holds the sheets that have been asked for with get_sheet (or created), which
+    # are the only ones loaded for writing. The read-only copy is opened from memory
+    # so it never holds the file, which the persistence thread replaces on each save.
+    #
+    # The xlsx backend keeps the log itself in a file per year under "Tracker Log",
+    # see the partition methods below. When the snapshot cache still matches the
+    # files, the charts and the log come from it instead and Tracker.xlsx is only
+    # opened if a sheet that isn't in the snapshot is asked for.
+    @instrument.timed()
     def __init__(self, path):
         self.path = path
-        self.workbook = opxl.load_workbook(self.path)
+        self.partitionDir = os.path.splitext(path)[0] + " Log"
+        self.backupDir = os.path.splitext(path)[0] + " Backups"
+        self.backedUp = set()
+        self.sourceNames = []
+        self.workbook = opxl.Workbook()
+        self.workbook.remove(self.workbook.active)
+        self.snapshot = Snapshot_Cache(self)
+        if (gf.storageType == "sqlite"):
+            self.storage = Sqlite_Storage(self)
+        else:
+            if (self.snapshot.load()):
+                self.sourceNames = list(self.snapshot.meta["sheets"])
+                for sheetName, rows, merges in self.snapshot.charts():
+                    sheet = self.workbook.create_sheet(sheetName)
+                    for values in rows:
+                        sheet.append(values)
+                    for mergedRange in merges:
+                        sheet.merge_cells(mergedRange)
+            elif (self.read_book() != None):
+                self.sourceNames = list(self.readBook.sheetnames)
+                self.workbook.properties = self.readBook.properties
+            self.storage = Xlsx_Storage(self)
+        self.persistence = Persistence_Worker(self.storage)
+
+    # Tracker.xlsx read-only, opened the first time it's needed. None if there's no file.
+    def read_book(self):
+        if (self.readBook == None and os.path.exists(self.path)):
+            with open(self.path, "rb") as workbookFile:
+                self.readBook = opxl.load_workbook(io.BytesIO(workbookFile.read()), read_only=True)
+        return self.readBook
+
+    # Sheets in Tracker.xlsx, then any created since.
+    def sheet_names(self):
+        names = list(self.sourceNames)
+        for sheetName in self.workbook.sheetnames:
+            if (sheetName not in names):
+                names.append(sheetName)
+        return names
+
+    def has_sheet(self, sheetName):
+        return sheetName in self.workbook.sheetnames or sheetName in self.sourceNames
+
+    # A sheet for reading only, streamed from the file if it hasn't been loaded.
+    def read_sheet(self, sheetName):
+        if (sheetName in self.workbook.sheetnames):
+            return self.workbook[sheetName]
+        return self.read_book()[sheetName]
+
+    # A sheet for writing, loaded from the file the first time it's asked for.
+    def get_sheet(self, sheetName):
+        if (sheetName not in self.workbook.sheetnames):
+            self.copy_sheet(sheetName)
+        return self.workbook[sheetName]
+
+    @instrument.timed()
+    def copy_sheet(self, sheetName):
+        source = self.read_book()[sheetName]
+        sheet = self.workbook.create_sheet(sheetName)
+        for values in source.iter_rows(min_row=1, values_only=True):
+            sheet.append(values)
+        for mergedRange in sheet_merges(source):
+            sheet.merge_cells(mergedRange)
+        return sheet
+
+    def create_sheet(self, sheetName):
+        return self.workbook.create_sheet(sheetName)
+
+    # (name, rows, merges) for every sheet, in order, to hand to write_workbook. Rows
+    # are None for sheets that were never loaded; those are copied from the file.
+    @instrument.timed()
+    def snapshot_sheets(self):
+        sheets = []
+        for sheetName in self.sheet_names():
+            if (sheetName in self.workbook.sheetnames):
+                sheet = self.workbook[sheetName]
+                sheets.append((sheetName, list(sheet.iter_rows(min_row=1, values_only=True)), sheet_merges(sheet)))
+            else:
+                sheets.append((sheetName, None, None))
+        return sheets
+
+    # Saves Tracker.xlsx on the persistence thread, from a snapshot of the sheets
+    # taken now. Saves still queued behind a later one are skipped.
+    @instrument.timed()
+    def save(self):
+        self.snapshot.valid = False
+        self.persistence.submit(self.write_workbook, self.path, self.snapshot_sheets(), None, None, key="save")
+
+    # Runs on the persistence thread. Builds the workbook from snapshots next to the
+    # target and swaps it in, so a failed write leaves the old file alone. logRows
+    # (transactions, newest first) replaces the Log sheet and identifier goes in the
+    # workbook properties; with None both are kept from the current file.
+    @instrument.timed()
+    def write_workbook(self, path, sheets, logRows, identifier):
+        source = None
+        unloaded = [sheetName for sheetName, rows, merges in sheets if rows == None and sheetName != "Log"]
+        if ((logRows == None or len(unloaded) > 0) and os.path.exists(self.path)):
+            source = opxl.load_workbook(self.path, read_only=True)
+            if (logRows == None):
+                identifier = source.properties.identifier
+
+        book = opxl.Workbook()
+        book.remove(book.active)
+        sheetNames = [sheetName for sheetName, rows, merges in sheets]
+        if (logRows != None and "Log" not in sheetNames):
+            sheets = [("Log", None, None)] + sheets
+        for sheetName, rows, merges in sheets:
+            sheet = book.create_sheet(sheetName)
+            if (sheetName == "Log" and logRows != None):
+                sheet.append(["Date", "Amount", "Category", "Description"])
+                for transaction in logRows:
+                    sheet.append(list(transaction.values()))
+                continue
+            if (rows == None):
+                rows = source[sheetName].iter_rows(min_row=1, values_only=True)
+                merges = sheet_merges(source[sheetName])
+            for values in rows:
+                sheet.append(values)
+            for mergedRange in merges:
+                sheet.merge_cells(mergedRange)
+        book.properties.identifier = identifier
+        if (source != None):
+            source.close()
+
+        tempPath = os.path.splitext(path)[0] + ".saving.xlsx"
+        book.save(tempPath)
+        backups = 0
+        if (os.path.abspath(path) == os.path.abspath(self.path)):
+            backups = gf.backupCount
+        self.replace_file(tempPath, path, backups)
+
+    # Every file is written next to its target under another name and swapped in
+    # here: the new file is synced to disk, the old one becomes backup 1 (the
+    # earlier ones move up, past backups are dropped), the rename replaces the
+    # target in one step and the folder is synced so the rename itself survives a
+    # crash. At any moment the target is the whole old file or the whole new one.
+    #
+    # Backups rotate on a file's first write of the session only, so they hold the
+    # file as it was at the start of this and earlier sessions, not a few writes ago.
+    def replace_file(self, tempPath, path, backups = 0):
+        with open(tempPath, "r+b") as tempFile:
+            os.fsync(tempFile.fileno())
+        if (backups > 0 and os.path.exists(path) and os.path.abspath(path) not in self.backedUp):
+            self.rotate_backups(path, backups)
+            self.backedUp.add(os.path.abspath(path))
+        os.replace(tempPath, path)
+        if (hasattr(os, "O_DIRECTORY")):
+            directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    def backup_path(self, path, number):
+        name, extension = os.path.splitext(os.path.basename(path))
+        return os.path.join(self.backupDir, name + "." + str(number) + extension)
+
+    # Backup 1 is a hard link to the current file where the filesystem has them, so
+    # keeping it costs no copy; the rename that follows leaves it holding the old data.
+    def rotate_backups(self, path, backups):
+        os.makedirs(self.backupDir, exist_ok=True)
+        for number in range(backups, 1, -1):
+            if (os.path.exists(self.backup_path(path, number - 1))):
+                os.replace(self.backup_path(path, number - 1), self.backup_path(path, number))
+        if (os.path.exists(self.backup_path(path, 1))):
+            os.remove(self.backup_path(path, 1))
+        try:
+            os.link(path, self.backup_path(path, 1))
+        except OSError:
+            shutil.copy2(path, self.backup_path(path, 1))
+
+    # Log partitions: <year>.xlsx files holding one year of the log each, newest
+    # first like the Log sheet, plus manifest.json listing the years and their row
+    # counts so they're known without opening any partition.
+    def partition_path(self, year):
+        return os.path.join(self.partitionDir, str(year) + ".xlsx")
+
+    def manifest_path(self):
+        return os.path.join(self.partitionDir, "manifest.json")
+
+    # None until the log has been split into partitions.
+    def read_manifest(self):
+        if (not os.path.exists(self.manifest_path())):
+            return None
+        with open(self.manifest_path(), "r") as manifestFile:
+            return json.load(manifestFile)
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.partitionDir, exist_ok=True)
+        tempPath = self.manifest_path() + ".saving"
+        with open(tempPath, "w") as manifestFile:
+            json.dump(manifest, manifestFile, indent=4)
+        self.replace_file(tempPath, self.manifest_path())
+
+    # Opened read-only from memory, like readBook, so the file is never held.
+    def read_partition(self, year):
+        with open(self.partition_path(year), "rb") as partitionFile:
+            return opxl.load_workbook(io.BytesIO(partitionFile.read()), read_only=True)
+
+    # Runs on the persistence thread. transactions are one year's, newest first.
+    @instrument.timed()
+    def write_partition(self, year, transactions, identifier):
+        os.makedirs(self.partitionDir, exist_ok=True)
+        book = opxl.Workbook(write_only=True)
+        sheet = book.create_sheet("Log")
+        sheet.append(["Date", "Amount", "Category", "Description"])
+        for transaction in transactions:
+            sheet.append(list(transaction.values()))
+        book.properties.identifier = identifier
+
+        partitionPath = self.partition_path(year)
+        tempPath = os.path.splitext(partitionPath)[0] + ".saving.xlsx"
+        book.save(tempPath)
+        self.replace_file(tempPath, partitionPath, gf.backupCount)
+
+    def remove_partition(self, year):
+        if (os.path.exists(self.partition_path(year))):
+            os.remove(self.partition_path(year))
 
     def make_excelView(self, sheetName, window, columnSize = 100, stretch = 0):
-        sheet = self.workbook[sheetName]
+        sheet = self.get_sheet(sheetName)
         excelView = self.load_sheet(sheet, window, columnSize=columnSize, stretch=stretch)
         return excelView
 
+    # rowCount() and fetchRows(start, stop) supply the rows as (key, values) pairs;
+    # only the ones on screen are ever put into the Treeview.
+    def make_listView(self, cols, rowCount, fetchRows, window, columnSize = 100, stretch = 0):
+        return self.load_rows(cols, rowCount, fetchRows, window, columnSize=columnSize, stretch=stretch)
+
+    # Rows are read from the sheet as they scroll into view, so a refresh of the view
+    # picks up cells written since it was made.
+    @instrument.timed()
     def load_sheet(self, sheet, window, columnSize, stretch):
-        list_values = list(sheet.values)
-        cols = list_values[0]
-        tree = ttk.Treeview(window, column= cols, show="headings")
+        cols, rowCount, fetchRows = self.sheet_source(sheet)
+        return self.load_rows(cols, rowCount, fetchRows, window, columnSize=columnSize, stretch=stretch)
 
+    # The headers, rowCount() and fetchRows(start, stop) a view of the sheet reads from.
+    def sheet_source(self, sheet):
+        cols = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True))
+
+        def fetchRows(start, stop):
+            stop = min(stop, sheet.max_row - 1)
+            rows = []
+            if (start >= stop):
+                return rows
+            i = start
+            for values in sheet.iter_rows(min_row=start + 2, max_row=stop + 1, max_col=len(cols), values_only=True):
+                rows.append(("row" + str(i), values))
+                i = i + 1
+            return rows
+
+        return cols, lambda: sheet.max_row - 1, fetchRows
+
+    @instrument.timed()
+    def load_rows(self, cols, rowCount, fetchRows, window, columnSize, stretch):
+        from virtual_view import Virtual_View
         height = int(((window.winfo_screenheight())/24)-10)
 
-        tree.config(height=height)
+        tree = Virtual_View(window, rowCount, fetchRows, height, column= cols, show="headings")
 
         i = 1
         for col_name in cols:
@@ -34,13 +304,42 @@ class Excel_Manager:
                 tree.heading('#' + str(i), text = col_name)
                 tree.column('#' + str(i), minwidth=columnSize, width=columnSize, stretch=stretch)
             i = i + 1
-
-        for value_tuple in list_values[1:]:
-            tree.insert('', tk.END, values=value_tuple)
         return tree
 
     def destroy_sheet(self, tree):
         tree.destroy()
 
-    def load_path(self):
-        self.workbook = opxl.load_workbook(self.path)
\ No newline at end of file
+    def save_chart(self, sheetName, deferred = False):
+        self.storage.save_chart(sheetName, deferred)
+
+    # Writes the log and every year chart to an xlsx file, whatever the backend, on
+    # the persistence thread. With xlsx the partitions are compacted first, so an
+    # export never holds changes the log files don't.
+    @instrument.timed()
+    def export_xlsx(self, path, log):
+        if (isinstance(self.storage, Xlsx_Storage)):
+            self.storage.compact(log)
+            if (os.path.abspath(path) == os.path.abspath(self.path)):
+                self.snapshot.valid = False
+        self.persistence.submit(self.write_workbook, path, self.snapshot_sheets(), log.sort_logs("Date", False), None)
+
+    # Rebuilds the snapshot cache on the persistence thread if anything was written
+    # since it was made. Called once loading is done and on exit rather than after
+    # every compaction, since the rebuild is a pass over the whole log.
+    @instrument.timed()
+    def refresh_snapshot(self, log):
+        if (not isinstance(self.storage, Xlsx_Storage) or self.snapshot.valid):
+            return
+        self.snapshot.valid = True
+        self.persistence.submit(self.write_snapshot, list(log.transactionIndex.transactions), self.snapshot_sheets(),
+                                key="snapshot", done=self.snapshot_written)
+
+    # Runs on the persistence thread; the journal seq then covers every change in
+    # the log that was handed over.
+    @instrument.timed()
+    def write_snapshot(self, transactions, sheets):
+        self.snapshot.write(transactions, sheets, self.storage.journal.seq)
+
+    def snapshot_written(self, error):
+        if (error != None):
+            self.snapshot.valid = False
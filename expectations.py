@@ -0,0 +1,123 @@
+import numpy as np
+import global_func as gf
+from actuals import Monthly_Actuals
+
+# What each category is expected to bring in or cost per month, from the
+# "Expectations" setting in json-dump.json:
+#
+#   "Expectations": {
+#       "Defaults": {"In": {"Paychecks": 2000}, "Out": {"Rent": 1200}},
+#       "Overrides": [{"Year": 2025, "Month": 3, "Category": "Rent", "Out": true, "Amount": 1300}],
+#       "Rules": [{"Category": "Paychecks", "Out": false, "Amount": 950, "Every": 14, "Start": "2025-01-03"},
+#                 {"Category": "Rent", "Out": true, "Amount": 1200, "Day": 1, "Start": "2024-06-01", "End": "2025-05-31"}]
+#   }
+#
+# A month's expected amount is the category's default plus what its rules fall on
+# that month, unless an override gives the month outright. Rules repeat every
+# "Every" days, or on "Day" of every "Months" months (1 by default), from Start to
+# End (both optional, inclusive). Months are 1-12 in the settings.
+#
+# Expected amounts come out as a Monthly_Actuals grid of (year, month, category),
+# built with array operations over every year at once, so Year_Chart fills its
+# Expected columns the same way it fills Actual ones.
+class Expectations:
+    defaults = {}
+    overrides = []
+    rules = []
+
+    def __init__(self, settings = None):
+        if (settings == None):
+            settings = gf.expectations
+        self.defaults = {}
+        for section, out in (("In", False), ("Out", True)):
+            for name, amount in settings.get("Defaults", {}).get(section, {}).items():
+                self.defaults[(name, out)] = float(amount)
+        self.overrides = list(settings.get("Overrides", []))
+        self.rules = list(settings.get("Rules", []))
+
+    def categories(self):
+        categories = [(name, False) for name in gf.categoriesIn] + [(name, True) for name in gf.categoriesOut]
+        for key in self.defaults:
+            if (key not in categories):
+                categories.append(key)
+        return categories
+
+    def override(self, year, month, name, out):
+        for override in self.overrides:
+            if (override["Year"] == year and override["Month"] == month and override["Category"] == name and override.get("Out", True) == out):
+                return override["Amount"]
+        return None
+
+    # How many times a rule falls in each month of years, as a (years, 12) array.
+    def rule_counts(self, rule, years):
+        firstMonth = np.datetime64(str(years[0]) + "-01", "M")
+        monthCount = len(years) * 12
+        first = np.datetime64(str(years[0]) + "-01-01", "D")
+        last = np.datetime64(str(years[-1]) + "-12-31", "D")
+        start = first
+        if (rule.get("Start") != None):
+            start = np.datetime64(gf.to_datetime(rule["Start"]).date(), "D")
+        end = last
+        if (rule.get("End") != None):
+            end = min(last, np.datetime64(gf.to_datetime(rule["End"]).date(), "D"))
+
+        if (rule.get("Every") != None):
+            every = int(rule["Every"])
+            skipped = max(0, -(-(first - start).astype(int) // every))
+            occurrences = start + every * np.arange(skipped, max(skipped, (end - start).astype(int) // every + 1))
+            monthKeys = (occurrences.astype("datetime64[M]") - firstMonth).astype(int)
+            return np.bincount(monthKeys, minlength=monthCount)[:monthCount].reshape(len(years), 12).astype(np.float64)
+
+        # On a day of the month, moved back to the month's last day when it's shorter.
+        months = firstMonth + np.arange(monthCount)
+        monthStarts = months.astype("datetime64[D]")
+        monthLengths = ((months + 1).astype("datetime64[D]") - monthStarts).astype(int)
+        occurrences = monthStarts + np.minimum(int(rule.get("Day", 1)), monthLengths) - 1
+        startMonth = (start.astype("datetime64[M]") - firstMonth).astype(int)
+        onCycle = (np.arange(monthCount) - startMonth) % int(rule.get("Months", 1)) == 0
+        falls = (occurrences >= start) & (occurrences <= end) & onCycle
+        return falls.astype(np.float64).reshape(len(years), 12)
+
+    # Expected amounts for every month and category of years (consecutive, oldest
+    # first): defaults broadcast over the grid, every rule added in one product of
+    # the rule counts with each rule's amount per category, then the overrides set.
+    def compute(self, years):
+        years = list(range(min(years), max(years) + 1))
+        categories = self.categories()
+        codes = {}
+        for code in range(len(categories)):
+            codes[categories[code]] = code
+
+        defaults = np.array([self.defaults.get(category, 0.0) for category in categories])
+        sums = np.broadcast_to(defaults, (len(years), 12, len(categories))).copy()
+
+        rules = [rule for rule in self.rules if (rule["Category"], rule.get("Out", True)) in codes]
+        if (len(rules) > 0):
+            counts = np.stack([self.rule_counts(rule, years) for rule in rules])
+            amounts = np.zeros((len(rules), len(categories)))
+            for i in range(len(rules)):
+                amounts[i, codes[(rules[i]["Category"], rules[i].get("Out", True))]] = float(rules[i]["Amount"])
+            sums = sums + np.einsum("rym,rc->ymc", counts, amounts)
+
+        overrides = [override for override in self.overrides
+                     if years[0] <= override["Year"] <= years[-1] and (override["Category"], override.get("Out", True)) in codes]
+        if (len(overrides) > 0):
+            yearIndex = np.array([override["Year"] - years[0] for override in overrides])
+            monthIndex = np.array([override["Month"] - 1 for override in overrides])
+            codeIndex = np.array([codes[(override["Category"], override.get("Out", True))] for override in overrides])
+            sums[yearIndex, monthIndex, codeIndex] = np.array([float(override["Amount"]) for override in overrides])
+        return Monthly_Actuals(years, categories, sums)
+
+
+# Actual minus expected for every month and category expected has, in one subtraction
+# once the actuals are laid out on the same grid. Positive is more than expected,
+# in or out.
+def variance(expected, actuals):
+    aligned = np.zeros(expected.sums.shape)
+    yearIndex = [i for i in range(len(expected.years)) if expected.years[i] in actuals.years]
+    codeIndex = [code for code in range(len(expected.categories)) if expected.categories[code] in actuals.codes]
+    if (len(yearIndex) > 0 and len(codeIndex) > 0):
+        actualYears = np.array([actuals.years.index(expected.years[i]) for i in yearIndex])
+        actualCodes = np.array([actuals.codes[expected.categories[code]] for code in codeIndex])
+        aligned[np.ix_(yearIndex, range(12), codeIndex)] = actuals.sums[np.ix_(actualYears, range(12), actualCodes)]
+    return Monthly_Actuals(expected.years, expected.categories, aligned - expected.sums)
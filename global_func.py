@@ -1,24 +1,46 @@
 import datetime
-import tkinter as tk
 import json
-from tkinter import ttk
-from tkcalendar import DateEntry
 
+# tkinter is imported by the dialogs that use it, so batch.py and service.py can
+# load this module on a machine without it.
 today = datetime.date.today()
 curYear = today.year
 curMonth = today.month
 
-jsonFile = open("./json-dump.json", "r+")
-categoriesIn = []
-categoriesOut = []
+settingsPath = "./json-dump.json"
 months = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
 years = []
 
-# json.dump(jsonDump, jsonFile)
-
-saveInfo = json.load(jsonFile)
-categoriesIn = saveInfo["Categories In"]
-categoriesOut = saveInfo["Categories Out"]
+# Settings from json-dump.json. They're read the first time one of them is used (or
+# when load_settings is called), not when the module is imported, so the window can
+# come up first.
+settingNames = ("saveInfo", "categoriesIn", "categoriesOut", "storageType", "payeeCategories", "duplicateDays", "expectations", "backupCount")
+
+def load_settings():
+    global saveInfo, categoriesIn, categoriesOut, storageType, payeeCategories, duplicateDays, expectations, backupCount
+    with open(settingsPath, "r") as jsonFile:
+        saveInfo = json.load(jsonFile)
+    categoriesIn = saveInfo["Categories In"]
+    categoriesOut = saveInfo["Categories Out"]
+    storageType = saveInfo.get("Storage", "xlsx")
+    # Statement payee text (matched case-insensitively) to the category it's filed under.
+    payeeCategories = saveInfo.get("Payees", {})
+    # Transactions with the same amount this many days apart are flagged as possible duplicates.
+    duplicateDays = saveInfo.get("Duplicate Days", 3)
+    # Defaults, overrides and recurring rules for the Expected columns, see expectations.py.
+    expectations = saveInfo.setdefault("Expectations", {})
+    # Earlier copies of Tracker.xlsx and each log partition kept in "Tracker Backups"; 0 keeps none.
+    backupCount = saveInfo.get("Backups", 3)
+
+def save_settings():
+    with open(settingsPath, "w") as jsonFile:
+        json.dump(saveInfo, jsonFile, indent=4)
+
+def __getattr__(name):
+    if (name in settingNames):
+        load_settings()
+        return globals()[name]
+    raise AttributeError("module 'global_func' has no attribute '" + name + "'")
 
 windowWidth = 0
 windowHeight = 0
@@ -27,17 +49,28 @@ windowHeight = 0
 def create_widget(parent, widget_type, **options):
     return widget_type(parent, **options)
 
+# Log dates come back from the workbook either as datetimes or as "yyyy-mm-dd" text,
+# depending on what wrote the row. Everything in memory is kept as a datetime.
+def to_datetime(value):
+    if (isinstance(value, datetime.datetime)):
+        return value
+    if (isinstance(value, datetime.date)):
+        return datetime.datetime.combine(value, datetime.time(0, 0, 0))
+    return datetime.datetime.fromisoformat(str(value).strip())
+
+# Chart years, then any log years without a chart, from the storage's manifest or
+# index rather than the log itself.
 def check_years(excelMan):
-    for sheet in excelMan.workbook.sheetnames:
-        if (sheet == "Log"):
-            continue
+    for sheet in excelMan.storage.chart_years():
         years.append(sheet)
+    for year in excelMan.storage.log_years():
+        if (str(year) not in years):
+            years.append(str(year))
         
 
 def setupScreenSize(window, verticalBool = False, squareBool = False, manSize = 0.80):
     windowWidth = window.winfo_screenwidth()
     windowHeight = window.winfo_screenheight()
-    print(windowHeight)
     
     if (verticalBool):
         height = int(windowHeight * manSize)
@@ -60,6 +93,12 @@ def setupScreenSize(window, verticalBool = False, squareBool = False, manSize =
 # Opens the popup to prompt user for a transaction input. Reads the input and sends
 # it to the log_transaction().
 def prompt_for_transaction(window, path, log, editBool, index = None, Transaction = None):
+    import tkinter as tk
+    from tkinter import ttk
+    from tkinter import messagebox
+    # tkcalendar is only needed here, so it isn't imported until the dialog opens.
+    from tkcalendar import DateEntry
+
     top = tk.Toplevel(window)
     top.title("Enter Transaction")
     
@@ -158,7 +197,6 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
     outButton.configure(command= output_transaction)
 
     def submit_transaction():
-        print("Submitting...")
         inputDate = dateIn.get_date()
         fakeTime = datetime.time(0, 0, 0)
         date = datetime.datetime.combine(inputDate, fakeTime)
@@ -167,8 +205,8 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
         amount = amount.replace('$', '')
         try:
             amount = float(amount)
-        except TypeError:
-            print(amount + " -- Type Error")
+        except ValueError:
+            messagebox.showerror("Transaction", "\"" + amount + "\" isn't an amount.", parent=top)
             return
 
         amount = amount * inState
@@ -176,14 +214,15 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
         category = categoryTrace.get()
         description = descriptionIn.get("1.0", tk.END)
 
-        print(str(type(date)) + ": " + str(date))
-        print(str(type(amount)) + ": " + str(amount))
-        print(str(type(category)) + ": " + category)
-        print(str(type(description)) + ": " + description)
-
         if (editBool):
-            log.edit_transaction(path, date, amount, category, description, index)
+            log.edit_transaction(path, date, amount, category, description, Transaction)
         else:
+            exactMatches, nearMatches = log.find_duplicates(date, amount, category, description)
+            matches = exactMatches + nearMatches
+            if (len(matches) > 0):
+                message = "This looks like a transaction already in the log:\n\n" + str(matches[0]) + "\n\nAdd it anyway?"
+                if (not messagebox.askyesno("Possible Duplicate", message, parent=top)):
+                    return
             log.log_transaction(path, date, amount, category, description)
 
         top.destroy()
@@ -213,8 +252,6 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
 
 
     if (editBool):
-        print("edit mode")
-        print("Amount = " + str(Transaction.amount))
         if (Transaction.amount < 0):
             inState = -1
             outButton.configure(state="disabled")
@@ -236,7 +273,6 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
         descriptionIn.configure(state = "normal")
 
         dateIn.set_date(Transaction.date)
-        print(abs(Transaction.amount))
         amountTrace.set('$' + str(abs(Transaction.amount)))
         categoryTrace.set(Transaction.category)
         descriptionIn.delete(1.0, tk.END)
@@ -248,23 +284,101 @@ def prompt_for_transaction(window, path, log, editBool, index = None, Transactio
     categoryTrace.trace_add('write', catCallback)
 
 
-# Not called yet. Will generate the widgets to enter expectations into each category for.
-def generate_expectations(frame, defaultBool, month):
-    frame.columnconfigure(0, weight=1)
-    frame.columnconfigure(1, weight=1)
-
-    inputLabel = create_widget(frame, tk.Label, textvariable=tk.StringVar(value="Input"))
-    inputLabel.grid(row=0, column=0, columnspan=2)
-
-    finalRow = 0
-    for category in range(len(categoriesIn)):
-        categoryLabel = create_widget(frame, tk.Label, textvariable=tk.StringVar(value=categoriesIn[category]))
-        categoryLabel.grid(row=category + 1, column=0)
+# Lists the rows of an import flagged as possible duplicates and waits for the
+# user. Returns the transactions to leave out of the import, or None to cancel it.
+def prompt_for_duplicates(window, flagged):
+    import tkinter as tk
+    from virtual_view import Virtual_View
+    top = tk.Toplevel(window)
+    top.title("Possible Duplicates")
+    setupScreenSize(top, manSize=0.6)
+    top.columnconfigure(0, weight=1)
+    top.rowconfigure(1, weight=1)
+    top.attributes("-topmost", True)
 
-        categoryInput = create_widget(frame, tk.Entry, )
+    exactCount = 0
+    for transaction, exactMatches, nearMatches in flagged:
+        if (len(exactMatches) > 0):
+            exactCount = exactCount + 1
+    summary = str(len(flagged)) + " rows look like transactions already in the log (" + str(exactCount) + " exact)."
+    summaryLabel = create_widget(top, tk.Label, textvariable=tk.StringVar(value=summary))
+    summaryLabel.grid(row=0, column=0, pady=10)
+
+    columns = ("Date", "Amount", "Category", "Description", "Matches")
+    def fetchRows(start, stop):
+        rows = []
+        for i in range(start, min(stop, len(flagged))):
+            transaction, exactMatches, nearMatches = flagged[i]
+            if (len(exactMatches) > 0):
+                match = "Exact: " + str(exactMatches[0].description)
+            else:
+                match = "Near: " + nearMatches[0].date.strftime("%Y-%m-%d") + " " + str(nearMatches[0].description)
+            rows.append(("d" + str(i), (transaction.date.strftime("%Y-%m-%d"), transaction.amount, transaction.category, transaction.description, match)))
+        return rows
+
+    flaggedView = Virtual_View(top, lambda: len(flagged), fetchRows, 20, columns=columns, show="headings")
+    for column in columns:
+        flaggedView.heading(column, text=column)
+        flaggedView.column(column, width=150)
+    flaggedView.grid(row=1, column=0, sticky="nsew")
+
+    result = None
+    def choose(skipped):
+        nonlocal result
+        result = skipped
+        top.destroy()
 
+    buttonFrame = create_widget(top, tk.Frame)
+    buttonFrame.grid(row=2, column=0, pady=10)
+    skipExactButton = create_widget(buttonFrame, tk.Button, text="Skip Exact Duplicates",
+                                    command=lambda: choose([transaction for transaction, exactMatches, nearMatches in flagged if len(exactMatches) > 0]))
+    skipExactButton.grid(row=0, column=0, padx=5)
+    skipAllButton = create_widget(buttonFrame, tk.Button, text="Skip All Flagged", command=lambda: choose([transaction for transaction, exactMatches, nearMatches in flagged]))
+    skipAllButton.grid(row=0, column=1, padx=5)
+    importAllButton = create_widget(buttonFrame, tk.Button, text="Import All", command=lambda: choose([]))
+    importAllButton.grid(row=0, column=2, padx=5)
+    cancelButton = create_widget(buttonFrame, tk.Button, text="Cancel", command=lambda: choose(None))
+    cancelButton.grid(row=0, column=3, padx=5)
+
+    top.protocol("WM_DELETE_WINDOW", lambda: choose(None))
+    top.grab_set()
+    window.wait_window(top)
+    return result
+
+
+# Builds an entry for every in and out category into frame, filled from values
+# ((name, out) to amount). Returns the entries' StringVars keyed the same way.
+def generate_expectations(frame, values):
+    import tkinter as tk
+    frame.columnconfigure(0, weight=1)
+    frame.columnconfigure(1, weight=1)
 
-def prompt_for_expectations(window):
+    traces = {}
+    row = 0
+    for title, categoryList, out in (("Input", categoriesIn, False), ("Output", categoriesOut, True)):
+        sectionLabel = create_widget(frame, tk.Label, textvariable=tk.StringVar(value=title))
+        sectionLabel.grid(row=row, column=0, columnspan=2, pady=5)
+        row = row + 1
+        for category in categoryList:
+            categoryLabel = create_widget(frame, tk.Label, textvariable=tk.StringVar(value=category))
+            categoryLabel.grid(row=row, column=0, sticky="w")
+
+            traces[(category, out)] = tk.StringVar()
+            if (values.get((category, out)) != None):
+                traces[(category, out)].set(str(values[(category, out)]))
+            categoryInput = create_widget(frame, tk.Entry, textvariable=traces[(category, out)], width=12)
+            categoryInput.grid(row=row, column=1, pady=2)
+            row = row + 1
+    return traces
+
+
+# Edits the expectation defaults (left) and the overrides for one month (right);
+# blank means none. Recurring rules are kept as they are in json-dump.json. onSave
+# is called once the settings are written, to refill the charts.
+def prompt_for_expectations(window, onSave = None):
+    import tkinter as tk
+    from tkinter import ttk
+    from tkinter import messagebox
     top = tk.Toplevel(window)
     top.title("Expectations Settings")
     setupScreenSize(top, squareBool= True, manSize= 0.7)
@@ -277,16 +391,207 @@ def prompt_for_expectations(window):
 
     top.attributes("-topmost", True)
 
+    defaults = {}
+    for section, out in (("In", False), ("Out", True)):
+        for name, amount in expectations.get("Defaults", {}).get(section, {}).items():
+            defaults[(name, out)] = amount
+    overrides = {}
+    for override in expectations.get("Overrides", []):
+        overrides[(override["Year"], override["Month"], override["Category"], override.get("Out", True))] = override["Amount"]
+
+    def parse(trace):
+        text = trace.get().strip().replace("$", "").replace(",", "")
+        if (text == ""):
+            return None
+        return float(text)
+
+    defaultLabel = create_widget(top, tk.Label, textvariable=tk.StringVar(value="Every month"))
+    defaultLabel.grid(row=0, column=0)
+
     defaultFrame = create_widget(top, tk.Frame)
     defaultFrame.grid(row=1, column=0)
+    defaultTraces = generate_expectations(defaultFrame, defaults)
+
+    selectFrame = create_widget(top, tk.Frame)
+    selectFrame.grid(row=0, column=1)
+
+    yearChoices = sorted(set([str(curYear)] + [year for year in years if year.isdigit()]))
+    yearSelect = create_widget(selectFrame, ttk.Combobox, values=yearChoices, width=8, state="readonly")
+    yearSelect.grid(row=0, column=0, padx=5)
+    yearSelect.set(str(curYear))
+
+    monthSelect = create_widget(selectFrame, ttk.Combobox, values=months, width=12, state="readonly")
+    monthSelect.grid(row=0, column=1, padx=5)
+    monthSelect.set(months[curMonth - 1])
 
     monthFrame = create_widget(top, tk.Frame)
     monthFrame.grid(row=1, column=1)
+    shown = {"key": None, "traces": {}}
+
+    # Keeps what was typed for the month being left before showing the next one.
+    # Anything that isn't a number keeps that month showing.
+    def show_month(*args):
+        if (shown["key"] != None):
+            year, month = shown["key"]
+            try:
+                amounts = {}
+                for key, trace in shown["traces"].items():
+                    amounts[key] = parse(trace)
+            except ValueError:
+                yearSelect.set(str(year))
+                monthSelect.set(months[month - 1])
+                raise
+            for (name, out), amount in amounts.items():
+                overrides.pop((year, month, name, out), None)
+                if (amount != None):
+                    overrides[(year, month, name, out)] = amount
+        for child in monthFrame.winfo_children():
+            child.destroy()
+        year = int(yearSelect.get())
+        month = months.index(monthSelect.get()) + 1
+        values = {}
+        for (overrideYear, overrideMonth, name, out), amount in overrides.items():
+            if (overrideYear == year and overrideMonth == month):
+                values[(name, out)] = amount
+        shown["key"] = (year, month)
+        shown["traces"] = generate_expectations(monthFrame, values)
+
+    def select_month(*args):
+        try:
+            show_month()
+        except ValueError:
+            messagebox.showerror("Expectations", "Amounts must be numbers.", parent=top)
 
-    yearSelect = create_widget(top, ttk.Combobox, )
+    yearSelect.bind("<<ComboboxSelected>>", select_month)
+    monthSelect.bind("<<ComboboxSelected>>", select_month)
+    show_month()
 
-    monthSelect = create_widget(top, ttk.Combobox, values=months)
-    monthSelect.grid(row=0, column=1)
-    monthSelect.set("Select a month")
+    def save_expectations():
+        try:
+            show_month()
+            savedDefaults = {"In": {}, "Out": {}}
+            for (name, out), trace in defaultTraces.items():
+                amount = parse(trace)
+                if (amount != None and out):
+                    savedDefaults["Out"][name] = amount
+                elif (amount != None):
+                    savedDefaults["In"][name] = amount
+        except ValueError:
+            messagebox.showerror("Expectations", "Amounts must be numbers.", parent=top)
+            return
+        expectations["Defaults"] = savedDefaults
+        expectations["Overrides"] = [{"Year": year, "Month": month, "Category": name, "Out": out, "Amount": amount}
+                                     for (year, month, name, out), amount in sorted(overrides.items())]
+        save_settings()
+        if (onSave != None):
+            onSave()
+        top.destroy()
+
+    buttonFrame = create_widget(top, tk.Frame)
+    buttonFrame.grid(row=2, column=0, columnspan=2)
+    saveButton = create_widget(buttonFrame, tk.Button, text="Save", command=save_expectations)
+    saveButton.grid(row=0, column=0, padx=5)
+    cancelButton = create_widget(buttonFrame, tk.Button, text="Cancel", command=top.destroy)
+    cancelButton.grid(row=0, column=1, padx=5)
+
+
+# Adds, renames, merges and splits categories. onChange(change, name, newName, text)
+# makes an "add", "rename", "merge" or "split" happen in the log, charts and
+# settings and returns how many transactions a split moved; an added category is put
+# in its list before it's called. Names are shared by Input and Output, so a change
+# applies to both.
+def prompt_for_categories(window, onChange):
+    import tkinter as tk
+    from tkinter import ttk
+    from tkinter import messagebox
+    top = tk.Toplevel(window)
+    top.title("Category Settings")
+    setupScreenSize(top, squareBool= True, manSize= 0.5)
+    top.columnconfigure(0,weight=1)
+    top.columnconfigure(1,weight=1)
+
+    top.attributes("-topmost", True)
 
+    def category_names():
+        names = []
+        for category in categoriesIn + categoriesOut:
+            if (category not in names):
+                names.append(category)
+        return names
 
+    categoryTrace = tk.StringVar()
+    nameTrace = tk.StringVar()
+    matchTrace = tk.StringVar()
+    statusTrace = tk.StringVar()
+
+    fields = (("Category:", ttk.Combobox, {"textvariable": categoryTrace, "values": category_names(), "state": "readonly", "width": 18}),
+              ("New or target name:", tk.Entry, {"textvariable": nameTrace, "width": 20}),
+              ("Split off matching:", tk.Entry, {"textvariable": matchTrace, "width": 20}))
+    widgets = []
+    for row in range(len(fields)):
+        labelText, widgetType, options = fields[row]
+        label = create_widget(top, tk.Label, textvariable=tk.StringVar(value=labelText))
+        label.grid(row=row, column=0, sticky="e", pady=5)
+        widget = create_widget(top, widgetType, **options)
+        widget.grid(row=row, column=1, sticky="w", pady=5)
+        widgets.append(widget)
+    categorySelect = widgets[0]
+
+    statusLabel = create_widget(top, tk.Label, textvariable=statusTrace)
+    statusLabel.grid(row=len(fields) + 1, column=0, columnspan=2, pady=5)
+
+    def refresh_names(name):
+        categorySelect.configure(values=category_names())
+        categoryTrace.set(name)
+        nameTrace.set("")
+        matchTrace.set("")
+
+    def add_category(categoryList):
+        name = nameTrace.get().strip()
+        if (name == "" or name in categoryList):
+            messagebox.showerror("Categories", "Enter a name that isn't in that list yet.", parent=top)
+            return
+        categoryList.append(name)
+        onChange("add", name, name, "")
+        refresh_names(name)
+        statusTrace.set("Added " + name)
+
+    def change_category(change):
+        name = categoryTrace.get()
+        newName = nameTrace.get().strip()
+        text = matchTrace.get()
+        if (name == ""):
+            messagebox.showerror("Categories", "Choose a category first.", parent=top)
+            return
+        if (newName == "" or newName == name):
+            messagebox.showerror("Categories", "Enter a different name.", parent=top)
+            return
+        if (change == "merge" and newName not in category_names()):
+            messagebox.showerror("Categories", newName + " isn't a category to merge into.", parent=top)
+            return
+        if (change != "merge" and newName in category_names()):
+            messagebox.showerror("Categories", newName + " is already a category, merge into it instead.", parent=top)
+            return
+        if (change == "split" and text.strip() == ""):
+            messagebox.showerror("Categories", "Enter the description text to split off.", parent=top)
+            return
+        moved = onChange(change, name, newName, text)
+        if (change == "split" and moved == 0):
+            statusTrace.set("No " + name + " transactions match " + text)
+            return
+        if (change == "split"):
+            statusTrace.set("Moved " + str(moved) + " transactions to " + newName)
+            refresh_names(name)
+        else:
+            statusTrace.set(name + " is now " + newName)
+            refresh_names(newName)
+
+    buttonFrame = create_widget(top, tk.Frame)
+    buttonFrame.grid(row=len(fields), column=0, columnspan=2, pady=10)
+    buttons = (("Add Input", lambda: add_category(categoriesIn)), ("Add Output", lambda: add_category(categoriesOut)),
+               ("Rename", lambda: change_category("rename")), ("Merge Into", lambda: change_category("merge")),
+               ("Split", lambda: change_category("split")), ("Close", top.destroy))
+    for column in range(len(buttons)):
+        text, command = buttons[column]
+        button = create_widget(buttonFrame, tk.Button, text=text, command=command)
+        button.grid(row=0, column=column, padx=5)
@@ -0,0 +1,258 @@
+import re
+import csv
+import sys
+import time
+import datetime
+import global_func as gf
+import instrument
+from log import Log, Transaction
+from excel_manager import Excel_Manager
+
+# Bulk import of bank statements, CSV or OFX/QFX. Files are read a chunk of rows at
+# a time and each row is filed under a category from its payee text, then the whole
+# statement goes into the log with Log.log_transactions: one sort of the index and
+# one batched write, instead of a save per row.
+class Statement_Importer:
+    chunkSize = 5000
+    payees = {}
+    stats = None
+    unreadRows = 0
+    dateCache = {}
+    dateFormat = "%Y-%m-%d"
+
+    dateFormats = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%Y/%m/%d", "%m-%d-%Y", "%Y%m%d")
+    dateHeaders = ("date", "posted date", "posting date", "transaction date", "trans. date")
+    amountHeaders = ("amount", "transaction amount")
+    debitHeaders = ("debit", "withdrawal", "withdrawals")
+    creditHeaders = ("credit", "deposit", "deposits")
+    descriptionHeaders = ("description", "payee", "name", "memo", "details")
+
+    def __init__(self, payees = None):
+        if (payees == None):
+            payees = gf.payeeCategories
+        self.payees = {}
+        for payee, category in payees.items():
+            self.payees[payee.lower()] = category
+        self.stats = None
+        self.unreadRows = 0
+        self.dateCache = {}
+
+    # Statements repeat the same few dates over and over, so each distinct text is
+    # only parsed once, trying the format that matched last time first.
+    def parse_date(self, text):
+        date = self.dateCache.get(text)
+        if (date != None):
+            return date
+        formats = (self.dateFormat,) + self.dateFormats
+        for dateFormat in formats:
+            try:
+                date = datetime.datetime.strptime(text.strip(), dateFormat)
+            except ValueError:
+                continue
+            self.dateFormat = dateFormat
+            self.dateCache[text] = date
+            return date
+        raise ValueError("Unrecognised date: " + text)
+
+    # "$1,234.50", "-12.00" and "(12.00)" all parse; blank is None.
+    def parse_amount(self, text):
+        text = text.strip().replace("$", "").replace(",", "")
+        if (text == ""):
+            return None
+        if (text.startswith("(") and text.endswith(")")):
+            return -float(text[1:-1])
+        return float(text)
+
+    # parse_amount, but None when the text doesn't parse either. Rows left without
+    # an amount are skipped and counted in unreadRows.
+    def read_amount(self, text):
+        try:
+            return self.parse_amount(text)
+        except ValueError:
+            return None
+
+    # A column's text in a row, blank when the file has no such column or the row
+    # is too short to have it.
+    def cell(self, row, column):
+        if (column == None or column >= len(row)):
+            return ""
+        return row[column]
+
+    # The first payee pattern found in the description picks the category, as long
+    # as it's one of the categories for that direction; otherwise it goes to Misc
+    # (or the last category of the list).
+    def categorize(self, description, amount):
+        categories = gf.categoriesIn
+        if (amount < 0):
+            categories = gf.categoriesOut
+        text = description.lower()
+        for payee, category in self.payees.items():
+            if (payee in text and category in categories):
+                return category
+        if ("Misc" in categories):
+            return "Misc"
+        return categories[-1]
+
+    def find_column(self, headers, names):
+        for i in range(len(headers)):
+            if (headers[i] in names):
+                return i
+        return None
+
+    # Yields lists of (date, amount, description), chunkSize rows at a time. The
+    # header row picks the columns; a Debit/Credit pair is read as out/in.
+    def read_csv(self, path):
+        with open(path, "r", newline="", encoding="utf-8-sig") as csvFile:
+            reader = csv.reader(csvFile)
+            headers = [header.strip().lower() for header in next(reader)]
+            dateColumn = self.find_column(headers, self.dateHeaders)
+            amountColumn = self.find_column(headers, self.amountHeaders)
+            debitColumn = self.find_column(headers, self.debitHeaders)
+            creditColumn = self.find_column(headers, self.creditHeaders)
+            descriptionColumn = self.find_column(headers, self.descriptionHeaders)
+            if (dateColumn == None or (amountColumn == None and debitColumn == None and creditColumn == None)):
+                raise ValueError(path + " has no date or amount column")
+
+            chunk = []
+            for row in reader:
+                if (self.cell(row, dateColumn).strip() == ""):
+                    continue
+                if (amountColumn != None):
+                    amount = self.read_amount(self.cell(row, amountColumn))
+                else:
+                    amount = None
+                    debit = self.read_amount(self.cell(row, debitColumn))
+                    credit = self.read_amount(self.cell(row, creditColumn))
+                    if (debit != None):
+                        amount = -abs(debit)
+                    if (credit != None and amount == None):
+                        amount = abs(credit)
+                    elif (credit != None):
+                        amount = amount + abs(credit)
+                if (amount == None):
+                    self.unreadRows = self.unreadRows + 1
+                    continue
+                description = self.cell(row, descriptionColumn).strip()
+                chunk.append((self.parse_date(row[dateColumn]), amount, description))
+                if (len(chunk) >= self.chunkSize):
+                    yield chunk
+                    chunk = []
+            if (len(chunk) > 0):
+                yield chunk
+
+    # OFX is SGML and may be all on one line, so the file is read in blocks and each
+    # complete <STMTTRN> record is parsed as soon as it's in the buffer.
+    def read_ofx(self, path):
+        recordEnd = re.compile(r"</STMTTRN>", re.IGNORECASE)
+        field = re.compile(r"<(\w+)>([^<\r\n]*)")
+        buffer = ""
+        chunk = []
+        with open(path, "r", encoding="utf-8", errors="replace") as ofxFile:
+            while True:
+                block = ofxFile.read(65536)
+                buffer = buffer + block
+                position = 0
+                for match in recordEnd.finditer(buffer):
+                    record = buffer[position:match.start()]
+                    position = match.end()
+                    fields = {}
+                    start = max(0, record.upper().rfind("<STMTTRN>"))
+                    for name, value in field.findall(record[start:]):
+                        fields[name.upper()] = value.strip()
+                    if ("DTPOSTED" not in fields or "TRNAMT" not in fields):
+                        continue
+                    amount = self.read_amount(fields["TRNAMT"])
+                    if (amount == None):
+                        self.unreadRows = self.unreadRows + 1
+                        continue
+                    description = fields.get("NAME", fields.get("MEMO", ""))
+                    chunk.append((self.parse_date(fields["DTPOSTED"][:8]), amount, description))
+                    if (len(chunk) >= self.chunkSize):
+                        yield chunk
+                        chunk = []
+                buffer = buffer[position:]
+                if (block == ""):
+                    break
+        if (len(chunk) > 0):
+            yield chunk
+
+    def read(self, path):
+        self.unreadRows = 0
+        if (path.lower().endswith((".ofx", ".qfx"))):
+            return self.read_ofx(path)
+        return self.read_csv(path)
+
+    # Parses and categorizes the whole statement; nothing is added to the log.
+    def read_transactions(self, path):
+        transactions = []
+        for chunk in self.read(path):
+            for date, amount, description in chunk:
+                transactions.append(Transaction(date, amount, self.categorize(description, amount), description))
+        return transactions
+
+    # Rows that exactly match one already in the log or earlier in the statement;
+    # the default when there's no one to ask.
+    def exact_duplicates(self, flagged):
+        return [transaction for transaction, exactMatches, nearMatches in flagged if len(exactMatches) > 0]
+
+    # Imports a statement into the log and returns the stats: rows, skipped,
+    # flagged, unread (rows without a readable amount), seconds and rowsPerSecond,
+    # parsing through to the index update.
+    #
+    # Possible duplicates are flagged before anything is added. review(flagged) gets
+    # the (transaction, exactMatches, nearMatches) list and returns the rows to
+    # leave out, or None to cancel the import. Without it exact duplicates are left
+    # out.
+    def import_file(self, log, path, review = None):
+        startTime = time.perf_counter()
+        transactions = self.read_transactions(path)
+        flagged = log.flag_duplicates(transactions)
+        skipped = []
+        if (len(flagged) > 0):
+            reviewTime = time.perf_counter()
+            if (review == None):
+                skipped = self.exact_duplicates(flagged)
+            else:
+                skipped = review(flagged)
+            # Time spent waiting on the user doesn't count against the import.
+            startTime = startTime + time.perf_counter() - reviewTime
+            if (skipped == None):
+                return None
+        skippedIds = set(id(transaction) for transaction in skipped)
+        transactions = [transaction for transaction in transactions if id(transaction) not in skippedIds]
+        log.log_transactions(transactions)
+        seconds = time.perf_counter() - startTime
+
+        rowsPerSecond = 0
+        if (seconds > 0):
+            rowsPerSecond = len(transactions) / seconds
+        self.stats = {"rows": len(transactions), "skipped": len(skipped), "flagged": len(flagged), "unread": self.unreadRows, "seconds": seconds, "rowsPerSecond": rowsPerSecond}
+        instrument.count("Statement_Importer rows imported", len(transactions))
+        return self.stats
+
+
+# One line about an import's stats, for the command line.
+def describe_stats(path, stats):
+    return ("Imported " + str(stats["rows"]) + " transactions from " + path + " in " + str(round(stats["seconds"], 3)) + "s ("
+            + str(int(stats["rowsPerSecond"])) + " rows/s), " + str(stats["flagged"]) + " flagged as possible duplicates, "
+            + str(stats["skipped"]) + " skipped, " + str(stats["unread"]) + " without an amount")
+
+
+# Headless import: python importer.py statement.csv [more.ofx ...]
+# Loads the tracker once, imports every file and waits for the writes to finish.
+def main(paths, trackerPath = "./Tracker.xlsx"):
+    excelManager = Excel_Manager(trackerPath)
+    log = Log(excelManager)
+    importer = Statement_Importer()
+    for path in paths:
+        print(describe_stats(path, importer.import_file(log, path)))
+    log.compact()
+    excelManager.persistence.close()
+    excelManager.storage.close()
+
+
+if (__name__ == "__main__"):
+    if (len(sys.argv) < 2):
+        print("Usage: python importer.py statement.csv [statement.ofx ...]")
+        sys.exit(1)
+    main(sys.argv[1:])
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+
+# Timers and counters on the hot paths, off unless BUDGET_STATS is set when the app
+# starts:
+#   BUDGET_STATS=1          timers and counters, dumped to BUDGET_STATS_FILE on exit
+#   BUDGET_STATS=profile    the same plus a cProfile capture next to it (.prof)
+# BUDGET_STATS_FILE defaults to budget-stats.json.
+#
+# Off, @timed hands back the function untouched and timer()/count() return straight
+# away, so the instrumented code runs as if nothing was there. Timings can come from
+# the persistence thread too, so recording takes a lock.
+mode = os.environ.get("BUDGET_STATS", "").strip().lower()
+enabled = mode not in ("", "0", "off", "false")
+statsPath = os.environ.get("BUDGET_STATS_FILE", "budget-stats.json")
+
+timings = {}
+counters = {}
+lock = threading.Lock()
+profiler = None
+
+
+def record(name, seconds):
+    with lock:
+        timing = timings.get(name)
+        if (timing == None):
+            timing = {"count": 0, "total": 0.0, "max": 0.0}
+            timings[name] = timing
+        timing["count"] = timing["count"] + 1
+        timing["total"] = timing["total"] + seconds
+        if (seconds > timing["max"]):
+            timing["max"] = seconds
+
+
+def count(name, amount = 1):
+    if (not enabled):
+        return
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+
+# Decorator timing every call of a function under name (its qualified name by default).
+def timed(name = None):
+    def decorate(function):
+        if (not enabled):
+            return function
+        timerName = name
+        if (timerName == None):
+            timerName = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            startTime = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(timerName, time.perf_counter() - startTime)
+        return wrapper
+    return decorate
+
+
+class Timer:
+    name = None
+    startTime = 0
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        record(self.name, time.perf_counter() - self.startTime)
+        return False
+
+
+class No_Timer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+noTimer = No_Timer()
+
+
+# Context manager timing a block: with instrument.timer("Log.replay"): ...
+def timer(name):
+    if (not enabled):
+        return noTimer
+    return Timer(name)
+
+
+def stats():
+    with lock:
+        snapshot = {"timings": {}, "counters": dict(counters)}
+        for name, timing in timings.items():
+            snapshot["timings"][name] = {"count": timing["count"], "total": timing["total"], "max": timing["max"],
+                                         "mean": timing["total"] / timing["count"]}
+    return snapshot
+
+
+def reset():
+    with lock:
+        timings.clear()
+        counters.clear()
+
+
+def dump(path = None):
+    if (path == None):
+        path = statsPath
+    with open(path, "w") as statsFile:
+        json.dump(stats(), statsFile, indent=4, sort_keys=True)
+    if (profiler != None):
+        profiler.disable()
+        profiler.dump_stats(os.path.splitext(path)[0] + ".prof")
+        profiler.enable()
+
+
+def finish():
+    global profiler
+    dump()
+    if (profiler != None):
+        profiler.disable()
+        profiler = None
+    print("Stats written to " + statsPath, file=sys.stderr)
+
+
+if (enabled):
+    if (mode == "profile"):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(finish)
+
+
+# Debug window with a row per timer and counter. Refresh re-reads them; Dump writes
+# the stats file now instead of waiting for exit.
+def show_window(window):
+    import tkinter as tk
+    from tkinter import ttk
+    top = tk.Toplevel(window)
+    top.title("Stats")
+    top.columnconfigure(0, weight=1)
+    top.rowconfigure(0, weight=1)
+
+    columns = ("Name", "Count", "Total ms", "Mean ms", "Max ms")
+    statsView = ttk.Treeview(top, columns=columns, show="headings", height=25)
+    for column in columns:
+        statsView.heading(column, text=column)
+        statsView.column(column, width=110)
+    statsView.column("Name", width=280)
+    statsView.grid(row=0, column=0, sticky="nsew")
+
+    def refresh():
+        statsView.delete(*statsView.get_children())
+        snapshot = stats()
+        for name in sorted(snapshot["timings"]):
+            timing = snapshot["timings"][name]
+            statsView.insert('', tk.END, values=(name, timing["count"], round(timing["total"] * 1000, 2), round(timing["mean"] * 1000, 3), round(timing["max"] * 1000, 2)))
+        for name in sorted(snapshot["counters"]):
+            statsView.insert('', tk.END, values=(name, snapshot["counters"][name], "", "", ""))
+
+    buttonFrame = tk.Frame(top)
+    buttonFrame.grid(row=1, column=0, pady=5)
+    refreshButton = tk.Button(buttonFrame, text="Refresh", command=refresh)
+    refreshButton.grid(row=0, column=0, padx=5)
+    dumpButton = tk.Button(buttonFrame, text="Dump to " + statsPath, command=lambda: dump())
+    dumpButton.grid(row=0, column=1, padx=5)
+    refresh()
+    return top
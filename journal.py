@@ -0,0 +1,91 @@
+import os
+import json
+import global_func as gf
+
+# Append-only record of every add/edit/delete made to the log since the last time
+# it was compacted into the workbook. Each record is one JSON line and is fsync'd
+# before the call returns, so a change is durable without rewriting Tracker.xlsx.
+# With sync=False the fsync is left to a later sync() call, so a burst of records
+# shares one.
+class Journal:
+    path = None
+    file = None
+    seq = 0
+    count = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.seq = 0
+        self.count = 0
+
+    def encode(self, transaction):
+        return {"date": transaction.date.isoformat(), "amount": transaction.amount,
+                "category": transaction.category, "description": transaction.description}
+
+    def decode(self, values):
+        return (gf.to_datetime(values["date"]), values["amount"], values["category"], values["description"])
+
+    def append(self, op, old = None, new = None, sync = True):
+        self.seq = self.seq + 1
+        record = {"seq": self.seq, "op": op}
+        if (old != None):
+            record["old"] = self.encode(old)
+        if (new != None):
+            record["new"] = self.encode(new)
+
+        if (self.file == None):
+            self.file = open(self.path, "a", encoding="utf-8")
+        self.file.write(json.dumps(record) + "\n")
+        self.count = self.count + 1
+        if (sync):
+            self.sync()
+
+    def sync(self):
+        if (self.file != None):
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    # Returns the records written after baseSeq. A torn last line from a crash
+    # mid-write is ignored, everything before it was already fsync'd. It's also cut
+    # off the file, so the next append starts a line of its own instead of being
+    # glued onto it and lost with it on the next replay.
+    def read(self, baseSeq = 0):
+        records = []
+        self.seq = baseSeq
+        if (not os.path.exists(self.path)):
+            return records
+        with open(self.path, "rb+") as journalFile:
+            end = 0
+            lastLine = b""
+            for line in journalFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                end = end + len(line)
+                lastLine = line
+                self.seq = max(self.seq, record["seq"])
+                if (record["seq"] > baseSeq):
+                    records.append(record)
+            journalFile.seek(0, os.SEEK_END)
+            if (journalFile.tell() > end or (end > 0 and not lastLine.endswith(b"\n"))):
+                journalFile.seek(end)
+                journalFile.truncate()
+                if (end > 0 and not lastLine.endswith(b"\n")):
+                    journalFile.write(b"\n")
+                journalFile.flush()
+                os.fsync(journalFile.fileno())
+        self.count = len(records)
+        return records
+
+    def clear(self):
+        self.close()
+        if (os.path.exists(self.path)):
+            os.remove(self.path)
+        self.count = 0
+
+    def close(self):
+        if (self.file != None):
+            self.file.close()
+            self.file = None
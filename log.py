@@ -1,121 +1,525 @@
-import pandas as pd
-import tkinter as tk
+import sys
+import time
+import bisect
+import datetime
 import global_func as gf
+from actuals import Running_Totals, log_actuals
+from duplicates import Duplicate_Index
+from search import Search_Index
+from analytics import Rolling_Analytics
+import categories
+import instrument
 
+# Slotted so a log of 100k+ transactions stays small in memory. The category is
+# kept as its code in the category registry and read back as its current name.
 class Transaction:
-    date = None
-    amount = 0
-    category = ""
-    description = ""
-
-    def __init__(self, date = None, amount = None, category = None, description = None, logSheet = None, index = None):
-        if (date != None):
-            self.date = date
-            self.amount = amount
-            self.category = category
-            self.description = description
-        else:
-            logVals = list(logSheet.values)
-            self.date = logVals[index][0]
-            self.amount = logVals[index][1]
-            self.category = logVals[index][2]
-            self.description = logVals[index][3]
-            print(self.date)
-            print(self.amount)
-            print(self.category)
-            print(self.description)
+    __slots__ = ("date", "amount", "categoryCode", "description", "seq", "storageId")
+
+    def __init__(self, date, amount, category, description):
+        self.date = gf.to_datetime(date)
+        self.amount = amount
+        self.category = category
+        self.description = description
+        self.seq = 0
+        self.storageId = None
+
+    @property
+    def category(self):
+        return categories.registry.name(self.categoryCode)
+
+    @category.setter
+    def category(self, name):
+        self.categoryCode = categories.registry.code(name)
+
+    def values(self):
+        return (self.date, self.amount, self.category, self.description)
 
     def __str__(self):
         return "Date: " + str(self.date) + ", Amount: $" + str(self.amount) + ", Category: " + str(self.category) + ", Description: " + str(self.description)
 
 
+# Keeps the log's transactions in date order so an insert, a removal or a date range
+# query is a bisection instead of a re-sort of the whole log. Transactions on the same
+# date stay in insertion order through a running sequence number.
+class Log_Index:
+    keys = []
+    transactions = []
+    yearCounts = {}
+    nextSeq = 0
+    columnCache = None
+
+    def __init__(self):
+        self.keys = []
+        self.transactions = []
+        self.yearCounts = {}
+        self.nextSeq = 0
+        self.columnCache = None
+
+    def __len__(self):
+        return len(self.transactions)
+
+    # A transaction that already has a sequence number (an edited one) keeps it, so
+    # it keeps its identity in the views.
+    def insert(self, transaction):
+        if (transaction.seq == 0):
+            self.nextSeq = self.nextSeq + 1
+            transaction.seq = self.nextSeq
+        key = (transaction.date, transaction.seq)
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.transactions.insert(i, transaction)
+        self.columnCache = None
+
+        year = transaction.date.year
+        self.yearCounts[year] = self.yearCounts.get(year, 0) + 1
+        return i
+
+    # Bulk load for startup: one sort over everything instead of one bisection per row.
+    def load(self, transactions):
+        for transaction in transactions:
+            self.nextSeq = self.nextSeq + 1
+            transaction.seq = self.nextSeq
+            year = transaction.date.year
+            self.yearCounts[year] = self.yearCounts.get(year, 0) + 1
+        transactions.sort(key=lambda transaction: (transaction.date, transaction.seq))
+        self.transactions = transactions
+        self.keys = [(transaction.date, transaction.seq) for transaction in transactions]
+        self.columnCache = None
+
+    # Bulk insert for imports: the new transactions are appended and the whole list
+    # sorted once, which is close to linear since the old part is already in order.
+    def extend(self, transactions):
+        for transaction in transactions:
+            self.nextSeq = self.nextSeq + 1
+            transaction.seq = self.nextSeq
+            year = transaction.date.year
+            self.yearCounts[year] = self.yearCounts.get(year, 0) + 1
+        self.transactions.extend(transactions)
+        self.transactions.sort(key=lambda transaction: (transaction.date, transaction.seq))
+        self.keys = [(transaction.date, transaction.seq) for transaction in self.transactions]
+        self.columnCache = None
+
+    def memory_size(self):
+        size = sys.getsizeof(self.keys) + sys.getsizeof(self.transactions)
+        for i in range(len(self.transactions)):
+            size = size + sys.getsizeof(self.keys[i]) + sys.getsizeof(self.transactions[i])
+        return size
+
+    def remove(self, transaction):
+        i = bisect.bisect_left(self.keys, (transaction.date, transaction.seq))
+        if (i == len(self.keys) or self.transactions[i] is not transaction):
+            return None
+        del self.keys[i]
+        del self.transactions[i]
+        self.columnCache = None
+
+        year = transaction.date.year
+        self.yearCounts[year] = self.yearCounts[year] - 1
+        if (self.yearCounts[year] == 0):
+            del self.yearCounts[year]
+        return i
+
+    # Finds a transaction by its (date, amount, category, description) values, only
+    # looking at the transactions that share its date.
+    def find(self, values):
+        date = values[0]
+        i = bisect.bisect_left(self.keys, (date,))
+        while (i < len(self.keys) and self.keys[i][0] == date):
+            if (self.transactions[i].values() == values):
+                return self.transactions[i]
+            i = i + 1
+        return None
+
+    # Transactions from start (inclusive) up to end (exclusive), oldest first.
+    def range(self, start = None, end = None):
+        first = 0
+        last = len(self.keys)
+        if (start != None):
+            first = bisect.bisect_left(self.keys, (gf.to_datetime(start),))
+        if (end != None):
+            last = bisect.bisect_left(self.keys, (gf.to_datetime(end),))
+        return self.transactions[first:last]
+
+    def years(self):
+        return sorted(self.yearCounts)
+
+
 class Log:
-    logTransactions = []
+    logColumns = ("Date", "Amount", "Category", "Description")
+    transactionIndex = None
     log_view = None
     log_popup = None
 
     excelMan = None
-    logSheet = None
+    storage = None
+    persistence = None
+    loadStats = None
+    changeListeners = []
+    bulkListeners = []
+    runningTotals = None
+    analytics = None
+    duplicates = None
+    search = None
+    searchFilter = None
+    searchResults = None
+
+    # Milliseconds between background compactions of pending changes into storage.
+    compactInterval = 60000
 
     def __init__(self, excelMan):
         self.excelMan = excelMan
-        self.load_log(excelMan.workbook)
-
-    def createLog(self):
-        self.logSheet = self.excelMan.workbook.create_sheet("Log")
-        self.logSheet.cell(row=1, column=1, value = "Date")
-        self.logSheet.cell(row=1, column=2, value = "Amount")
-        self.logSheet.cell(row=1, column=3, value = "Category")
-        self.logSheet.cell(row=1, column=4, value = "Description")
-
-    def load_log(self, workbook):
-        if ("Log" in workbook.sheetnames):
-            self.logSheet = workbook["Log"]
-            logValues = list(self.logSheet.values)
-            for i in range(1, len(logValues)):
-                newTrans = Transaction(logSheet = self.logSheet, index = i)
-                self.logTransactions.append(newTrans)
+        self.transactionIndex = Log_Index()
+        self.changeListeners = []
+        self.bulkListeners = []
+        self.storage = excelMan.storage
+        self.persistence = excelMan.persistence
+        self.load_log()
+
+    @instrument.timed()
+    def load_log(self):
+        # Timed from before the storage is read, since some storages parse the whole
+        # sheet up front rather than as the rows are taken.
+        startTime = time.perf_counter()
+        self.read_rows(self.storage.read_rows())
+        self.loadStats = {"rows": len(self.transactionIndex), "seconds": time.perf_counter() - startTime}
+        # Walking every transaction for its size is only worth it when stats are on.
+        if (instrument.enabled):
+            self.loadStats["bytes"] = self.transactionIndex.memory_size()
+            instrument.record("Log load (storage read)", self.loadStats["seconds"])
+            instrument.count("Log bytes", self.loadStats["bytes"])
+        self.replay_pending()
+        self.runningTotals = Running_Totals(log_actuals(self))
+        self.analytics = Rolling_Analytics(self.transactionIndex)
+        self.duplicates = Duplicate_Index()
+        self.duplicates.add_all(self.transactionIndex.transactions)
+        self.search = Search_Index()
+        self.search.add_all(self.transactionIndex.transactions)
+
+    # One line for the status bar: rows and seconds, and memory when stats are on.
+    def load_summary(self):
+        summary = "Loaded " + str(self.loadStats["rows"]) + " transactions in " + str(round(self.loadStats["seconds"], 2)) + "s"
+        if ("bytes" in self.loadStats):
+            summary = summary + ", ~" + str(self.loadStats["bytes"] // 1024) + " KB"
+        return summary
+
+    # Single pass over the stored rows, oldest first. Rows on the same day share one
+    # datetime object, so each distinct date is only parsed once.
+    @instrument.timed()
+    def read_rows(self, rows):
+        dateCache = {}
+        transactions = []
+        for date, amount, category, description, storageId in rows:
+            if (date == None):
+                continue
+            parsedDate = dateCache.get(date)
+            if (parsedDate == None):
+                parsedDate = gf.to_datetime(date)
+                dateCache[date] = parsedDate
+            transaction = Transaction(parsedDate, amount, category, description)
+            transaction.storageId = storageId
+            transactions.append(transaction)
+        self.transactionIndex.load(transactions)
+        instrument.count("Log rows loaded", len(transactions))
+
+    # Re-applies changes the storage took but never compacted, e.g. after a crash.
+    @instrument.timed()
+    def replay_pending(self):
+        for oldValues, newValues in self.storage.pending_changes():
+            if (oldValues != None):
+                self.remove_transaction(oldValues)
+            if (newValues != None):
+                date, amount, category, description = newValues
+                self.transactionIndex.insert(Transaction(date, amount, category, description))
+
+    def remove_transaction(self, values):
+        date, amount, category, description = values
+        transaction = self.transactionIndex.find((date, amount, categories.registry.resolve(category), description))
+        if (transaction != None):
+            self.transactionIndex.remove(transaction)
+        return transaction
+
+    # The log is kept in date order already, so sorting by date is just a walk over
+    # the index. Only used when the sheet is written out.
+    @instrument.timed()
+    def sort_logs(self, columnName, acending):
+        if (columnName == "Date"):
+            if (acending):
+                return list(self.transactionIndex.transactions)
+            return list(reversed(self.transactionIndex.transactions))
+        column = self.logColumns.index(columnName)
+        return sorted(self.transactionIndex.transactions, key=lambda transaction: transaction.values()[column], reverse=not acending)
+
+    # Position as shown in the Log view, which lists the newest transaction first.
+    def display_position(self, i):
+        return len(self.transactionIndex) - 1 - i
+
+    # Rows in the Log view, only the search results while a search is on.
+    def view_count(self):
+        if (self.searchResults != None):
+            return len(self.searchResults)
+        return len(self.transactionIndex)
+
+    def transaction_at(self, position):
+        if (self.searchResults != None):
+            return self.searchResults[position]
+        return self.transactionIndex.transactions[len(self.transactionIndex) - 1 - position]
+
+    # Unfiltered, the view is told exactly which row changed. While a search is on
+    # it's run again instead, since the change may have entered or left the results.
+    def update_view(self, change):
+        if (self.log_view == None):
+            return
+        if (self.searchResults != None):
+            self.searchResults = self.search.query(self.transactionIndex, **self.searchFilter)
+            self.log_view.refresh()
         else:
-            self.createLog()
+            change()
 
-    def sort_logs(self, path, columnName, acending):
-        logFrame = pd.read_excel(path, sheet_name="Log")
-        logFrame = logFrame.sort_values(by=columnName, ascending=acending)
-        logFrame.to_excel(path, sheet_name="Log", index=False)
+    # Filters the Log view. text is matched against description words, category is
+    # one category name, start/end bound the date and minAmount/maxAmount the
+    # absolute amount; None or "" leaves a filter off. Returns the match count.
+    @instrument.timed()
+    def set_search(self, text = "", category = None, start = None, end = None, minAmount = None, maxAmount = None):
+        self.searchFilter = {"text": text, "category": category, "start": start, "end": end, "minAmount": minAmount, "maxAmount": maxAmount}
+        if (text.strip() == "" and category == None and start == None and end == None and minAmount == None and maxAmount == None):
+            self.searchResults = None
+        else:
+            self.searchResults = self.search.query(self.transactionIndex, **self.searchFilter)
+        if (self.log_view != None):
+            self.log_view.scroll_to(0)
+            self.log_view.refresh()
+        return self.view_count()
 
+    @instrument.timed()
     def log_transaction(self, path, date, amount, category, description):
-        newTransaction = Transaction(date=date, amount=amount, category=category, description=description)
-        self.logTransactions.append(newTransaction)
-        self.logSheet.append([date, amount, category, description])
-        self.excelMan.workbook.save("Tracker.xlsx")
-        self.sort_logs(path, "Date", False)
-        self.excelMan.load_path()
-        self.logSheet = self.excelMan.workbook["Log"]
-        
-        if (self.log_view != None):
-            self.excelMan.destroy_sheet(self.log_view)
-            self.log_view = self.excelMan.make_excelView("Log", self.log_popup)
-            self.log_view.grid(row=0, column=1)
+        newTransaction = Transaction(date, amount, category, description)
+        position = self.display_position(self.transactionIndex.insert(newTransaction))
+        self.persist(self.storage.add, newTransaction)
+        self.notify_change(None, newTransaction)
+        self.update_view(lambda: self.log_view.insert_row(position))
 
+    @instrument.timed()
+    def edit_transaction(self, path, date, amount, category, description, oldTransaction):
+        oldIndex = self.transactionIndex.remove(oldTransaction)
+        if (oldIndex == None):
+            # Deleted while the edit dialog was open.
+            self.log_transaction(path, date, amount, category, description)
+            return
+        # Position the old row had before it was removed.
+        oldPosition = len(self.transactionIndex) - oldIndex
 
-    def edit_transaction(self, path, date, amount, category, description, index):
-        self.logSheet.delete_rows(index)
-        self.log_transaction(path, date, amount, category, description)
+        newTransaction = Transaction(date, amount, category, description)
+        newTransaction.seq = oldTransaction.seq
+        newPosition = self.display_position(self.transactionIndex.insert(newTransaction))
+        self.persist(self.storage.edit, oldTransaction, newTransaction)
+        self.notify_change(oldTransaction, newTransaction)
+        self.update_view(lambda: self.log_view.move_row(oldPosition, newPosition))
+
+    # Adds many transactions at once, e.g. from a statement import: one sort of the
+    # index, one batched write, and the bulk listeners are called once with the list
+    # instead of the change listeners once per row.
+    @instrument.timed()
+    def log_transactions(self, transactions):
+        if (len(transactions) == 0):
+            return
+        self.transactionIndex.extend(transactions)
+        self.persist(self.storage.add_many, transactions)
+        for transaction in transactions:
+            self.runningTotals.apply(transaction, 1)
+            self.analytics.apply(transaction, 1)
+            self.duplicates.add(transaction)
+        self.search.add_all(transactions)
+        self.update_view(lambda: self.log_view.refresh())
+        for listener in self.bulkListeners:
+            listener(transactions)
+
+    # Transactions already in the log that a new entry may duplicate, as
+    # (exactMatches, nearMatches).
+    def find_duplicates(self, date, amount, category, description):
+        return self.duplicates.matches(Transaction(date, amount, category, description))
+
+    # Checks a batch about to be added against the log and against the rows before
+    # it in the batch. Returns (transaction, exactMatches, nearMatches) for each row
+    # that matched anything.
+    @instrument.timed()
+    def flag_duplicates(self, transactions):
+        batch = Duplicate_Index(self.duplicates.windowDays)
+        flagged = []
+        for transaction in transactions:
+            exactMatches, nearMatches = self.duplicates.matches(transaction)
+            batchExact, batchNear = batch.matches(transaction)
+            exactMatches = exactMatches + batchExact
+            nearMatches = nearMatches + batchNear
+            if (len(exactMatches) > 0 or len(nearMatches) > 0):
+                flagged.append((transaction, exactMatches, nearMatches))
+            batch.add(transaction)
+        return flagged
+
+    # Hands a change to the persistence thread; the Tk thread never waits on a write.
+    # args are the transactions it touches, or a list of them, whose years the
+    # storage marks as changed.
+    def persist(self, task, *args):
+        years = set()
+        for arg in args:
+            if (isinstance(arg, Transaction)):
+                years.add(arg.date.year)
+            else:
+                for transaction in arg:
+                    years.add(transaction.date.year)
+        self.storage.mark_dirty(years)
+        self.persistence.submit(task, *args)
+
+    # Keeps the running totals, analytics, duplicate and search indexes up to date,
+    # then calls the listeners with (oldTransaction, newTransaction); old is None for
+    # an add and new is None for a delete.
+    def notify_change(self, oldTransaction, newTransaction):
+        if (oldTransaction != None):
+            self.runningTotals.apply(oldTransaction, -1)
+            self.analytics.apply(oldTransaction, -1)
+            self.duplicates.remove(oldTransaction)
+            self.search.remove(oldTransaction)
+        if (newTransaction != None):
+            self.runningTotals.apply(newTransaction, 1)
+            self.analytics.apply(newTransaction, 1)
+            self.duplicates.add(newTransaction)
+            self.search.add(newTransaction)
+        for listener in self.changeListeners:
+            listener(oldTransaction, newTransaction)
+
+    # Runs from the background timer and on exit.
+    @instrument.timed()
+    def compact(self):
+        self.storage.compact(self)
+
+    def schedule_compaction(self, window):
+        self.compact()
+        window.after(self.compactInterval, lambda: self.schedule_compaction(window))
+
+    # Rows for the Log view between two display positions, newest first.
+    @instrument.timed()
+    def get_rows(self, start, stop):
+        stop = min(stop, self.view_count())
+        rows = []
+        for position in range(start, stop):
+            transaction = self.transaction_at(position)
+            rows.append(("t" + str(transaction.seq), (transaction.date.strftime("%Y-%m-%d"), transaction.amount, transaction.category, transaction.description)))
+        return rows
+
+    def make_view(self, window):
+        return self.excelMan.make_listView(self.logColumns, self.view_count, self.get_rows, window)
 
-    
     def edit_row(self, window):
         try:
-            selection = self.log_view.selection()[0]
-            intSelection = int("0x" + selection[1:], 16)
-
-            selection_trans = Transaction(logSheet=self.logSheet, index=intSelection)
-            gf.prompt_for_transaction(window, self.excelMan.path, self, True, intSelection + 1, selection_trans)
-
-            # self.excelMan.workbook.save("Tracker.xlsx")
-            # self.excelMan.load_path()
-            # self.logSheet = self.excelMan.workbook["Log"]
-            # self.excelMan.destroy_sheet(self.log_view)
-            # self.log_view = self.excelMan.make_excelView("Log", self.log_popup)
-            # self.log_view.grid(row = 0, column=1)
+            intSelection = self.log_view.selection_index()
+
+            selection_trans = self.transaction_at(intSelection)
+            gf.prompt_for_transaction(window, self.excelMan.path, self, True, intSelection, selection_trans)
         except:
             return
 
 
     def delete_row(self):
         try:
-            selection = self.log_view.selection()[0]
-            intSelection = int("0x" + selection[1:], 16) + 1
-            self.logSheet.delete_rows(intSelection)
-            self.excelMan.workbook.save("Tracker.xlsx")
-            self.excelMan.load_path()
-            self.logSheet = self.excelMan.workbook["Log"]
-            self.excelMan.destroy_sheet(self.log_view)
-            self.log_view = self.excelMan.make_excelView("Log", self.log_popup)
-            self.log_view.grid(row = 0, column=1)
+            intSelection = self.log_view.selection_index()
+            self.delete_transaction(self.transaction_at(intSelection), intSelection)
         except:
             return
 
+    # position is where the row sits in the Log view, if it's showing.
+    @instrument.timed()
+    def delete_transaction(self, oldTransaction, position = None):
+        if (self.transactionIndex.remove(oldTransaction) == None):
+            return
+        self.persist(self.storage.delete, oldTransaction)
+        self.notify_change(oldTransaction, None)
+        if (position != None):
+            self.update_view(lambda: self.log_view.remove_row(position))
+        else:
+            self.update_view(lambda: self.log_view.refresh())
+
+    # Renames a category. Transactions hold its code, so none of them change; xlsx
+    # rows stored under the old name are mapped on load by the aliases the registry
+    # keeps, and sqlite renames its one categories row.
+    @instrument.timed()
+    def rename_category(self, oldName, newName):
+        self.rewrite_category_code(categories.registry.rename(oldName, newName))
+        self.persistence.submit(self.storage.rename_category, oldName, newName)
+        self.recategorized(oldName, newName)
+
+    # Files every transaction of source under target, the same way as a rename.
+    @instrument.timed()
+    def merge_category(self, source, target):
+        categories.registry.merge(source, target)
+        self.persistence.submit(self.storage.merge_category, source, target)
+        self.recategorized(source, target)
+
+    # A category added with a name that was renamed or merged away gets a code of its
+    # own instead of reading as where the old one went.
+    def add_category(self, name):
+        self.rewrite_category_code(categories.registry.free(name))
+
+    # Writes the transactions under a freed alias's code again, under the name they
+    # read as now, and compacts straight away so no stored row keeps the alias's name
+    # once it means another category.
+    def rewrite_category_code(self, code):
+        if (code == None):
+            return
+        newTransactions = []
+        oldTransactions = []
+        for transaction in self.transactionIndex.transactions:
+            if (transaction.categoryCode == code):
+                oldTransaction = Transaction(*transaction.values())
+                oldTransaction.seq = transaction.seq
+                oldTransaction.storageId = transaction.storageId
+                oldTransactions.append(oldTransaction)
+                newTransactions.append(transaction)
+        if (len(newTransactions) == 0):
+            return
+        self.persist(self.storage.edit_many, oldTransactions, newTransactions)
+        self.compact()
+
+    def recategorized(self, oldName, newName):
+        self.runningTotals.rename_category(oldName, newName)
+        self.search.rename_category(oldName, newName)
+        self.duplicates.rebuild_exact()
+        if (self.searchFilter != None and self.searchFilter["category"] == oldName):
+            self.searchFilter["category"] = newName
+        self.update_view(lambda: self.log_view.refresh())
+
+    # Moves the transactions of a category whose descriptions match text (as in the
+    # search box) to a new category. Only those are edited and written, as one batch.
+    # Returns the moved transactions.
+    @instrument.timed()
+    def split_category(self, name, newName, text):
+        candidates = self.search.candidates(text, name)
+        if (text.strip() == "" or candidates == None or len(candidates) == 0):
+            return []
+        self.add_category(newName)
+        newTransactions = sorted(candidates, key=lambda transaction: (transaction.date, transaction.seq))
+        oldTransactions = []
+        for transaction in newTransactions:
+            self.runningTotals.apply(transaction, -1)
+            self.analytics.apply(transaction, -1)
+            self.duplicates.remove(transaction)
+            self.search.remove(transaction)
+            oldTransaction = Transaction(*transaction.values())
+            oldTransaction.seq = transaction.seq
+            oldTransaction.storageId = transaction.storageId
+            oldTransactions.append(oldTransaction)
+
+            transaction.category = newName
+            self.runningTotals.apply(transaction, 1)
+            self.analytics.apply(transaction, 1)
+            self.duplicates.add(transaction)
+            self.search.add(transaction)
+        self.transactionIndex.columnCache = None
+        self.persist(self.storage.edit_many, oldTransactions, newTransactions)
+        self.update_view(lambda: self.log_view.refresh())
+        return newTransactions
+
+    @instrument.timed()
     def display_log(self, window):
+        import tkinter as tk
         top = tk.Toplevel(window)
         top.title("Log")
 
@@ -127,14 +531,16 @@ class Log:
 
         top.attributes('-topmost', True)
 
-        logDisplay = self.excelMan.make_excelView("Log", top)
-        logDisplay.grid(row=0, column=1)
+        self.display_search(top)
+
+        logDisplay = self.make_view(top)
+        logDisplay.grid(row=1, column=1)
 
         self.log_view = logDisplay
         self.log_popup = top
 
         buttonFrame = gf.create_widget(top, tk.Frame)
-        buttonFrame.grid(row=1, column=1)
+        buttonFrame.grid(row=2, column=1)
         buttonFrame.columnconfigure(0, weight=1)
         buttonFrame.columnconfigure(1, weight=1)
 
@@ -147,18 +553,73 @@ class Log:
 
         top.protocol("WM_DELETE_WINDOW", lambda: self.remove_log(top))
 
+    # Search box and filters above the Log view. Every keystroke reruns the search;
+    # a date or amount that doesn't parse yet (half typed) leaves that filter off.
+    def display_search(self, top):
+        import tkinter as tk
+        from tkinter import ttk
+        searchFrame = gf.create_widget(top, tk.Frame)
+        searchFrame.grid(row=0, column=1, pady=5)
+
+        searchTrace = tk.StringVar()
+        categoryTrace = tk.StringVar(value="All")
+        startTrace = tk.StringVar()
+        endTrace = tk.StringVar()
+        minTrace = tk.StringVar()
+        maxTrace = tk.StringVar()
+        countTrace = tk.StringVar(value=str(len(self.transactionIndex)) + " transactions")
+
+        categoryChoices = ["All"]
+        for category in gf.categoriesIn + gf.categoriesOut:
+            if (category not in categoryChoices):
+                categoryChoices.append(category)
+
+        fields = (("Search:", tk.Entry, {"textvariable": searchTrace, "width": 25}),
+                  ("Category:", ttk.Combobox, {"textvariable": categoryTrace, "values": categoryChoices, "state": "readonly", "width": 15}),
+                  ("From:", tk.Entry, {"textvariable": startTrace, "width": 11}),
+                  ("To:", tk.Entry, {"textvariable": endTrace, "width": 11}),
+                  ("Min $:", tk.Entry, {"textvariable": minTrace, "width": 8}),
+                  ("Max $:", tk.Entry, {"textvariable": maxTrace, "width": 8}))
+        column = 0
+        for labelText, widgetType, options in fields:
+            label = gf.create_widget(searchFrame, tk.Label, text=labelText)
+            label.grid(row=0, column=column)
+            field = gf.create_widget(searchFrame, widgetType, **options)
+            field.grid(row=0, column=column + 1, padx=5)
+            column = column + 2
+        countLabel = gf.create_widget(searchFrame, tk.Label, textvariable=countTrace)
+        countLabel.grid(row=1, column=0, columnspan=column)
+
+        def parse(trace, parser):
+            try:
+                return parser(trace.get().strip())
+            except ValueError:
+                return None
+
+        def dayAfter(text):
+            return gf.to_datetime(text) + datetime.timedelta(days=1)
+
+        def apply_search(*args):
+            category = categoryTrace.get()
+            if (category == "All"):
+                category = None
+            # "To" is inclusive of the day typed.
+            count = self.set_search(searchTrace.get(), category, parse(startTrace, gf.to_datetime), parse(endTrace, dayAfter),
+                                    parse(minTrace, float), parse(maxTrace, float))
+            countTrace.set(str(count) + " of " + str(len(self.transactionIndex)) + " transactions")
+
+        for trace in (searchTrace, categoryTrace, startTrace, endTrace, minTrace, maxTrace):
+            trace.trace_add("write", apply_search)
+
     def get_years(self):
-        years = []
-        for transactions in self.logTransactions:
-            if (transactions.date.year not in years):
-                years.append(transactions.date.year)
-        years.sort()
-        return years
+        return self.transactionIndex.years()
     
-    def get_transactions(self):
-        return self.logTransactions
+    def get_transactions(self, start = None, end = None):
+        return self.transactionIndex.range(start, end)
 
     def remove_log(self, top):
         self.log_view = None
         self.log_popup = None
+        self.searchFilter = None
+        self.searchResults = None
         top.destroy()
\ No newline at end of file
@@ -0,0 +1,151 @@
+import queue
+import threading
+import instrument
+
+# Runs storage writes on a thread of their own so a save never holds up the Tk
+# mainloop. Changes are submitted as tasks and written in the order they came in.
+# Everything queued while the worker was busy is taken as one burst: tasks with a
+# key are dropped when a later task in the burst has the same key (a newer snapshot
+# of the same thing), and the rest run inside one storage batch, so a burst of
+# edits is a single commit or journal fsync.
+#
+# Tasks only ever see snapshots taken on the UI thread, never live widgets or
+# sheets. Their outcomes come back through a second queue that poll() drains from
+# Tk's after(), so done callbacks and status listeners always run on the UI thread.
+#
+# A burst that starts with a keyed task (a whole-file save) waits coalesceWindow
+# seconds first, so saves asked for in quick succession, e.g. one per chart sheet,
+# are written once. Unkeyed changes behind it wait too, but never longer than that,
+# and flush() cuts the wait short.
+#
+# hold() keeps the worker from writing until release(), so everything submitted in
+# between goes out as one burst; the batch CLI uses it to write once at the end.
+class Persistence_Worker:
+    storage = None
+    tasks = None
+    results = None
+    thread = None
+    released = None
+    hurry = None
+    statusListeners = []
+    pollInterval = 200
+    coalesceWindow = 0.5
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.statusListeners = []
+        self.released = threading.Event()
+        self.released.set()
+        self.hurry = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="persistence", daemon=True)
+        self.thread.start()
+
+    # done(error) is called on the UI thread once the task has been written, with
+    # None or the exception it raised.
+    def submit(self, task, *args, key = None, done = None):
+        self.tasks.put((task, args, key, done))
+
+    def run(self):
+        while True:
+            burst = [self.tasks.get()]
+            self.released.wait()
+            if (burst[0][2] != None):
+                self.hurry.wait(self.coalesceWindow)
+            while True:
+                try:
+                    burst.append(self.tasks.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            tasks = []
+            for item in burst:
+                if (item[0] == None):
+                    stop = True
+                else:
+                    tasks.append(item)
+            merged = self.merge(tasks)
+            instrument.count("Persistence_Worker tasks written", len(merged))
+            instrument.count("Persistence_Worker tasks merged away", len(tasks) - len(merged))
+            self.write(merged)
+            for item in burst:
+                self.tasks.task_done()
+            if (stop):
+                return
+
+    def merge(self, tasks):
+        lastIndex = {}
+        for i in range(len(tasks)):
+            if (tasks[i][2] != None):
+                lastIndex[tasks[i][2]] = i
+        merged = []
+        for i in range(len(tasks)):
+            if (tasks[i][2] == None or lastIndex[tasks[i][2]] == i):
+                merged.append(tasks[i])
+        return merged
+
+    @instrument.timed()
+    def write(self, tasks):
+        if (len(tasks) == 0):
+            return
+        outcomes = []
+        self.storage.begin_batch()
+        for task, args, key, done in tasks:
+            try:
+                task(*args)
+                outcomes.append((done, None))
+            except Exception as error:
+                outcomes.append((done, error))
+        try:
+            self.storage.end_batch()
+        except Exception as error:
+            # Nothing in the batch made it to disk.
+            outcomes = [(done, error) for done, taskError in outcomes]
+        for outcome in outcomes:
+            self.results.put(outcome)
+
+    # Runs done callbacks and tells the status listeners (written, errors) about
+    # every task finished since the last call.
+    def drain(self):
+        written = 0
+        errors = []
+        while True:
+            try:
+                done, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if (done != None):
+                done(error)
+            if (error != None):
+                instrument.count("Persistence_Worker tasks failed")
+                errors.append(error)
+            else:
+                written = written + 1
+        if (written > 0 or len(errors) > 0):
+            for listener in self.statusListeners:
+                listener(written, errors)
+
+    def hold(self):
+        self.released.clear()
+
+    def release(self):
+        self.released.set()
+
+    def poll(self, window):
+        self.drain()
+        window.after(self.pollInterval, lambda: self.poll(window))
+
+    # Blocks until everything submitted so far is on disk.
+    def flush(self):
+        self.release()
+        self.hurry.set()
+        self.tasks.join()
+        self.hurry.clear()
+        self.drain()
+
+    def close(self):
+        self.flush()
+        self.tasks.put((None, (), None, None))
+        self.thread.join()
@@ -0,0 +1,137 @@
+import re
+import bisect
+import global_func as gf
+
+# Inverted index over the log for the Log view's search box. Description words map
+# to the set of transactions that use them, and the words are also kept sorted so
+# the word still being typed matches as a prefix with a bisection. Categories get a
+# set each. Built once when the log loads and updated by Log on every change.
+class Search_Index:
+    tokens = {}
+    sortedTokens = []
+    categories = {}
+
+    tokenPattern = re.compile(r"[a-z0-9]+")
+
+    def __init__(self):
+        self.tokens = {}
+        self.sortedTokens = []
+        self.categories = {}
+
+    def split(self, text):
+        return self.tokenPattern.findall(str(text or "").lower())
+
+    def add(self, transaction):
+        for token in set(self.split(transaction.description)):
+            matches = self.tokens.get(token)
+            if (matches == None):
+                matches = set()
+                self.tokens[token] = matches
+                bisect.insort(self.sortedTokens, token)
+            matches.add(transaction)
+        self.categories.setdefault(transaction.category, set()).add(transaction)
+
+    # Bulk build: the sorted word list is made once at the end.
+    def add_all(self, transactions):
+        tokens = self.tokens
+        categories = self.categories
+        split = self.split
+        for transaction in transactions:
+            for token in split(transaction.description):
+                matches = tokens.get(token)
+                if (matches == None):
+                    matches = set()
+                    tokens[token] = matches
+                matches.add(transaction)
+            matches = categories.get(transaction.category)
+            if (matches == None):
+                matches = set()
+                categories[transaction.category] = matches
+            matches.add(transaction)
+        self.sortedTokens = sorted(tokens)
+
+    def remove(self, transaction):
+        for token in set(self.split(transaction.description)):
+            matches = self.tokens.get(token)
+            if (matches == None):
+                continue
+            matches.discard(transaction)
+            if (len(matches) == 0):
+                del self.tokens[token]
+                i = bisect.bisect_left(self.sortedTokens, token)
+                if (i < len(self.sortedTokens) and self.sortedTokens[i] == token):
+                    del self.sortedTokens[i]
+        matches = self.categories.get(transaction.category)
+        if (matches != None):
+            matches.discard(transaction)
+            if (len(matches) == 0):
+                del self.categories[transaction.category]
+
+    # Files a category's transactions under another name, joining any already there.
+    def rename_category(self, oldName, newName):
+        matches = self.categories.pop(oldName, None)
+        if (matches == None):
+            return
+        if (newName in self.categories):
+            self.categories[newName].update(matches)
+        else:
+            self.categories[newName] = matches
+
+    # Every transaction with a word starting with prefix.
+    def prefix_matches(self, prefix):
+        i = bisect.bisect_left(self.sortedTokens, prefix)
+        words = []
+        while (i < len(self.sortedTokens) and self.sortedTokens[i].startswith(prefix)):
+            words.append(self.tokens[self.sortedTokens[i]])
+            i = i + 1
+        if (len(words) == 1):
+            return words[0]
+        return set().union(*words)
+
+    # The set of transactions matching the text and category, or None when neither
+    # narrows anything down. Whole words must match exactly, the last word (the one
+    # being typed) as a prefix.
+    def candidates(self, text, category = None):
+        words = self.split(text)
+        sets = []
+        if (category != None):
+            sets.append(self.categories.get(category, set()))
+        if (len(words) > 0):
+            if (text[-1:].isalnum()):
+                for word in words[:-1]:
+                    sets.append(self.tokens.get(word, set()))
+                sets.append(self.prefix_matches(words[-1]))
+            else:
+                for word in words:
+                    sets.append(self.tokens.get(word, set()))
+        if (len(sets) == 0):
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    # Matching transactions newest first, as the Log view lists them. Dates bound the
+    # range like Log_Index.range (start inclusive, end exclusive); amounts bound the
+    # absolute amount, so 50 to 100 finds money in and out alike.
+    def query(self, transactionIndex, text = "", category = None, start = None, end = None, minAmount = None, maxAmount = None):
+        candidates = self.candidates(text, category)
+        if (candidates == None):
+            transactions = transactionIndex.range(start, end)
+        elif (len(candidates) * 8 > len(transactionIndex)):
+            # Most of the log matches, a walk over it in order beats a sort.
+            transactions = [transaction for transaction in transactionIndex.range(start, end) if transaction in candidates]
+        else:
+            transactions = sorted(candidates, key=lambda transaction: (transaction.date, transaction.seq))
+            if (start != None):
+                start = gf.to_datetime(start)
+            if (end != None):
+                end = gf.to_datetime(end)
+            if (start != None or end != None):
+                transactions = [transaction for transaction in transactions
+                                if (start == None or transaction.date >= start) and (end == None or transaction.date < end)]
+
+        if (minAmount != None or maxAmount != None):
+            transactions = [transaction for transaction in transactions
+                            if transaction.amount != None and (minAmount == None or abs(transaction.amount) >= minAmount)
+                            and (maxAmount == None or abs(transaction.amount) <= maxAmount)]
+        transactions.reverse()
+        return transactions
@@ -0,0 +1,385 @@
+import os
+import sys
+import json
+import hmac
+import secrets
+import bisect
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+import global_func as gf
+from excel_manager import Excel_Manager
+from log import Log
+from expectations import Expectations
+import instrument
+
+# Headless local HTTP service over the same Log and Excel_Manager the Tk app uses,
+# for front ends like budget-electron that should only fetch the rows they show:
+#
+#   python service.py [--port 8765] [--path ./Tracker.xlsx] [--origin http://localhost:5173]
+#                     [--token-file token.txt]
+#
+#   GET    /years                        log and chart years
+#   GET    /transactions                 one page, newest first
+#          ?limit=100&cursor=...&order=asc|desc&start=2024-01-01&end=2025-01-01
+#          &text=kroger&category=Groceries&minAmount=10&maxAmount=50
+#   GET    /aggregates?year=2024         monthly actual, expected and variance per category
+#   GET    /charts/2024                  the year chart sheet's rows
+#   POST   /transactions                 {"date", "amount", "category", "description"}
+#   POST   /transactions/<id>            the same, replacing that transaction
+#   DELETE /transactions/<id>
+#
+# Pages carry nextCursor, the id of their last row, instead of an offset, so a
+# transaction added or deleted while paging doesn't shift the next page. An id is
+# "<date>/<key>" and stays the same across restarts: the key is the storage id when
+# the backend has one (sqlite), otherwise a hash of the amount and description,
+# numbered when a date has more than one alike. Found with a bisection to the date.
+#
+# The log is the user's whole financial history, and any web page can send
+# requests to localhost, so every request must carry the token made at launch in an
+# X-Budget-Token header; it's printed and, with --token-file, written where the
+# front end can read it. Browsers are only let in from --origin, the front end's own
+# origin, which is echoed back; without it no cross-origin page is allowed at all.
+#
+# Everything is loaded once and kept open, and each request gets a thread. The log
+# isn't safe to share between threads, so the data access itself is taken in turn
+# under a lock; a page is a bisection and a slice, so it's held for a moment. Don't
+# run this and bank.py on the same files at the same time.
+class Query_Service:
+    excelMan = None
+    log = None
+    lock = None
+    stopped = None
+
+    defaultLimit = 100
+    maxLimit = 1000
+
+    def __init__(self, path):
+        self.excelMan = Excel_Manager(path)
+        self.log = Log(self.excelMan)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.excelMan.refresh_snapshot(self.log)
+
+    # Stands in for the Tk after() loop: finished writes are drained and pending
+    # changes compacted on a timer thread, under the same lock as the requests.
+    def start_background(self):
+        def poll():
+            while (not self.stopped.wait(self.excelMan.persistence.pollInterval / 1000)):
+                with self.lock:
+                    self.excelMan.persistence.drain()
+
+        def compact():
+            while (not self.stopped.wait(self.log.compactInterval / 1000)):
+                with self.lock:
+                    self.log.compact()
+
+        threading.Thread(target=poll, name="service-poll", daemon=True).start()
+        threading.Thread(target=compact, name="service-compact", daemon=True).start()
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            self.log.compact()
+            self.excelMan.refresh_snapshot(self.log)
+            self.excelMan.persistence.close()
+            self.excelMan.storage.close()
+
+    def transaction_id(self, transaction):
+        return transaction.date.isoformat() + "/" + self.stable_key(transaction)
+
+    def stable_key(self, transaction):
+        if (transaction.storageId != None):
+            return str(transaction.storageId)
+        digest = content_digest(transaction)
+        n = 0
+        for other in self.same_date(transaction.date):
+            if (other is transaction):
+                break
+            if (other.storageId == None and content_digest(other) == digest):
+                n = n + 1
+        return "h" + digest + "." + str(n)
+
+    # The log's transactions on date, in the index's order.
+    def same_date(self, date):
+        index = self.log.transactionIndex
+        first = bisect.bisect_left(index.keys, (date,))
+        last = bisect.bisect_right(index.keys, (date, float("inf")))
+        return index.transactions[first:last]
+
+    def lookup(self, transactionId):
+        date, key = transactionId.rsplit("/", 1)
+        for transaction in self.same_date(gf.to_datetime(date)):
+            if (self.stable_key(transaction) == key):
+                return transaction
+        return None
+
+    # The index key of the row a cursor names. A row deleted since stands for its
+    # whole date, so the page goes on from the next date.
+    def cursor_key(self, cursor, order):
+        transaction = self.lookup(cursor)
+        if (transaction != None):
+            return (transaction.date, transaction.seq)
+        date = gf.to_datetime(cursor.rsplit("/", 1)[0])
+        if (order == "asc"):
+            return (date, float("inf"))
+        return (date,)
+
+    def transaction_json(self, transaction):
+        return {"id": self.transaction_id(transaction), "date": transaction.date.strftime("%Y-%m-%d"), "amount": transaction.amount,
+                "category": transaction.category, "description": transaction.description}
+
+    def find(self, transactionId):
+        transaction = self.lookup(transactionId)
+        if (transaction == None):
+            raise LookupError("No transaction " + transactionId)
+        return transaction
+
+    # One page of transactions oldest first (order=asc) or newest first, after the
+    # row the cursor names. Without a text, category or amount filter it's a slice
+    # of the index; with one, the search index narrows the log down first.
+    @instrument.timed()
+    def page(self, limit = None, cursor = None, order = "desc", start = None, end = None,
+             text = "", category = None, minAmount = None, maxAmount = None):
+        if (limit == None):
+            limit = self.defaultLimit
+        limit = max(1, min(int(limit), self.maxLimit))
+        if (start != None):
+            start = gf.to_datetime(start)
+        if (end != None):
+            end = gf.to_datetime(end)
+        if (minAmount != None):
+            minAmount = float(minAmount)
+        if (maxAmount != None):
+            maxAmount = float(maxAmount)
+
+        index = self.log.transactionIndex
+        if (text.strip() != "" or category != None or minAmount != None or maxAmount != None):
+            transactions = self.log.search.query(index, text, category, start, end, minAmount, maxAmount)
+            transactions.reverse()
+            keys = [(transaction.date, transaction.seq) for transaction in transactions]
+            first = 0
+            last = len(transactions)
+        else:
+            transactions = index.transactions
+            keys = index.keys
+            first = 0
+            last = len(keys)
+            if (start != None):
+                first = bisect.bisect_left(keys, (start,))
+            if (end != None):
+                last = bisect.bisect_left(keys, (end,))
+        total = max(0, last - first)
+
+        if (order == "asc"):
+            if (cursor != None):
+                first = max(first, bisect.bisect_right(keys, self.cursor_key(cursor, order)))
+            stop = min(last, first + limit)
+            rows = transactions[first:stop]
+            more = stop < last
+        else:
+            if (cursor != None):
+                last = min(last, bisect.bisect_left(keys, self.cursor_key(cursor, order)))
+            stop = max(first, last - limit)
+            rows = transactions[stop:last]
+            rows.reverse()
+            more = stop > first
+
+        nextCursor = None
+        if (more and len(rows) > 0):
+            nextCursor = self.transaction_id(rows[-1])
+        return {"rows": [self.transaction_json(transaction) for transaction in rows], "nextCursor": nextCursor, "total": total}
+
+    def years(self):
+        return {"log": self.log.get_years(), "charts": self.excelMan.storage.chart_years()}
+
+    # Actuals are read from the running totals Log keeps up to date, so nothing is
+    # regrouped; expected comes from the expectations grid and variance is actual
+    # minus expected.
+    @instrument.timed()
+    def aggregates(self, year):
+        year = int(year)
+        totals = self.log.runningTotals
+        expected = Expectations().compute([year])
+        result = {"year": year, "in": {}, "out": {}, "expectedIn": {}, "expectedOut": {}, "varianceIn": {}, "varianceOut": {},
+                  "totalIn": totals.section_months(year, False).tolist(), "totalOut": totals.section_months(year, True).tolist()}
+        sections = (("in", "expectedIn", "varianceIn", gf.categoriesIn, False), ("out", "expectedOut", "varianceOut", gf.categoriesOut, True))
+        for actualKey, expectedKey, varianceKey, names, out in sections:
+            for name in names:
+                actual = totals.category_months(year, name, out)
+                expectedMonths = expected.category_months(year, name, out)
+                result[actualKey][name] = actual.tolist()
+                result[expectedKey][name] = expectedMonths.tolist()
+                result[varianceKey][name] = (actual - expectedMonths).tolist()
+        return result
+
+    def chart(self, year):
+        if (not self.excelMan.has_sheet(str(year))):
+            raise LookupError("No chart for " + str(year))
+        sheet = self.excelMan.read_sheet(str(year))
+        return {"year": int(year), "rows": [list(values) for values in sheet.iter_rows(min_row=1, values_only=True)]}
+
+    # Writes go through before the response, so a new row already has its storage id
+    # (and so its lasting id) when the front end pages to it.
+    def add(self, body):
+        self.log.log_transaction(self.excelMan.path, gf.to_datetime(body["date"]), float(body["amount"]), body["category"], body.get("description"))
+        self.excelMan.persistence.flush()
+        return {"written": True}
+
+    def edit(self, transactionId, body):
+        oldTransaction = self.find(transactionId)
+        self.log.edit_transaction(self.excelMan.path, gf.to_datetime(body["date"]), float(body["amount"]), body["category"],
+                                  body.get("description"), oldTransaction)
+        self.excelMan.persistence.flush()
+        return {"written": True}
+
+    def delete(self, transactionId):
+        self.log.delete_transaction(self.find(transactionId))
+        self.excelMan.persistence.flush()
+        return {"written": True}
+
+    # (status, result) for a request; the handler only does HTTP. Ids hold a "/" of
+    # their own, so everything after /transactions/ is the id.
+    def handle(self, method, path, query, body):
+        parts = [part for part in path.split("/") if part != ""]
+        if (len(parts) > 2 and parts[0] == "transactions"):
+            parts = ["transactions", "/".join(parts[1:])]
+        with self.lock:
+            if (method == "GET" and parts == ["years"]):
+                return 200, self.years()
+            if (method == "GET" and parts == ["transactions"]):
+                return 200, self.page(**query)
+            if (method == "GET" and parts == ["aggregates"]):
+                return 200, self.aggregates(query["year"])
+            if (method == "GET" and len(parts) == 2 and parts[0] == "charts"):
+                return 200, self.chart(parts[1])
+            if (method == "POST" and parts == ["transactions"]):
+                return 201, self.add(body)
+            if (method == "POST" and len(parts) == 2 and parts[0] == "transactions"):
+                return 200, self.edit(parts[1], body)
+            if (method == "DELETE" and len(parts) == 2 and parts[0] == "transactions"):
+                return 200, self.delete(parts[1])
+        return 404, {"error": "Not found: " + method + " " + path}
+
+
+# Hash of what makes a transaction itself, leaving out the category so a rename
+# doesn't change ids. The amount is taken as a float and a missing description as
+# blank, since a workbook may hold either and a compaction writes them back as that.
+def content_digest(transaction):
+    description = transaction.description
+    if (description == None):
+        description = ""
+    return hashlib.sha1(repr((float(transaction.amount), description)).encode("utf-8")).hexdigest()[:12]
+
+
+class Service_Handler(BaseHTTPRequestHandler):
+    service = None
+    token = None
+    origin = None
+
+    # The front end's origin when it's the one asking, else nothing, so browsers
+    # keep every other page's requests and responses apart from the service.
+    def send_origin(self):
+        if (self.origin != None and self.headers.get("Origin") == self.origin):
+            self.send_header("Access-Control-Allow-Origin", self.origin)
+            self.send_header("Vary", "Origin")
+
+    def authorized(self):
+        token = self.headers.get("X-Budget-Token", "")
+        return hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def respond(self, method):
+        if (not self.authorized()):
+            self.send_json(401, {"error": "Missing or wrong X-Budget-Token"})
+            return
+        url = urlsplit(self.path)
+        query = {}
+        for name, values in parse_qs(url.query).items():
+            query[name] = values[-1]
+        try:
+            body = None
+            length = int(self.headers.get("Content-Length", 0))
+            if (length > 0):
+                body = json.loads(self.rfile.read(length))
+            status, result = self.service.handle(method, unquote(url.path), query, body)
+        except KeyError as error:
+            status, result = 400, {"error": "Missing " + str(error)}
+        except LookupError as error:
+            status, result = 404, {"error": str(error)}
+        except (ValueError, TypeError) as error:
+            status, result = 400, {"error": str(error)}
+        self.send_json(status, result)
+
+    def send_json(self, status, result):
+        data = json.dumps(result, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_origin()
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+    def do_DELETE(self):
+        self.respond("DELETE")
+
+    # Preflights carry no token; only the front end's origin is answered.
+    def do_OPTIONS(self):
+        if (self.origin == None or self.headers.get("Origin") != self.origin):
+            self.send_response(403)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(204)
+        self.send_origin()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, X-Budget-Token")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        return
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serves the budget log over local HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", default="./Tracker.xlsx")
+    parser.add_argument("--origin", default=None, help="The front end's origin, the only one browsers are let in from.")
+    parser.add_argument("--token-file", default=None, help="Writes the launch's access token here, readable by the user only.")
+    args = parser.parse_args(argv)
+
+    token = secrets.token_urlsafe(32)
+    if (args.token_file != None):
+        descriptor = os.open(args.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "w") as tokenFile:
+            tokenFile.write(token)
+
+    gf.load_settings()
+    service = Query_Service(args.path)
+    service.start_background()
+    Service_Handler.service = service
+    Service_Handler.token = token
+    Service_Handler.origin = args.origin
+    server = ThreadingHTTPServer((args.host, args.port), Service_Handler)
+    print("Serving " + args.path + " on http://" + args.host + ":" + str(args.port))
+    if (args.token_file == None):
+        print("X-Budget-Token: " + token)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if (__name__ == "__main__"):
+    main(sys.argv[1:])
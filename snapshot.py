@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import itertools
+import datetime
+import numpy as np
+import openpyxl as opxl
+from storage import sheet_merges
+
+# Binary copy of what a cold start reads from the xlsx files, in "Tracker Cache"
+# next to Tracker.xlsx: the log as one .npy array per column, opened memory-mapped,
+# and the year chart sheets as JSON. Categories and descriptions are stored as codes
+# into a table of their distinct values, so repeated payees are only kept once.
+#
+# meta.json records the size, mtime and sha256 of every file the snapshot was made
+# from (Tracker.xlsx, the partition manifest and the partitions). It's only used
+# while they all still match; a file with a new mtime but the same size is hashed
+# before it's given up on, so a copy or a touch doesn't force a rebuild. meta.json is
+# written last and removed first, so a half written snapshot is never read.
+class Snapshot_Cache:
+    excelMan = None
+    directory = None
+    meta = None
+    valid = False
+
+    version = 1
+    columns = ("dates", "amounts", "categories", "descriptions")
+
+    def __init__(self, excelMan):
+        self.excelMan = excelMan
+        self.directory = os.path.splitext(excelMan.path)[0] + " Cache"
+        self.meta = None
+        self.valid = False
+
+    def file_path(self, name):
+        return os.path.join(self.directory, name)
+
+    # The files a snapshot is made from, relative to Tracker.xlsx's folder.
+    def sources(self):
+        sources = []
+        baseDir = os.path.dirname(os.path.abspath(self.excelMan.path))
+        if (os.path.exists(self.excelMan.path)):
+            sources.append(self.excelMan.path)
+        manifest = self.excelMan.read_manifest()
+        if (manifest != None):
+            sources.append(self.excelMan.manifest_path())
+            for year in manifest["years"]:
+                if (os.path.exists(self.excelMan.partition_path(year))):
+                    sources.append(self.excelMan.partition_path(year))
+        return [os.path.relpath(os.path.abspath(source), baseDir) for source in sources]
+
+    def source_path(self, source):
+        return os.path.join(os.path.dirname(os.path.abspath(self.excelMan.path)), source)
+
+    def file_hash(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as sourceFile:
+            for block in iter(lambda: sourceFile.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # The previous fingerprint is reused when size and mtime haven't moved.
+    def fingerprint(self, source, previous = None):
+        stat = os.stat(self.source_path(source))
+        if (previous != None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns):
+            return previous
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": self.file_hash(self.source_path(source))}
+
+    def matches(self, source, recorded):
+        stat = os.stat(self.source_path(source))
+        if (stat.st_size != recorded["size"]):
+            return False
+        if (stat.st_mtime_ns == recorded["mtime"]):
+            return True
+        return self.file_hash(self.source_path(source)) == recorded["sha256"]
+
+    # Reads meta.json and checks it against the files on disk. Sets and returns valid.
+    def load(self):
+        self.valid = False
+        self.meta = None
+        if (not os.path.exists(self.file_path("meta.json"))):
+            return False
+        try:
+            with open(self.file_path("meta.json"), "r") as metaFile:
+                meta = json.load(metaFile)
+            if (meta.get("version") != self.version or sorted(meta["sources"]) != sorted(self.sources())):
+                return False
+            for source, recorded in meta["sources"].items():
+                if (not self.matches(source, recorded)):
+                    return False
+        except (OSError, ValueError, KeyError):
+            return False
+        self.meta = meta
+        self.valid = True
+        return True
+
+    # (name, rows, merges) for each year chart, in sheet order.
+    def charts(self):
+        with open(self.file_path("charts.json"), "r") as chartsFile:
+            charts = json.load(chartsFile)
+        return [(chart["name"], chart["rows"], chart["merges"]) for chart in charts]
+
+    # The log as storage rows, oldest first. The arrays are memory-mapped and turned
+    # into Python values a column at a time.
+    def rows(self):
+        arrays = {}
+        for column in self.columns:
+            arrays[column] = np.load(self.file_path(column + ".npy"), mmap_mode="r")
+        with open(self.file_path("tables.json"), "r") as tablesFile:
+            tables = json.load(tablesFile)
+
+        dates = arrays["dates"].tolist()
+        amounts = arrays["amounts"].tolist()
+        if (np.isnan(arrays["amounts"]).any()):
+            amounts = [None if amount != amount else amount for amount in amounts]
+        categoryTable = tables["categories"]
+        categories = [categoryTable[code] for code in arrays["categories"].tolist()]
+        descriptionTable = tables["descriptions"]
+        descriptions = [descriptionTable[code] for code in arrays["descriptions"].tolist()]
+        return zip(dates, amounts, categories, descriptions, itertools.repeat(None))
+
+    def encode(self, values):
+        table = []
+        codes = {}
+        encoded = np.empty(len(values), dtype=np.int32)
+        for i in range(len(values)):
+            code = codes.get(values[i])
+            if (code == None):
+                code = len(table)
+                codes[values[i]] = code
+                table.append(values[i])
+            encoded[i] = code
+        return encoded, table
+
+    def save_array(self, name, array):
+        tempPath = self.file_path(name + ".npy.saving")
+        with open(tempPath, "wb") as arrayFile:
+            np.save(arrayFile, array)
+        self.excelMan.replace_file(tempPath, self.file_path(name + ".npy"))
+
+    def save_json(self, name, value):
+        tempPath = self.file_path(name + ".saving")
+        with open(tempPath, "w") as jsonFile:
+            json.dump(value, jsonFile, default=str)
+        self.excelMan.replace_file(tempPath, self.file_path(name))
+
+    # Runs on the persistence thread, after every write queued before it, so the
+    # files it fingerprints are the ones the data came from. transactions are the
+    # log oldest first, sheets come from Excel_Manager.snapshot_sheets and seq is
+    # the journal seq the log includes, which replay starts after.
+    def write(self, transactions, sheets, seq):
+        charts = []
+        source = None
+        for sheetName, rows, merges in sheets:
+            if (sheetName == "Log"):
+                continue
+            if (rows == None):
+                if (source == None):
+                    source = opxl.load_workbook(self.excelMan.path, read_only=True)
+                rows = list(source[sheetName].iter_rows(min_row=1, values_only=True))
+                merges = sheet_merges(source[sheetName])
+            charts.append({"name": sheetName, "rows": [list(values) for values in rows], "merges": merges})
+        if (source != None):
+            source.close()
+
+        previous = {}
+        if (self.meta != None):
+            previous = self.meta["sources"]
+        fingerprints = {}
+        for sourceName in self.sources():
+            fingerprints[sourceName] = self.fingerprint(sourceName, previous.get(sourceName))
+
+        os.makedirs(self.directory, exist_ok=True)
+        if (os.path.exists(self.file_path("meta.json"))):
+            os.remove(self.file_path("meta.json"))
+
+        self.save_array("dates", np.array([transaction.date for transaction in transactions], dtype="datetime64[us]"))
+        amounts = [transaction.amount for transaction in transactions]
+        self.save_array("amounts", np.array([np.nan if amount == None else amount for amount in amounts], dtype=np.float64))
+        categories, categoryTable = self.encode([transaction.category for transaction in transactions])
+        self.save_array("categories", categories)
+        descriptions, descriptionTable = self.encode([transaction.description for transaction in transactions])
+        self.save_array("descriptions", descriptions)
+        self.save_json("tables.json", {"categories": categoryTable, "descriptions": descriptionTable})
+        self.save_json("charts.json", charts)
+
+        meta = {"version": self.version, "seq": seq, "rows": len(transactions), "sheets": [sheetName for sheetName, rows, merges in sheets],
+                "written": datetime.datetime.now().isoformat(), "sources": fingerprints}
+        self.save_json("meta.json", meta)
+        self.meta = meta
@@ -0,0 +1,502 @@
+import os
+import re
+import json
+import sqlite3
+import datetime
+import openpyxl as opxl
+import global_func as gf
+from journal import Journal
+
+# Storage backends behind Excel_Manager. Both hand the log to Log as
+# (date, amount, category, description, storageId) rows, oldest first, take each
+# add/edit/delete as it happens, and keep the year chart sheets.
+#
+# Once the log is loaded, writes only run on the persistence thread: add, edit,
+# delete and the batch calls are submitted there by Log, and compact/save_chart
+# take their snapshot on the UI thread and submit the write.
+
+# Merged ranges of a sheet as strings. Read-only sheets don't parse them, so they're
+# read straight out of the sheet's xml in the workbook archive.
+def sheet_merges(sheet):
+    if (hasattr(sheet, "merged_cells")):
+        merges = []
+        for mergedRange in sheet.merged_cells.ranges:
+            merges.append(str(mergedRange))
+        return merges
+    sheetXml = sheet.parent._archive.read(sheet._worksheet_path).decode("utf-8")
+    return re.findall(r'<(?:\w+:)?mergeCell ref="([^"]+)"', sheetXml)
+
+
+# The log in per-year partition files managed by Excel_Manager, plus a journal of
+# changes since the last compaction; Tracker.xlsx keeps one sheet per year chart.
+# A compaction only rewrites the partitions of the years that changed, so an edit
+# to this month never rewrites past years.
+#
+# A workbook from before partitions has the whole log in its Log sheet. It's read
+# from there and the first compaction splits it up; after that the Log sheet is
+# only written by an export.
+class Xlsx_Storage:
+    excelMan = None
+    journal = None
+    batchDepth = 0
+    manifest = None
+    manifestSeq = 0
+    partitionSeqs = {}
+    dirtyYears = set()
+    chartsDirty = False
+
+    def __init__(self, excelMan):
+        self.excelMan = excelMan
+        self.journal = Journal(os.path.splitext(excelMan.path)[0] + ".journal")
+        self.batchDepth = 0
+        self.manifest = None
+        self.manifestSeq = 0
+        self.partitionSeqs = {}
+        self.dirtyYears = set()
+        self.chartsDirty = False
+
+    def identifier_seq(self, identifier):
+        if (identifier != None and identifier.startswith("journal:")):
+            return int(identifier[len("journal:"):])
+        return 0
+
+    def read_rows(self):
+        self.manifest = self.excelMan.read_manifest()
+        if (self.manifest != None):
+            self.partitioned()
+        if (self.excelMan.snapshot.valid):
+            # Everything up to the snapshot's seq is in it, whichever year.
+            self.manifestSeq = self.excelMan.snapshot.meta["seq"]
+            return self.excelMan.snapshot.rows()
+        if (self.manifest == None):
+            self.manifestSeq = self.identifier_seq(self.excelMan.workbook.properties.identifier)
+            return self.read_log_sheet()
+        self.manifestSeq = self.manifest["seq"]
+        return self.read_partitions()
+
+    # Streams the Log sheet from the read-only workbook; it's never loaded for writing.
+    def read_log_sheet(self):
+        if (not self.excelMan.has_sheet("Log")):
+            return []
+        rows = list(self.excelMan.read_sheet("Log").iter_rows(min_row=2, max_col=4, values_only=True))
+        # The sheet is written newest first, reading it bottom up keeps ties on the
+        # same date in the order they were saved.
+        rows.reverse()
+        return [(date, amount, category, description, None) for date, amount, category, description in rows]
+
+    # The partitions oldest year first, each one only opened once the year before
+    # it has been read, so together they come out in date order without a merge.
+    def read_partitions(self):
+        for year in sorted(int(year) for year in self.manifest["years"]):
+            if (not os.path.exists(self.excelMan.partition_path(year))):
+                continue
+            partition = self.excelMan.read_partition(year)
+            self.partitionSeqs[year] = self.identifier_seq(partition.properties.identifier)
+            rows = list(partition["Log"].iter_rows(min_row=2, max_col=4, values_only=True))
+            partition.close()
+            rows.reverse()
+            for date, amount, category, description in rows:
+                yield (date, amount, category, description, None)
+
+    # Log years from the manifest, without opening a partition.
+    def log_years(self):
+        if (self.manifest == None):
+            return []
+        return sorted(int(year) for year in self.manifest["years"])
+
+    # The journal seq a year was last written at. Years without a partition file
+    # were either empty or never written, as of the manifest.
+    def base_seq(self, year):
+        return self.partitionSeqs.get(year, self.manifestSeq)
+
+    # Changes that were journaled but never compacted, e.g. after a crash, as
+    # (oldValues, newValues) pairs. Each side is only replayed if it's newer than
+    # its year's partition, so an edit that moved a transaction between two years
+    # is right even when only one of them was written before the crash.
+    def pending_changes(self):
+        seqs = list(self.partitionSeqs.values()) + [self.manifestSeq]
+        changes = []
+        for record in self.journal.read(min(seqs)):
+            oldValues = None
+            newValues = None
+            if ("old" in record):
+                values = self.journal.decode(record["old"])
+                if (record["seq"] > self.base_seq(values[0].year)):
+                    oldValues = values
+                    self.dirtyYears.add(values[0].year)
+            if ("new" in record):
+                values = self.journal.decode(record["new"])
+                if (record["seq"] > self.base_seq(values[0].year)):
+                    newValues = values
+                    self.dirtyYears.add(values[0].year)
+            if (oldValues != None or newValues != None):
+                changes.append((oldValues, newValues))
+        # New records must come after every partition, even with the journal gone.
+        self.journal.seq = max([self.journal.seq] + seqs)
+        return changes
+
+    # dirtyYears is read and set on the UI thread, the journal is only touched by
+    # the persistence thread.
+    def add(self, transaction):
+        self.journal.append("add", new=transaction, sync=self.batchDepth == 0)
+
+    def edit(self, oldTransaction, newTransaction):
+        self.journal.append("edit", old=oldTransaction, new=newTransaction, sync=self.batchDepth == 0)
+
+    def delete(self, oldTransaction):
+        self.journal.append("delete", old=oldTransaction, sync=self.batchDepth == 0)
+
+    def add_many(self, transactions):
+        self.begin_batch()
+        for transaction in transactions:
+            self.add(transaction)
+        self.end_batch()
+
+    def edit_many(self, oldTransactions, newTransactions):
+        self.begin_batch()
+        for i in range(len(oldTransactions)):
+            self.edit(oldTransactions[i], newTransactions[i])
+        self.end_batch()
+
+    def mark_dirty(self, years):
+        self.dirtyYears.update(years)
+
+    # Rows keep the name they were written with; the registry's aliases map them on
+    # load until the next compaction writes the current name.
+    def rename_category(self, oldName, newName):
+        return
+
+    def merge_category(self, source, target):
+        return
+
+    # Records written in a batch share one fsync at the end.
+    def begin_batch(self):
+        self.batchDepth = self.batchDepth + 1
+
+    def end_batch(self):
+        self.batchDepth = self.batchDepth - 1
+        if (self.batchDepth == 0):
+            self.journal.sync()
+
+    # Snapshots the changed years of the in-memory log and has the persistence
+    # thread write their partitions, after which the journal is no longer needed.
+    # The first compaction of a workbook from before partitions writes every year.
+    def compact(self, log):
+        if (self.chartsDirty):
+            self.chartsDirty = False
+            self.excelMan.save()
+        years = set(self.dirtyYears)
+        if (self.manifest == None):
+            years.update(log.get_years())
+            self.manifest = {"seq": self.manifestSeq, "years": {}}
+        if (len(years) == 0):
+            return
+        self.dirtyYears = set()
+
+        partitions = []
+        for year in sorted(years):
+            transactions = log.get_transactions(datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1))
+            transactions.reverse()
+            partitions.append((year, transactions))
+        self.excelMan.snapshot.valid = False
+        self.excelMan.persistence.submit(self.write_partitions, partitions, dict(log.transactionIndex.yearCounts),
+                                         done=lambda error: self.compacted(error, years))
+
+    # Runs on the persistence thread, behind every journal record submitted before
+    # the snapshot was taken. Partitions go first and the manifest after, so a crash
+    # in between leaves each partition tagged with the seq it was written at.
+    def write_partitions(self, partitions, yearCounts):
+        seq = self.journal.seq
+        for year, transactions in partitions:
+            if (len(transactions) > 0):
+                self.excelMan.write_partition(year, transactions, "journal:" + str(seq))
+
+        years = {}
+        for year in sorted(yearCounts):
+            years[str(year)] = {"rows": yearCounts[year]}
+        self.excelMan.write_manifest({"seq": seq, "years": years})
+        for year, transactions in partitions:
+            if (len(transactions) == 0):
+                self.excelMan.remove_partition(year)
+        if (self.journal.seq == seq):
+            self.journal.clear()
+
+    def compacted(self, error, years):
+        if (error != None):
+            self.dirtyYears.update(years)
+        else:
+            self.partitioned()
+
+    # Once the partitions are on disk, Tracker.xlsx's Log sheet is an old copy, so
+    # it's left out of every save from then on; only an export writes it again.
+    def partitioned(self):
+        if ("Log" in self.excelMan.sourceNames):
+            self.excelMan.sourceNames.remove("Log")
+
+    def chart_years(self):
+        years = []
+        for sheetName in self.excelMan.sheet_names():
+            if (sheetName != "Log"):
+                years.append(sheetName)
+        return years
+
+    # A deferred save waits for the next compaction, on a timer and on exit, rather
+    # than rewriting Tracker.xlsx per change; it's for cells refilled from the log,
+    # which are rebuilt on the next start if they never get written.
+    def save_chart(self, sheetName, deferred = False):
+        if (deferred):
+            self.chartsDirty = True
+            return
+        self.excelMan.save()
+
+    def close(self):
+        self.journal.close()
+        if (self.excelMan.readBook != None):
+            self.excelMan.readBook.close()
+
+
+# SQLite as the database, in Tracker.db next to Tracker.xlsx. Transactions are rows
+# indexed on date and category; every change is its own transaction unless it's
+# made between begin_batch and end_batch, which commit together. Year chart sheets
+# are kept cell by cell and rebuilt into the in-memory workbook on open.
+#
+# A transaction's category is a code into the categories table, so a rename is an
+# update of one categories row and a merge one update of the merged rows' codes.
+# A database from before codes has its text categories moved over when it's opened.
+#
+# The first time the database is opened next to an existing Tracker.xlsx, the
+# workbook is imported into it. After that the xlsx is only written by an export.
+class Sqlite_Storage:
+    excelMan = None
+    path = None
+    connection = None
+    batchDepth = 0
+    dirty = False
+    categoryCodes = {}
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS categories (
+            code INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            category INTEGER REFERENCES categories (code),
+            description TEXT
+        );
+        CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date, id);
+        CREATE INDEX IF NOT EXISTS transactions_category ON transactions (category, date);
+
+        CREATE TABLE IF NOT EXISTS charts (
+            name TEXT PRIMARY KEY,
+            merges TEXT NOT NULL DEFAULT '[]'
+        );
+        CREATE TABLE IF NOT EXISTS chart_cells (
+            name TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            col INTEGER NOT NULL,
+            value,
+            PRIMARY KEY (name, row, col)
+        );
+    """
+
+    def __init__(self, excelMan):
+        self.excelMan = excelMan
+        self.path = os.path.splitext(excelMan.path)[0] + ".db"
+        self.batchDepth = 0
+
+        newDatabase = not os.path.exists(self.path)
+        # Opened here but written from the persistence thread.
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.schema)
+        self.migrate_categories()
+        self.categoryCodes = {}
+        for code, name in self.connection.execute("SELECT code, name FROM categories"):
+            self.categoryCodes[name] = code
+
+        if (newDatabase and os.path.exists(excelMan.path)):
+            importBook = opxl.load_workbook(excelMan.path, read_only=True)
+            self.import_xlsx(importBook)
+            importBook.close()
+        self.load_charts()
+
+    def read_rows(self):
+        return self.connection.execute("SELECT t.date, t.amount, c.name, t.description, t.id FROM transactions t "
+                                       "LEFT JOIN categories c ON c.code = t.category ORDER BY t.date, t.id")
+
+    # Moves a transactions table with text categories onto codes, in one transaction.
+    def migrate_categories(self):
+        columns = {}
+        for column in self.connection.execute("PRAGMA table_info(transactions)"):
+            columns[column[1]] = column[2]
+        if (columns["category"].upper() != "TEXT"):
+            return
+        self.connection.executescript("""
+            BEGIN;
+            INSERT OR IGNORE INTO categories (name) SELECT DISTINCT category FROM transactions WHERE category IS NOT NULL;
+            CREATE TABLE transactions_codes (
+                id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                amount REAL NOT NULL,
+                category INTEGER REFERENCES categories (code),
+                description TEXT
+            );
+            INSERT INTO transactions_codes (id, date, amount, category, description)
+                SELECT t.id, t.date, t.amount, c.code, t.description FROM transactions t LEFT JOIN categories c ON c.name = t.category;
+            DROP TABLE transactions;
+            ALTER TABLE transactions_codes RENAME TO transactions;
+            COMMIT;
+        """)
+        self.connection.executescript(self.schema)
+
+    # The code for a category name, new names get a categories row.
+    def category_code(self, name):
+        if (name == None):
+            return None
+        code = self.categoryCodes.get(name)
+        if (code == None):
+            code = self.connection.execute("INSERT INTO categories (name) VALUES (?)", (name,)).lastrowid
+            self.categoryCodes[name] = code
+        return code
+
+    # Run on the persistence thread like every other write, after the changes
+    # submitted before them.
+    def rename_category(self, oldName, newName):
+        code = self.categoryCodes.pop(oldName, None)
+        if (code == None):
+            return
+        if (newName in self.categoryCodes):
+            self.move_category(code, self.categoryCodes[newName])
+        else:
+            self.connection.execute("UPDATE categories SET name = ? WHERE code = ?", (newName, code))
+            self.categoryCodes[newName] = code
+        self.commit()
+
+    def merge_category(self, source, target):
+        code = self.categoryCodes.pop(source, None)
+        if (code == None):
+            return
+        self.move_category(code, self.category_code(target))
+        self.commit()
+
+    def move_category(self, code, newCode):
+        self.connection.execute("UPDATE transactions SET category = ? WHERE category = ?", (newCode, code))
+        self.connection.execute("DELETE FROM categories WHERE code = ?", (code,))
+
+    def pending_changes(self):
+        return []
+
+    def commit(self):
+        if (self.batchDepth == 0):
+            self.connection.commit()
+
+    def begin_batch(self):
+        self.batchDepth = self.batchDepth + 1
+
+    def end_batch(self):
+        self.batchDepth = self.batchDepth - 1
+        self.commit()
+
+    def add(self, transaction):
+        cursor = self.connection.execute("INSERT INTO transactions (date, amount, category, description) VALUES (?, ?, ?, ?)",
+                                         (transaction.date.isoformat(" "), transaction.amount, self.category_code(transaction.category), transaction.description))
+        transaction.storageId = cursor.lastrowid
+        self.commit()
+
+    def add_many(self, transactions):
+        self.begin_batch()
+        for transaction in transactions:
+            self.add(transaction)
+        self.end_batch()
+
+    def edit(self, oldTransaction, newTransaction):
+        self.connection.execute("UPDATE transactions SET date = ?, amount = ?, category = ?, description = ? WHERE id = ?",
+                                (newTransaction.date.isoformat(" "), newTransaction.amount, self.category_code(newTransaction.category), newTransaction.description,
+                                 oldTransaction.storageId))
+        newTransaction.storageId = oldTransaction.storageId
+        self.commit()
+
+    def edit_many(self, oldTransactions, newTransactions):
+        self.begin_batch()
+        for i in range(len(oldTransactions)):
+            self.edit(oldTransactions[i], newTransactions[i])
+        self.end_batch()
+
+    def delete(self, oldTransaction):
+        self.connection.execute("DELETE FROM transactions WHERE id = ?", (oldTransaction.storageId,))
+        self.commit()
+
+    # Every burst on the persistence thread already ends in a commit.
+    def compact(self, log):
+        return
+
+    def mark_dirty(self, years):
+        return
+
+    def chart_years(self):
+        years = []
+        for (name,) in self.connection.execute("SELECT name FROM charts ORDER BY name"):
+            years.append(name)
+        return years
+
+    # One lookup on the date index per year instead of a scan of the table.
+    def log_years(self):
+        years = []
+        (date,) = self.connection.execute("SELECT MIN(date) FROM transactions").fetchone()
+        while (date != None):
+            years.append(int(date[:4]))
+            (date,) = self.connection.execute("SELECT MIN(date) FROM transactions WHERE date >= ?", (str(years[-1] + 1),)).fetchone()
+        return years
+
+    def write_chart(self, name, rows, merges):
+        self.connection.execute("INSERT OR REPLACE INTO charts (name, merges) VALUES (?, ?)", (name, json.dumps(merges)))
+        self.connection.execute("DELETE FROM chart_cells WHERE name = ?", (name,))
+
+        cells = []
+        row = 1
+        for values in rows:
+            for col in range(len(values)):
+                if (values[col] != None):
+                    cells.append((name, row, col + 1, values[col]))
+            row = row + 1
+        self.connection.executemany("INSERT INTO chart_cells (name, row, col, value) VALUES (?, ?, ?, ?)", cells)
+        self.commit()
+
+    # Only the one sheet is written, so deferred saves go out straight away too.
+    def save_chart(self, sheetName, deferred = False):
+        sheet = self.excelMan.workbook[sheetName]
+        self.excelMan.persistence.submit(self.write_chart, sheetName, list(sheet.iter_rows(min_row=1, values_only=True)), sheet_merges(sheet),
+                                         key="chart:" + sheetName)
+
+    def load_charts(self):
+        for name, merges in self.connection.execute("SELECT name, merges FROM charts ORDER BY name"):
+            sheet = self.excelMan.workbook.create_sheet(name)
+            for row, col, value in self.connection.execute("SELECT row, col, value FROM chart_cells WHERE name = ?", (name,)):
+                sheet.cell(row=row, column=col, value=value)
+            for mergedRange in json.loads(merges):
+                sheet.merge_cells(mergedRange)
+
+    # Migration from a workbook: the Log sheet becomes the transactions table and
+    # every other sheet a chart, all in one transaction.
+    def import_xlsx(self, workbook):
+        self.begin_batch()
+        if ("Log" in workbook.sheetnames):
+            rows = []
+            for date, amount, category, description in workbook["Log"].iter_rows(min_row=2, max_col=4, values_only=True):
+                if (date == None):
+                    continue
+                rows.append((gf.to_datetime(date).isoformat(" "), amount, self.category_code(category), description))
+            # Newest first in the sheet, inserted oldest first so ids keep tie order.
+            rows.reverse()
+            self.connection.executemany("INSERT INTO transactions (date, amount, category, description) VALUES (?, ?, ?, ?)", rows)
+        for sheetName in workbook.sheetnames:
+            if (sheetName != "Log"):
+                sheet = workbook[sheetName]
+                self.write_chart(sheetName, sheet.iter_rows(min_row=1, values_only=True), sheet_merges(sheet))
+        self.end_batch()
+
+    def close(self):
+        self.connection.close()
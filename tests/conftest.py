@@ -0,0 +1,63 @@
+import os
+import sys
+import shutil
+import datetime
+import pytest
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoDir)
+
+import global_func as gf
+import categories
+from excel_manager import Excel_Manager
+from log import Log
+
+
+# A copy of the sample Tracker.xlsx and json-dump.json in a temporary directory,
+# with the settings and the category registry pointed at it. Every test gets its
+# own, so nothing it writes reaches the repo's files.
+@pytest.fixture
+def tracker(tmp_path, monkeypatch):
+    shutil.copy(os.path.join(repoDir, "Tracker.xlsx"), tmp_path / "Tracker.xlsx")
+    shutil.copy(os.path.join(repoDir, "json-dump.json"), tmp_path / "json-dump.json")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gf, "settingsPath", str(tmp_path / "json-dump.json"))
+    gf.load_settings()
+    gf.saveInfo["Storage"] = "xlsx"
+    gf.save_settings()
+    monkeypatch.setattr(categories, "registry", categories.Category_Registry())
+    return tmp_path
+
+
+def set_storage(storageType):
+    gf.saveInfo["Storage"] = storageType
+    gf.save_settings()
+    gf.load_settings()
+
+
+# Loads the tracker the way the app does on start, settings and categories included.
+def open_tracker(tracker):
+    gf.load_settings()
+    categories.registry = categories.Category_Registry()
+    excelMan = Excel_Manager(str(tracker / "Tracker.xlsx"))
+    return excelMan, Log(excelMan)
+
+
+# Waits for the writes and closes the files. Without compact the journal is left
+# behind, as after a crash.
+def close_tracker(excelMan, log, compact = True):
+    if (compact):
+        log.compact()
+    excelMan.persistence.close()
+    excelMan.storage.close()
+
+
+# An add this year, one from years before the log's first, an edit that moves a
+# transaction a month on and a delete, for the checks to go over.
+def change_log(excelMan, log):
+    transactions = log.transactionIndex.transactions
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 2, 14), -60.0, "Dining", "Check add")
+    log.log_transaction(excelMan.path, datetime.datetime(2019, 5, 1), -5.0, "Misc", "Before the trees")
+    edited = transactions[3]
+    log.edit_transaction(excelMan.path, edited.date + datetime.timedelta(days=40), edited.amount, edited.category, edited.description, edited)
+    log.delete_transaction(transactions[5])
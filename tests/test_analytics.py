@@ -0,0 +1,21 @@
+import datetime
+from conftest import open_tracker, close_tracker, change_log
+
+
+def test_rolling_analytics_check(tracker):
+    excelMan, log = open_tracker(tracker)
+    # Stale before the first query: check builds the trees rather than passing.
+    assert log.analytics.stale
+    assert log.analytics.check() == []
+    change_log(excelMan, log)
+    log.split_category("Groceries", "Check Split", "a")
+    assert log.analytics.check() == []
+
+    analytics = log.analytics
+    if (analytics.stale):
+        analytics.rebuild()
+    day = datetime.date(2026, 2, 14).toordinal() - analytics.firstDay
+    analytics.trees[1, day + 1] = analytics.trees[1, day + 1] + 7
+    mismatches = analytics.check()
+    assert (1, datetime.date(2026, 2, 14)) in mismatches
+    close_tracker(excelMan, log)
@@ -0,0 +1,27 @@
+import os
+from conftest import open_tracker, close_tracker
+
+
+def backups(tracker):
+    backupDir = tracker / "Tracker Backups"
+    if (not backupDir.exists()):
+        return []
+    return sorted(os.listdir(backupDir))
+
+
+# Saving again in the same session doesn't rotate the backups; the next session's
+# first save does.
+def test_backups_rotate_once_per_session(tracker):
+    excelMan, log = open_tracker(tracker)
+    for i in range(3):
+        excelMan.save()
+        excelMan.persistence.flush()
+    assert backups(tracker) == ["Tracker.1.xlsx"]
+    close_tracker(excelMan, log, compact=False)
+
+    excelMan, log = open_tracker(tracker)
+    excelMan.save()
+    excelMan.persistence.flush()
+    excelMan.save()
+    close_tracker(excelMan, log, compact=False)
+    assert backups(tracker) == ["Tracker.1.xlsx", "Tracker.2.xlsx"]
@@ -0,0 +1,20 @@
+import datetime
+from batch import Batch_Run
+from year_chart import Year_Chart
+
+
+def test_batch_chart_check(tracker):
+    batch = Batch_Run(str(tracker / "Tracker.xlsx"))
+    batch.run([("charts", []), ("check", [])])
+    assert batch.problems == []
+
+    batch.problems = []
+    yearChart = Year_Chart(excelManager=batch.excelMan, log=batch.log, year=datetime.date.today().year)
+    yearChart.yearSheet = batch.excelMan.get_sheet(str(yearChart.year))
+    for row, name, out in yearChart.category_rows()["categories"]:
+        if (name == "Groceries"):
+            # January's Actual column.
+            yearChart.yearSheet.cell(row=row, column=3, value=12345)
+    batch.run_check()
+    assert any("Groceries January" in problem for problem in batch.problems)
+    batch.finish()
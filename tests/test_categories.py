@@ -0,0 +1,77 @@
+import sqlite3
+import datetime
+import pytest
+import global_func as gf
+import categories
+from conftest import open_tracker, close_tracker, set_storage
+
+
+def count(log, name):
+    return sum(1 for transaction in log.transactionIndex.transactions if transaction.category == name)
+
+
+def test_registry_rename_and_readd(tracker):
+    registry = categories.registry
+    oldCode = registry.code("Dining")
+    registry.rename("Dining", "Eating Out")
+    assert registry.resolve("Dining") == "Eating Out"
+    assert registry.aliases() == {"Dining": "Eating Out"}
+
+    assert registry.free("Dining") == oldCode
+    newCode = registry.code("Dining")
+    assert newCode != oldCode
+    assert registry.name(newCode) == "Dining"
+    assert registry.name(oldCode) == "Eating Out"
+    assert registry.aliases() == {}
+
+
+def test_registry_refuses_rename_onto_category(tracker):
+    registry = categories.registry
+    with pytest.raises(ValueError):
+        registry.rename("Dining", "Groceries")
+    assert registry.resolve("Dining") == "Dining"
+    assert registry.resolve("Groceries") == "Groceries"
+
+
+# Renaming a category and then adding one with its old name keeps the renamed
+# transactions where they were, in memory and after a reload, with either storage.
+@pytest.mark.parametrize("storageType", ["xlsx", "sqlite"])
+def test_readd_after_rename(tracker, storageType):
+    set_storage(storageType)
+    excelMan, log = open_tracker(tracker)
+    dining = count(log, "Dining")
+    assert dining > 0
+    log.rename_category("Dining", "Eating Out")
+    categories.update_settings("Dining", "Eating Out", "rename")
+    close_tracker(excelMan, log, compact=False)
+
+    excelMan, log = open_tracker(tracker)
+    assert count(log, "Eating Out") == dining
+    gf.categoriesOut.append("Dining")
+    log.add_category("Dining")
+    categories.update_settings("Dining", "Dining", "add")
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 3, 3), -20.0, "Dining", "New dining")
+    assert count(log, "Eating Out") == dining
+    assert count(log, "Dining") == 1
+    close_tracker(excelMan, log)
+
+    excelMan, log = open_tracker(tracker)
+    assert count(log, "Eating Out") == dining
+    assert count(log, "Dining") == 1
+    assert gf.saveInfo["Category Aliases"] == {}
+    close_tracker(excelMan, log)
+
+
+def test_sqlite_migrates_text_categories(tracker):
+    set_storage("sqlite")
+    connection = sqlite3.connect(str(tracker / "Tracker.db"))
+    connection.executescript("CREATE TABLE transactions (id INTEGER PRIMARY KEY, date TEXT NOT NULL, amount REAL NOT NULL, category TEXT, description TEXT);")
+    connection.execute("INSERT INTO transactions (date, amount, category, description) VALUES ('2026-01-02 00:00:00', -5.0, 'Dining', 'Old row')")
+    connection.commit()
+    connection.close()
+
+    excelMan, log = open_tracker(tracker)
+    assert [transaction.category for transaction in log.transactionIndex.transactions] == ["Dining"]
+    (categoryType,) = excelMan.storage.connection.execute("SELECT typeof(category) FROM transactions").fetchone()
+    assert categoryType == "integer"
+    close_tracker(excelMan, log)
@@ -0,0 +1,31 @@
+import os
+import datetime
+from conftest import open_tracker, close_tracker
+from year_chart import fill_year_charts, update_year_charts
+
+
+def refresh_actuals(excelMan, log):
+    def listener(oldTransaction, newTransaction):
+        for transaction in (oldTransaction, newTransaction):
+            if (transaction != None):
+                update_year_charts(excelMan, log, transaction, save=True)
+    log.changeListeners.append(listener)
+
+
+# With xlsx, refreshing the Actual cells after an add doesn't rewrite Tracker.xlsx;
+# the chart goes out with the next compaction.
+def test_actual_refresh_waits_for_compaction(tracker):
+    excelMan, log = open_tracker(tracker)
+    fill_year_charts(excelMan, log)
+    refresh_actuals(excelMan, log)
+    excelMan.get_sheet(str(datetime.date.today().year))
+    before = os.stat(tracker / "Tracker.xlsx").st_mtime_ns
+
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 2, 14), -60.0, "Dining", "Chart add")
+    excelMan.persistence.flush()
+    assert os.stat(tracker / "Tracker.xlsx").st_mtime_ns == before
+
+    log.compact()
+    excelMan.persistence.flush()
+    assert os.stat(tracker / "Tracker.xlsx").st_mtime_ns != before
+    close_tracker(excelMan, log)
@@ -0,0 +1,29 @@
+import datetime
+import openpyxl as opxl
+from conftest import open_tracker, close_tracker
+from log import Transaction
+
+
+# A Log row with a blank amount loads and can be deleted; it adds nothing to the
+# totals and is never flagged as a duplicate.
+def test_blank_amount_loads(tracker):
+    workbook = opxl.load_workbook(tracker / "Tracker.xlsx")
+    workbook["Log"].insert_rows(2)
+    workbook["Log"].cell(row=2, column=1, value=datetime.datetime(2026, 1, 3))
+    workbook["Log"].cell(row=2, column=3, value="Misc")
+    workbook["Log"].cell(row=2, column=4, value="No amount")
+    workbook.save(tracker / "Tracker.xlsx")
+
+    excelMan, log = open_tracker(tracker)
+    blank = [transaction for transaction in log.transactionIndex.transactions if transaction.amount == None]
+    assert len(blank) == 1
+    assert log.duplicates.matches(blank[0]) == ([], [])
+    assert log.runningTotals.check(log) == []
+    assert log.analytics.check() == []
+    log.delete_transaction(blank[0])
+    assert log.runningTotals.check(log) == []
+
+    repeat = Transaction(*log.transactionIndex.transactions[0].values())
+    exactMatches, nearMatches = log.duplicates.matches(repeat)
+    assert len(exactMatches) == 1
+    close_tracker(excelMan, log)
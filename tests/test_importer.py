@@ -0,0 +1,57 @@
+from importer import Statement_Importer
+from conftest import open_tracker, close_tracker
+
+
+def write_file(tracker, name, text):
+    path = tracker / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def read(path):
+    importer = Statement_Importer()
+    transactions = importer.read_transactions(path)
+    return [(transaction.amount, transaction.description) for transaction in transactions], importer.unreadRows
+
+
+def test_debit_credit_unreadable_value(tracker):
+    path = write_file(tracker, "statement.csv", "Date,Description,Debit,Credit\n"
+                                                 "2026-01-05,Kroger,12.50,\n"
+                                                 "2026-01-06,Pending,n/a,\n"
+                                                 "2026-01-07,Paycheck,,100.00\n")
+    assert read(path) == ([(-12.5, "Kroger"), (100.0, "Paycheck")], 1)
+
+
+def test_debit_credit_both_blank(tracker):
+    path = write_file(tracker, "statement.csv", "Date,Description,Debit,Credit\n"
+                                                 "2026-01-05,Kroger,12.50,\n"
+                                                 "2026-01-06,Nothing,,\n")
+    assert read(path) == ([(-12.5, "Kroger")], 1)
+
+
+def test_short_rows(tracker):
+    path = write_file(tracker, "statement.csv", "Date,Amount,Description\n"
+                                                 "2026-01-05,-12.50,Kroger\n"
+                                                 "2026-01-06\n"
+                                                 "2026-01-07,-3.00\n")
+    assert read(path) == ([(-12.5, "Kroger"), (-3.0, "")], 1)
+
+
+def test_ofx_blank_and_unreadable_amounts(tracker):
+    path = write_file(tracker, "statement.ofx", "<OFX><STMTTRN><DTPOSTED>20260105<TRNAMT>-12.50<NAME>Kroger</STMTTRN>"
+                                                 "<STMTTRN><DTPOSTED>20260106<TRNAMT><NAME>Blank</STMTTRN>"
+                                                 "<STMTTRN><DTPOSTED>20260107<TRNAMT>abc<NAME>Junk</STMTTRN></OFX>\n")
+    assert read(path) == ([(-12.5, "Kroger")], 2)
+
+
+# The skipped rows are in the stats and the readable ones still go into the log.
+def test_import_counts_unread(tracker):
+    path = write_file(tracker, "statement.csv", "Date,Description,Debit,Credit\n"
+                                                 "2026-01-05,New payee,12.50,\n"
+                                                 "2026-01-06,Pending,n/a,\n")
+    excelMan, log = open_tracker(tracker)
+    before = len(log.transactionIndex)
+    stats = Statement_Importer().import_file(log, path)
+    assert stats["rows"] == 1 and stats["unread"] == 1
+    assert len(log.transactionIndex) == before + 1
+    close_tracker(excelMan, log)
@@ -0,0 +1,73 @@
+import datetime
+from conftest import open_tracker, close_tracker
+
+
+def log_values(log):
+    return sorted((transaction.date, transaction.amount, transaction.category, transaction.description)
+                  for transaction in log.transactionIndex.transactions)
+
+
+# Changes that were journaled but never compacted come back on the next load.
+def test_replay_after_crash(tracker):
+    excelMan, log = open_tracker(tracker)
+    transactions = log.transactionIndex.transactions
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 3, 3), -42.0, "Groceries", "Replay add")
+    edited = transactions[0]
+    log.edit_transaction(excelMan.path, edited.date, edited.amount + 1, edited.category, "Replay edit", edited)
+    log.delete_transaction(transactions[-1])
+    expected = log_values(log)
+    close_tracker(excelMan, log, compact=False)
+    assert (tracker / "Tracker.journal").stat().st_size > 0
+
+    excelMan, log = open_tracker(tracker)
+    assert log_values(log) == expected
+    close_tracker(excelMan, log)
+
+
+# Once compacted, the journal is cleared and the partitions hold the changes.
+def test_replay_after_compaction(tracker):
+    excelMan, log = open_tracker(tracker)
+    log.log_transaction(excelMan.path, datetime.datetime(2025, 7, 1), 15.0, "Paychecks", "Compacted add")
+    expected = log_values(log)
+    close_tracker(excelMan, log)
+    assert (tracker / "Tracker Log" / "manifest.json").exists()
+
+    excelMan, log = open_tracker(tracker)
+    assert log_values(log) == expected
+    assert list(excelMan.storage.pending_changes()) == []
+    close_tracker(excelMan, log)
+
+
+# A torn last record from a crash mid-write is ignored; the ones before it replay.
+def test_replay_ignores_torn_record(tracker):
+    excelMan, log = open_tracker(tracker)
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 1, 9), -3.5, "Misc", "Before the tear")
+    expected = log_values(log)
+    close_tracker(excelMan, log, compact=False)
+    with open(tracker / "Tracker.journal", "a", encoding="utf-8") as journalFile:
+        journalFile.write('{"seq": 99, "op": "add", "new": {"date": "2026-01-')
+
+    excelMan, log = open_tracker(tracker)
+    assert log_values(log) == expected
+    close_tracker(excelMan, log)
+
+
+# A record appended after a torn one starts its own line, so it replays after a
+# second crash along with the ones before the tear.
+def test_append_after_torn_record(tracker):
+    excelMan, log = open_tracker(tracker)
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 1, 9), -3.5, "Misc", "Before the tear")
+    close_tracker(excelMan, log, compact=False)
+    with open(tracker / "Tracker.journal", "a", encoding="utf-8") as journalFile:
+        journalFile.write('{"seq": 99, "op": "add", "new": {"date": "2026-01-')
+
+    excelMan, log = open_tracker(tracker)
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 1, 10), -4.5, "Misc", "After the tear")
+    expected = log_values(log)
+    close_tracker(excelMan, log, compact=False)
+
+    excelMan, log = open_tracker(tracker)
+    assert log_values(log) == expected
+    descriptions = [transaction.description for transaction in log.transactionIndex.transactions]
+    assert "Before the tear" in descriptions and "After the tear" in descriptions
+    close_tracker(excelMan, log)
@@ -0,0 +1,16 @@
+import instrument
+from conftest import open_tracker, close_tracker
+
+
+def test_load_summary(tracker, monkeypatch):
+    excelMan, log = open_tracker(tracker)
+    assert log.load_summary().startswith("Loaded " + str(len(log.transactionIndex)) + " transactions in ")
+    assert "KB" not in log.load_summary()
+    close_tracker(excelMan, log)
+
+    monkeypatch.setattr(instrument, "enabled", True)
+    excelMan, log = open_tracker(tracker)
+    assert log.loadStats["bytes"] > 0
+    assert log.load_summary().endswith(" KB")
+    assert instrument.stats()["counters"]["Log bytes"] >= log.loadStats["bytes"]
+    close_tracker(excelMan, log)
@@ -0,0 +1,42 @@
+import datetime
+import openpyxl as opxl
+from conftest import open_tracker, close_tracker
+
+
+def workbook_sheets(tracker):
+    workbook = opxl.load_workbook(tracker / "Tracker.xlsx", read_only=True)
+    sheetNames = list(workbook.sheetnames)
+    workbook.close()
+    return sheetNames
+
+
+# Once the log is in partitions, saving a chart leaves the old Log sheet out of
+# Tracker.xlsx, in the session that partitioned it and after a restart.
+def test_chart_save_drops_log_sheet(tracker):
+    assert "Log" in workbook_sheets(tracker)
+    excelMan, log = open_tracker(tracker)
+    log.compact()
+    excelMan.persistence.flush()
+    excelMan.save()
+    excelMan.persistence.flush()
+    assert "Log" not in workbook_sheets(tracker)
+    close_tracker(excelMan, log)
+
+    excelMan, log = open_tracker(tracker)
+    log.log_transaction(excelMan.path, datetime.datetime(2026, 2, 14), -60.0, "Dining", "Partition add")
+    excelMan.save()
+    close_tracker(excelMan, log)
+    assert "Log" not in workbook_sheets(tracker)
+    assert any(sheetName.isdigit() for sheetName in workbook_sheets(tracker))
+
+
+# An export still writes the whole log as a Log sheet.
+def test_export_writes_log_sheet(tracker):
+    excelMan, log = open_tracker(tracker)
+    log.compact()
+    excelMan.persistence.flush()
+    excelMan.export_xlsx(str(tracker / "Export.xlsx"), log)
+    close_tracker(excelMan, log)
+    workbook = opxl.load_workbook(tracker / "Export.xlsx", read_only=True)
+    assert workbook["Log"].max_row == len(log.transactionIndex) + 1
+    workbook.close()
@@ -0,0 +1,15 @@
+import pytest
+from conftest import open_tracker, close_tracker, set_storage, change_log
+
+
+@pytest.mark.parametrize("storageType", ["xlsx", "sqlite"])
+def test_running_totals_check(tracker, storageType):
+    set_storage(storageType)
+    excelMan, log = open_tracker(tracker)
+    change_log(excelMan, log)
+    assert log.runningTotals.check(log) == []
+
+    key = next(iter(log.runningTotals.categorySums))
+    log.runningTotals.categorySums[key] = log.runningTotals.categorySums[key] + 10
+    assert key in log.runningTotals.check(log)
+    close_tracker(excelMan, log)
@@ -0,0 +1,198 @@
+from tkinter import ttk
+import instrument
+
+# A Treeview that only holds the rows currently on screen. Rows are pulled from
+# fetchRows(start, stop) as (key, values) pairs as the view scrolls, and a buffer of
+# rows on either side of the window is cached so small scrolls don't go back to the
+# source. The scrollbar is driven from the row count, not from the items Tk holds.
+#
+# Keys become the Treeview item ids, so a redraw only inserts, moves, updates or
+# removes the items whose rows actually changed, and the selection follows the row
+# rather than its place on screen.
+class Virtual_View(ttk.Treeview):
+    rowCount = None
+    fetchRows = None
+    scrollCommand = None
+
+    first = 0
+    visibleRows = 0
+    bufferRows = 50
+    cacheStart = 0
+    cacheStop = 0
+    cacheRows = []
+    shownValues = {}
+    selectedKeys = set()
+
+    def __init__(self, window, rowCount, fetchRows, height, **options):
+        ttk.Treeview.__init__(self, window, height=height, **options)
+        self.rowCount = rowCount
+        self.fetchRows = fetchRows
+        self.scrollCommand = None
+        self.first = 0
+        self.visibleRows = height
+        self.cacheStart = 0
+        self.cacheStop = 0
+        self.cacheRows = []
+        self.shownValues = {}
+        self.selectedKeys = set()
+
+        self.bind("<<TreeviewSelect>>", self.on_select)
+        self.bind("<MouseWheel>", self.on_wheel)
+        self.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+        self.bind("<Button-5>", lambda event: self.scroll_rows(3))
+        self.bind("<Up>", lambda event: self.on_arrow(-1))
+        self.bind("<Down>", lambda event: self.on_arrow(1))
+        self.bind("<Prior>", lambda event: self.scroll_rows(-self.visibleRows))
+        self.bind("<Next>", lambda event: self.scroll_rows(self.visibleRows))
+
+        self.render()
+
+    # yscrollcommand is kept here instead of being handed to Tk, which would only
+    # report the handful of rows it holds.
+    def configure(self, cnf = None, **options):
+        if (cnf != None):
+            options.update(cnf)
+        if ("yscrollcommand" in options):
+            self.scrollCommand = options.pop("yscrollcommand")
+            self.update_scrollbar()
+            if (len(options) == 0):
+                return None
+        if ("height" in options):
+            self.visibleRows = int(options["height"])
+            ttk.Treeview.configure(self, **options)
+            self.refresh()
+            return None
+        return ttk.Treeview.configure(self, **options)
+
+    config = configure
+
+    def yview(self, *args):
+        total = self.rowCount()
+        if (len(args) == 0):
+            if (total == 0):
+                return (0.0, 1.0)
+            return (self.first / total, min(total, self.first + self.visibleRows) / total)
+
+        if (args[0] == "moveto"):
+            self.scroll_to(int(float(args[1]) * total))
+        elif (args[0] == "scroll"):
+            amount = int(args[1])
+            if (args[2] == "pages"):
+                amount = amount * self.visibleRows
+            self.scroll_rows(amount)
+
+    def update_scrollbar(self):
+        if (self.scrollCommand != None):
+            start, end = self.yview()
+            self.scrollCommand(start, end)
+
+    # Selected rows that have scrolled out of the window are remembered and selected
+    # again when they come back.
+    def on_select(self, event):
+        hidden = set()
+        for key in self.selectedKeys:
+            if (key not in self.shownValues):
+                hidden.add(key)
+        self.selectedKeys = hidden | set(self.selection())
+
+    def on_wheel(self, event):
+        if (abs(event.delta) >= 120):
+            self.scroll_rows(-int(event.delta / 120) * 3)
+        else:
+            self.scroll_rows(-event.delta)
+        return "break"
+
+    # Moving the selection past the top or bottom row scrolls the window by one.
+    def on_arrow(self, direction):
+        selection = self.selection()
+        items = self.get_children()
+        if (len(selection) == 0 or len(items) == 0):
+            return None
+        if ((direction < 0 and selection[0] == items[0]) or (direction > 0 and selection[0] == items[-1])):
+            self.scroll_rows(direction)
+            return "break"
+        return None
+
+    def scroll_rows(self, amount):
+        self.scroll_to(self.first + amount)
+
+    def scroll_to(self, first):
+        first = max(0, min(first, self.rowCount() - self.visibleRows))
+        if (first != self.first):
+            self.first = first
+            self.render()
+
+    def rows(self, start, stop):
+        if (start < self.cacheStart or stop > self.cacheStop):
+            self.cacheStart = max(0, start - self.bufferRows)
+            self.cacheStop = stop + self.bufferRows
+            self.cacheRows = list(self.fetchRows(self.cacheStart, self.cacheStop))
+            instrument.count("Virtual_View rows fetched", len(self.cacheRows))
+        return self.cacheRows[start - self.cacheStart:stop - self.cacheStart]
+
+    @instrument.timed()
+    def render(self):
+        total = self.rowCount()
+        self.first = max(0, min(self.first, total - self.visibleRows))
+        rows = self.rows(self.first, min(total, self.first + self.visibleRows))
+
+        keys = set()
+        for key, values in rows:
+            keys.add(key)
+        for iid in self.get_children():
+            if (iid not in keys):
+                self.delete(iid)
+                del self.shownValues[iid]
+
+        for i in range(len(rows)):
+            key, values = rows[i]
+            if (key not in self.shownValues):
+                self.insert('', i, iid=key, values=values)
+            else:
+                if (self.index(key) != i):
+                    self.move(key, '', i)
+                if (self.shownValues[key] != values):
+                    self.item(key, values=values)
+            self.shownValues[key] = values
+
+        shownSelection = []
+        for key in self.selectedKeys:
+            if (key in keys):
+                shownSelection.append(key)
+        if (set(self.selection()) != set(shownSelection)):
+            self.selection_set(shownSelection)
+        self.update_scrollbar()
+
+    # Call after the underlying rows change; drops the cached buffer and redraws.
+    @instrument.timed()
+    def refresh(self):
+        self.cacheStart = 0
+        self.cacheStop = 0
+        self.cacheRows = []
+        self.render()
+
+    # Change notifications from the row source. Rows added or removed above the
+    # window shift it, so what's on screen stays put.
+    def insert_row(self, position):
+        if (position < self.first):
+            self.first = self.first + 1
+        self.refresh()
+
+    def remove_row(self, position):
+        if (position < self.first):
+            self.first = self.first - 1
+        self.refresh()
+
+    def move_row(self, oldPosition, newPosition):
+        if (oldPosition < self.first):
+            self.first = self.first - 1
+        if (newPosition < self.first):
+            self.first = self.first + 1
+        self.refresh()
+
+    # Row number in the source for the selected item, or None.
+    def selection_index(self):
+        selection = self.selection()
+        if (len(selection) == 0):
+            return None
+        return self.first + self.get_children().index(selection[0])
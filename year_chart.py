@@ -1,6 +1,7 @@
-import tkinter as tk
-from tkinter import ttk
+from collections import OrderedDict
 import global_func as gf
+from expectations import Expectations
+import instrument
 
 class Year_Chart:
     yearCharts = []
@@ -9,10 +10,17 @@ class Year_Chart:
     yearSheet = None
     chart = None
     excelMan = None
+    cache = None
+    chartWindow = None
+    chartGrid = None
+    scrollbars = None
 
     maxYear = None
     minYear = None
 
+    # The year's totals sit after December.
+    totalColumn = len(gf.months) * 2 + 2
+
     def __init__(self, excelManager, log, year):
         self.excelMan = excelManager
         self.log = log
@@ -29,8 +37,9 @@ class Year_Chart:
         self.yearSheet.cell(column=1, row=lastRow, value="Total")
         return lastRow + 1
     
+    @instrument.timed()
     def create_chart(self):
-        self.yearSheet = self.excelMan.workbook.create_sheet(str(self.year))
+        self.yearSheet = self.excelMan.create_sheet(str(self.year))
         for monthInt in range(1, len(gf.months)+1):
             cell = (monthInt * 2)
             self.yearSheet.merge_cells(start_row=1, start_column=cell, end_row=1, end_column=cell+1)
@@ -38,20 +47,147 @@ class Year_Chart:
             self.yearSheet.cell(row=2, column=cell, value = "Expected")
             self.yearSheet.cell(row=2, column=cell+1, value = "Actual")
             continue
+        self.add_total_column()
         lastRow = self.read_cat_list(3, "Input", gf.categoriesIn)
         lastRow = self.read_cat_list(lastRow, "Output", gf.categoriesOut)
         self.yearSheet.cell(column=1, row=lastRow, value="Overall Total")
+        self.fill_expected(Expectations().compute([self.year]))
+
+        self.excelMan.save_chart(str(self.year))
+
+    def add_total_column(self):
+        self.yearSheet.merge_cells(start_row=1, start_column=self.totalColumn, end_row=1, end_column=self.totalColumn+1)
+        self.yearSheet.cell(row=1, column=self.totalColumn, value = "Year Total")
+        self.yearSheet.cell(row=2, column=self.totalColumn, value = "Expected")
+        self.yearSheet.cell(row=2, column=self.totalColumn+1, value = "Actual")
+
+    # Finds each row by its label in column A, since sheets made before a category
+    # was added or removed don't match the current category lists.
+    def category_rows(self):
+        rows = {"categories": [], "totals": [], "overall": None}
+        out = None
+        for cells in self.yearSheet.iter_rows(min_row=3, max_col=1):
+            label = cells[0].value
+            if (label == "Input"):
+                out = False
+            elif (label == "Output"):
+                out = True
+            elif (label == "Overall Total"):
+                rows["overall"] = cells[0].row
+            elif (label == "Total" and out != None):
+                rows["totals"].append((cells[0].row, out))
+            elif (label != None and out != None):
+                rows["categories"].append((cells[0].row, label, out))
+        return rows
+
+    def write_actuals(self, row, monthValues):
+        for monthInt in range(1, len(gf.months)+1):
+            self.yearSheet.cell(row=row, column=monthInt*2+1, value=round(float(monthValues[monthInt-1]), 2))
+        self.yearSheet.cell(row=row, column=self.totalColumn+1, value=round(float(monthValues.sum()), 2))
+
+    def write_expected(self, row, monthValues):
+        for monthInt in range(1, len(gf.months)+1):
+            self.yearSheet.cell(row=row, column=monthInt*2, value=round(float(monthValues[monthInt-1]), 2))
+        self.yearSheet.cell(row=row, column=self.totalColumn, value=round(float(monthValues.sum()), 2))
+
+    # Writes the Expected columns from an Expectations.compute grid.
+    @instrument.timed()
+    def fill_expected(self, expected):
+        self.yearSheet = self.excelMan.get_sheet(str(self.year))
+        if (self.yearSheet.cell(row=1, column=self.totalColumn).value == None):
+            self.add_total_column()
+
+        rows = self.category_rows()
+        for row, name, out in rows["categories"]:
+            self.write_expected(row, expected.category_months(self.year, name, out))
+        for row, out in rows["totals"]:
+            self.write_expected(row, expected.section_months(self.year, out))
+        if (rows["overall"] != None):
+            self.write_expected(rows["overall"], expected.section_months(self.year, False) - expected.section_months(self.year, True))
 
-        self.excelMan.workbook.save("Tracker.xlsx")
+    # Writes the Actual columns of this year's sheet from a Monthly_Actuals grouping
+    # or the log's Running_Totals.
+    @instrument.timed()
+    def fill_actuals(self, actuals):
+        self.yearSheet = self.excelMan.get_sheet(str(self.year))
+        if (self.yearSheet.cell(row=1, column=self.totalColumn).value == None):
+            self.add_total_column()
 
+        rows = self.category_rows()
+        for row, name, out in rows["categories"]:
+            self.write_actuals(row, actuals.category_months(self.year, name, out))
+        for row, out in rows["totals"]:
+            self.write_actuals(row, actuals.section_months(self.year, out))
+        if (rows["overall"] != None):
+            self.write_actuals(rows["overall"], actuals.section_months(self.year, False) - actuals.section_months(self.year, True))
+
+    # Rewrites only the rows one transaction can change: its category, its section
+    # total and the overall total.
+    @instrument.timed()
+    def refresh_category(self, totals, name, out):
+        self.yearSheet = self.excelMan.get_sheet(str(self.year))
+        rows = self.category_rows()
+        for row, rowName, rowOut in rows["categories"]:
+            if (rowName == name and rowOut == out):
+                self.write_actuals(row, totals.category_months(self.year, name, out))
+        for row, rowOut in rows["totals"]:
+            if (rowOut == out):
+                self.write_actuals(row, totals.section_months(self.year, out))
+        if (rows["overall"] != None):
+            self.write_actuals(rows["overall"], totals.section_months(self.year, False) - totals.section_months(self.year, True))
+
+    # Shows this year's chart in window, through a cache of chart views that the
+    # year buttons page through.
+    @instrument.timed()
     def display_chart(self, window, row, column, columnSize, stretch):
-        yearChartDisplay = self.excelMan.make_excelView(str(self.year), window, columnSize=columnSize, stretch=stretch)
-        yearChartDisplay.grid(row = row, column = column)
-        return yearChartDisplay
+        self.cache = Year_Chart_Cache(self.excelMan, self.log, window, columnSize, stretch)
+        self.chartWindow = window
+        self.chartGrid = (row, column)
+        self.show_chart()
+        self.prefetch_neighbors()
+        return self.chart
+
+    # Swaps the shown view for the current year's, from the cache when it's there.
+    @instrument.timed()
+    def show_chart(self):
+        view = self.cache.show(self.year)
+        if (self.chart != None and self.chart is not view):
+            self.chart.grid_remove()
+        self.chart = view
+        self.chart.grid(row = self.chartGrid[0], column = self.chartGrid[1])
+        if (self.scrollbars != None):
+            self.chart.config(xscrollcommand=self.scrollbars[0].set)
+            self.chart.config(yscrollcommand=self.scrollbars[1].set)
+
+    # The scrollbars follow whichever year's view is shown.
+    def attach_scrollbars(self, hScroll, vScroll):
+        self.scrollbars = (hScroll, vScroll)
+        hScroll.config(command=lambda *args: self.chart.xview(*args))
+        vScroll.config(command=lambda *args: self.chart.yview(*args))
+        self.show_chart()
+
+    def prefetch_neighbors(self):
+        years = []
+        for year in (self.year - 1, self.year + 1):
+            if (self.excelMan.has_sheet(str(year))):
+                years.append(year)
+        self.cache.prefetch(years)
 
+    # Call after transactions in year change; None for every year.
+    def refresh_chart(self, year = None):
+        if (self.cache != None):
+            self.cache.invalidate(year)
+
+    @instrument.timed()
     def update_year(self, chartLabel):
-        if (str(self.year) not in self.excelMan.workbook.sheetnames):
+        import tkinter as tk
+        if (not self.excelMan.has_sheet(str(self.year))):
             self.create_chart()
+        if (self.cache != None):
+            self.show_chart()
+            self.prefetch_neighbors()
+        else:
+            self.fill_actuals(self.log.runningTotals)
         chartLabel.configure(textvariable=tk.StringVar(value=str(self.year)))
 
     def previous_year(self, chartLabel):
@@ -63,5 +199,174 @@ class Year_Chart:
         self.update_year(chartLabel)
 
 
-        
-        
+# LRU cache of year charts for the main window, keyed by year. Each entry holds the
+# chart's values (its sheet with the Actual columns filled, header row first) and
+# the view built on them, so paging back to a recent year only re-grids its view.
+# Changing a transaction invalidates its year's values, which are recomputed when
+# that view next draws. Years either side of the shown one are prefetched from Tk's
+# idle loop, between the user's clicks, so the next page is usually ready.
+class Year_Chart_Cache:
+    excelMan = None
+    log = None
+    window = None
+    columnSize = 75
+    stretch = 0
+    capacity = 5
+    entries = None
+    shownYear = None
+
+    def __init__(self, excelMan, log, window, columnSize, stretch, capacity = 5):
+        self.excelMan = excelMan
+        self.log = log
+        self.window = window
+        self.columnSize = columnSize
+        self.stretch = stretch
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.shownYear = None
+
+    def entry(self, year):
+        entry = self.entries.get(year)
+        if (entry == None):
+            entry = {"rows": None, "view": None}
+            self.entries[year] = entry
+        self.entries.move_to_end(year)
+        self.evict()
+        return entry
+
+    # Drops the least recently used years past capacity, never the shown one.
+    def evict(self):
+        for year in list(self.entries):
+            if (len(self.entries) <= self.capacity):
+                break
+            if (year == self.shownYear):
+                continue
+            entry = self.entries.pop(year)
+            if (entry["view"] != None):
+                entry["view"].destroy()
+
+    @instrument.timed("Year_Chart_Cache.compute")
+    def compute(self, year, entry):
+        yearChart = Year_Chart(excelManager=self.excelMan, log=self.log, year=year)
+        yearChart.fill_actuals(self.log.runningTotals)
+        entry["rows"] = list(yearChart.yearSheet.iter_rows(min_row=1, values_only=True))
+        return entry["rows"]
+
+    def rows(self, year, entry):
+        if (entry["rows"] == None):
+            return self.compute(year, entry)
+        return entry["rows"]
+
+    def view(self, year):
+        entry = self.entry(year)
+        if (entry["view"] == None):
+            rows = self.rows(year, entry)
+
+            def fetchRows(start, stop):
+                rows = self.rows(year, entry)
+                stop = min(stop, len(rows) - 1)
+                return [("row" + str(i), rows[i + 1]) for i in range(start, stop)]
+
+            entry["view"] = self.excelMan.make_listView(rows[0], lambda: len(self.rows(year, entry)) - 1, fetchRows, self.window,
+                                                        columnSize=self.columnSize, stretch=self.stretch)
+        return entry["view"]
+
+    def show(self, year):
+        self.shownYear = year
+        view = self.view(year)
+        view.refresh()
+        return view
+
+    def invalidate(self, year = None):
+        for cachedYear, entry in self.entries.items():
+            if (year == None or cachedYear == year):
+                entry["rows"] = None
+                if (cachedYear == self.shownYear and entry["view"] != None):
+                    entry["view"].refresh()
+
+    def prefetch(self, years):
+        for year in years:
+            if (year not in self.entries or self.entries[year]["view"] == None):
+                self.window.after_idle(lambda year=year: self.prefetch_year(year))
+
+    def prefetch_year(self, year):
+        # Paging may have moved on and a sheet may have been removed since it was queued.
+        if (abs(year - self.shownYear) <= 1 and self.excelMan.has_sheet(str(year))):
+            self.view(year)
+            instrument.count("Year_Chart_Cache years prefetched")
+
+
+# Fills the Actual columns of the year sheets that are loaded from the log's running
+# totals; the rest are filled when they're first shown. allSheets loads and fills
+# every one, e.g. before an export. save queues each filled sheet's save, deferred
+# to the next compaction with xlsx.
+def fill_year_charts(excelMan, log, allSheets = False, save = False):
+    sheetNames = excelMan.workbook.sheetnames
+    if (allSheets):
+        sheetNames = excelMan.sheet_names()
+    for sheetName in sheetNames:
+        if (not sheetName.isdigit()):
+            continue
+        Year_Chart(excelManager=excelMan, log=log, year=int(sheetName)).fill_actuals(log.runningTotals)
+        if (save):
+            excelMan.save_chart(sheetName, deferred=True)
+
+# Fills the Expected columns of the loaded year sheets (every sheet with allSheets)
+# from one Expectations grid over all their years, then saves them together; the
+# saves are one burst on the persistence thread.
+@instrument.timed()
+def fill_year_expectations(excelMan, allSheets = False, save = False):
+    sheetNames = excelMan.workbook.sheetnames
+    if (allSheets):
+        sheetNames = excelMan.sheet_names()
+    years = [int(sheetName) for sheetName in sheetNames if sheetName.isdigit()]
+    if (len(years) == 0):
+        return
+    expected = Expectations().compute(years)
+    for year in years:
+        Year_Chart(excelManager=excelMan, log=None, year=year).fill_expected(expected)
+    if (save):
+        for year in years:
+            excelMan.save_chart(str(year))
+
+# Updates the year sheet cells a changed transaction touches, without regrouping,
+# and with save queues the sheet's save, deferred like fill_year_charts'. Sheets that aren't loaded yet are left alone
+# until they're shown.
+def update_year_charts(excelMan, log, transaction, save = False):
+    if (str(transaction.date.year) in excelMan.workbook.sheetnames):
+        yearChart = Year_Chart(excelManager=excelMan, log=log, year=transaction.date.year)
+        yearChart.refresh_category(log.runningTotals, transaction.category, transaction.amount < 0)
+        if (save):
+            excelMan.save_chart(str(transaction.date.year), deferred=True)
+
+# Carries a category change ("rename", "merge" or "split") into every year sheet:
+# the category's rows are relabelled, removed when merged into a row the section
+# already has, or get the new category's row after them on a split. The sheets are
+# then refilled from the running totals and expectations and saved together.
+@instrument.timed()
+def update_chart_categories(excelMan, log, oldName, newName, change):
+    years = []
+    for sheetName in excelMan.sheet_names():
+        if (not sheetName.isdigit()):
+            continue
+        years.append(int(sheetName))
+        yearChart = Year_Chart(excelManager=excelMan, log=log, year=int(sheetName))
+        yearChart.yearSheet = excelMan.get_sheet(sheetName)
+        rows = yearChart.category_rows()
+        labels = set([(name, out) for row, name, out in rows["categories"]])
+        # Bottom up, so removing or inserting a row doesn't move the ones still to do.
+        for row, name, out in reversed(rows["categories"]):
+            if (name != oldName):
+                continue
+            if (change == "split"):
+                if ((newName, out) not in labels):
+                    yearChart.yearSheet.insert_rows(row + 1)
+                    yearChart.yearSheet.cell(row=row + 1, column=1, value=newName)
+            elif ((newName, out) in labels):
+                yearChart.yearSheet.delete_rows(row)
+            else:
+                yearChart.yearSheet.cell(row=row, column=1, value=newName)
+        yearChart.fill_actuals(log.runningTotals)
+    fill_year_expectations(excelMan, allSheets=True)
+    for year in years:
+        excelMan.save_chart(str(year))